@@ -1,29 +1,13 @@
 import json
 import os
-import random
-import string
-import sys
-import json
 import logging
-import pprint
-import os
-import sys
-import adal
-
-
-from requests_oauthlib import OAuth2Session
-from oauthlib.oauth2 import BackendApplicationClient
-
+import time
+import hashlib
+import threading
+import typing
+import requests
 
-## AADTokenCredentials for multi-factor authentication
-from msrestazure.azure_active_directory import AADTokenCredentials
-
-## Required for Azure Data Lake Analytics job management
-from azure.mgmt.datalake.analytics.job import DataLakeAnalyticsJobManagementClient
-from azure.mgmt.datalake.analytics.job.models import JobInformation, JobState, USqlJobProperties
-
-## Other required imports
-import adal, uuid, time
+from latigo.session import PooledSession
 
 logger = logging.getLogger(__name__)
 
@@ -38,13 +22,14 @@ def fetch_access_token(auth_config: dict):
     resource_uri = auth_config.get("resource", "https://management.core.windows.net/")
     token = None
     oathlib_token = None
+    # adal is only needed once a token is actually fetched
+    import adal
+
     try:
         context = adal.AuthenticationContext(authority=authority_uri, validate_authority=validate_authority, api_version=None)
         token = context.acquire_token_with_client_credentials(resource_uri, client_id, client_secret) or {}
         if token:
-            print("Got auth token:")
-            print(json.dumps(token, indent=2))
-            # logger.info("fetch_access_token:")
+            logger.info(f"Got auth token for {client_id} expiring in {token.get('expiresIn', 0)} seconds")
             oathlib_token = {"access_token": token.get("accessToken", ""), "refresh_token": token.get("refreshToken", ""), "token_type": token.get("tokenType", "Bearer"), "expires_in": token.get("expiresIn", 0)}
             # logger.info(pprint.pformat(token))
     except Exception as e:
@@ -58,26 +43,154 @@ def fetch_access_token(auth_config: dict):
     return oathlib_token
 
 
-def token_saver(token):
-    # logger.info("TOKEN SAVER SAVING:")
-    # logger.info(pprint.pformat(token))
-    # TODO: Find out if we really need this
-    pass
+def token_cache_key(auth_config: dict) -> str:
+    """
+    Name of the shared cache file for tokens of one auth config
+    """
+    parts = [str(auth_config.get(key)) for key in ["authority_host_url", "tenant", "client_id", "resource"]]
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()[:32]
 
 
-def create_auth_session(auth_config: dict):
-    client_id = auth_config.get("client_id")
-    client_secret = auth_config.get("client_secret")
-    authority_host_url = auth_config.get("authority_host_url")
-    tenant = auth_config.get("tenant")
-    token_url = f"{authority_host_url}/{tenant}"
-    extra = {"client_id": client_id, "client_secret": client_secret}
-    refresh_url = "https://login.microsoftonline.com"
-    session = None
-    token = fetch_access_token(auth_config)
-    if token:
+class TokenManager:
+    """
+    Keeps a valid access token for one auth config available at all times.
+
+    The token is refreshed by a background thread well before it expires, and shared with every other
+    process on the node through a cache file guarded by an exclusive lock, so only one process does the
+    actual round trip to the authority. Readers never block on the network.
+    """
+
+    def __init__(self, auth_config: dict):
+        self.auth_config = auth_config
+        self.refresh_margin = float(auth_config.get("refresh_margin", 300))
+        self.retry_delay = float(auth_config.get("retry_delay", 10))
+        self.retry_delay_max = float(auth_config.get("retry_delay_max", 300))
+        cache_dir = auth_config.get("token_cache_dir", "/tmp/latigo/tokens")
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        self.cache_filename = os.path.join(cache_dir, f"{token_cache_key(auth_config)}.json")
+        self.lock = threading.Lock()
+        self.token: typing.Optional[dict] = None
+        self.done = threading.Event()
+        # The first token is fetched inline so the process does not start without credentials
+        self.refresh()
+        self.refresh_thread = threading.Thread(target=self._refresh_loop, name="token-refresh", daemon=True)
+        self.refresh_thread.start()
+
+    def _margin(self, token: dict) -> float:
+        # Short lived tokens are refreshed half way through their life rather than refresh_margin before expiry
+        return min(self.refresh_margin, 0.5 * float(token.get("expires_in", 0)))
+
+    def _is_fresh(self, token: typing.Optional[dict]) -> bool:
+        return bool(token) and token.get("expires_at", 0) - self._margin(token) > time.time()  # type: ignore
+
+    def _read_cache(self) -> typing.Optional[dict]:
         try:
-            session = OAuth2Session(auth_config.get("client_id"), token=token, auto_refresh_url=token_url, auto_refresh_kwargs=extra, token_updater=token_saver)
-        except Exception as e:
-            logger.error(f"Error creating OAuth2Session: {e}")
-    return session
+            with open(self.cache_filename, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_cache(self, token: dict):
+        tmp_filename = f"{self.cache_filename}.{os.getpid()}.tmp"
+        fd = os.open(tmp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(token, f)
+        os.replace(tmp_filename, self.cache_filename)
+
+    def refresh(self):
+        """
+        Make sure we hold a fresh token, taking it from the shared cache if another process already refreshed it
+        """
+        import fcntl
+
+        with open(f"{self.cache_filename}.lock", "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                token = self._read_cache()
+                if not self._is_fresh(token):
+                    token = fetch_access_token(self.auth_config)
+                    if not token:
+                        raise Exception(f"No token returned for client {self.auth_config.get('client_id')}")
+                    token["expires_at"] = time.time() + float(token.get("expires_in", 0))
+                    if not self._is_fresh(token):
+                        raise Exception(f"Token returned for client {self.auth_config.get('client_id')} expires in {token.get('expires_in', 0)} seconds")
+                    self._write_cache(token)
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        with self.lock:
+            self.token = token
+
+    def _seconds_until_refresh(self) -> float:
+        with self.lock:
+            token = self.token
+        if not token:
+            return 0.0
+        return max(0.0, token.get("expires_at", 0) - self._margin(token) - time.time())
+
+    def _refresh_loop(self):
+        delay = self.retry_delay
+        while not self.done.wait(self._seconds_until_refresh()):
+            try:
+                self.refresh()
+                delay = self.retry_delay
+            except Exception as e:
+                logger.error(f"Could not refresh token, retrying in {delay} seconds: {e}")
+                self.done.wait(delay)
+                delay = min(delay * 2, self.retry_delay_max)
+
+    def get_token(self) -> typing.Optional[dict]:
+        """
+        Return the current token without blocking on the network
+        """
+        with self.lock:
+            token = self.token
+        if token and token.get("expires_at", 0) < time.time():
+            logger.warning(f"Handing out expired token for client {self.auth_config.get('client_id')}, background refresh is failing")
+        return token
+
+    def get_access_token(self) -> str:
+        token = self.get_token()
+        return token.get("access_token", "") if token else ""
+
+    def stop(self):
+        self.done.set()
+
+
+class TokenManagerAuth(requests.auth.AuthBase):
+    """
+    Requests auth hook that stamps every request with the current token from a TokenManager
+    """
+
+    def __init__(self, token_manager: TokenManager):
+        self.token_manager = token_manager
+
+    def __call__(self, request):
+        token = self.token_manager.get_token() or {}
+        request.headers["Authorization"] = f"{token.get('token_type', 'Bearer')} {token.get('access_token', '')}"
+        return request
+
+
+token_managers_lock = threading.Lock()
+token_managers_by_key: typing.Dict[str, TokenManager] = {}
+
+
+def get_token_manager(auth_config: dict) -> TokenManager:
+    """
+    Return the process wide token manager for the given auth config, creating it on first use
+    """
+    key = json.dumps({key: auth_config.get(key) for key in ["authority_host_url", "tenant", "client_id", "resource"]}, sort_keys=True)
+    with token_managers_lock:
+        token_manager = token_managers_by_key.get(key, None)
+        if not token_manager:
+            token_manager = TokenManager(auth_config)
+            token_managers_by_key[key] = token_manager
+    return token_manager
+
+
+def create_auth_session(auth_config: dict, session_config: typing.Optional[dict] = None) -> PooledSession:
+    """
+    Pooled session that authenticates every request with the shared token manager for the auth config. Fails
+    when the first token cannot be fetched, the clients using the session are of no use without it.
+    """
+    token_manager = get_token_manager(auth_config)
+    return PooledSession(session_config, auth=TokenManagerAuth(token_manager))
@@ -0,0 +1,202 @@
+import typing
+import numpy as np
+import pandas as pd
+
+from latigo.types import LatigoSensorTag
+
+
+def _tag_name(tag) -> str:
+    return str(getattr(tag, "name", tag))
+
+
+def _to_utc_datetime64(index) -> np.ndarray:
+    """
+    Convert any datetime like index to a naive datetime64[ns] array in UTC
+    """
+    index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_convert("UTC").tz_localize(None)
+    return index.values.astype("datetime64[ns]", copy=False)
+
+
+class SensorDataColumns:
+    """
+    Columnar block of sensor data for one time range.
+
+    All tags share one sorted UTC time index, and the values live in a single 2-D float64 array in
+    column major order so that every tag is a contiguous column. Per tag views and the DataFrame handed
+    to Gordo are built on top of that array without copying it. Missing samples are NaN.
+    """
+
+    __slots__ = ("index", "values", "tags", "_positions", "_datetime_index")
+
+    def __init__(self, index: np.ndarray, values: np.ndarray, tags: typing.Sequence[typing.Any]):
+        index = np.asarray(index, dtype="datetime64[ns]")
+        values = np.asfortranarray(values, dtype=np.float64)
+        if values.ndim != 2 or values.shape != (len(index), len(tags)):
+            raise Exception(f"Sensor data values of shape {values.shape} do not match {len(index)} timestamps and {len(tags)} tags")
+        self.index = index
+        self.values = values
+        self.tags = list(tags)
+        self._positions: typing.Optional[typing.Dict[str, int]] = None
+        self._datetime_index: typing.Optional[pd.DatetimeIndex] = None
+
+    @classmethod
+    def empty(cls, tags: typing.Optional[typing.Sequence[typing.Any]] = None) -> "SensorDataColumns":
+        tags = list(tags or [])
+        return cls(np.empty(0, dtype="datetime64[ns]"), np.empty((0, len(tags)), dtype=np.float64, order="F"), tags)
+
+    @classmethod
+    def from_datapoints(cls, columns: typing.Iterable[typing.Tuple[typing.Any, typing.Sequence, typing.Sequence[float]]]) -> "SensorDataColumns":
+        """
+        Build from (tag, timestamps, values) triplets, aligning all tags on the union of their timestamps in one pass
+        """
+        tags = []
+        indices = []
+        column_values = []
+        for tag, timestamps, values in columns:
+            tags.append(tag)
+            indices.append(_to_utc_datetime64(timestamps))
+            column_values.append(np.asarray(values, dtype=np.float64))
+        if not tags:
+            return cls.empty()
+        index = np.unique(np.concatenate(indices))
+        block = np.full((len(index), len(tags)), np.nan, dtype=np.float64, order="F")
+        for column, (tag_index, values) in enumerate(zip(indices, column_values)):
+            block[np.searchsorted(index, tag_index), column] = values
+        return cls(index, block, tags)
+
+    @classmethod
+    def from_series(cls, series_list: typing.Iterable[pd.Series], tags: typing.Optional[typing.Sequence[typing.Any]] = None) -> "SensorDataColumns":
+        series_list = list(series_list)
+        if tags is None:
+            tags = [LatigoSensorTag(name=series.name, asset=None) for series in series_list]
+        return cls.from_datapoints((tag, series.index, series.values) for tag, series in zip(tags, series_list))
+
+    def __len__(self) -> int:
+        return len(self.tags)
+
+    def __iter__(self) -> typing.Iterator[pd.Series]:
+        """
+        Iterate over one Series per tag, like the Iterable[pd.Series] Gordo data providers produce
+        """
+        for column in range(len(self.tags)):
+            yield self._series_at(column)
+
+    def __str__(self):
+        return f"SensorDataColumns({len(self.index)} timestamps x {len(self.tags)} tags)"
+
+    @property
+    def tag_names(self) -> typing.List[str]:
+        return [_tag_name(tag) for tag in self.tags]
+
+    @property
+    def nbytes(self) -> int:
+        return self.index.nbytes + self.values.nbytes
+
+    @property
+    def datetime_index(self) -> pd.DatetimeIndex:
+        """
+        The shared time index as a UTC DatetimeIndex, built once and reused by every view
+        """
+        if self._datetime_index is None:
+            self._datetime_index = pd.DatetimeIndex(self.index).tz_localize("UTC")
+        return self._datetime_index
+
+    def _position(self, tag) -> int:
+        if self._positions is None:
+            self._positions = {name: column for column, name in enumerate(self.tag_names)}
+        return self._positions[_tag_name(tag)]
+
+    def column(self, tag) -> np.ndarray:
+        """
+        Zero-copy view of the values for one tag
+        """
+        return self.values[:, self._position(tag)]
+
+    def _series_at(self, column: int) -> pd.Series:
+        return pd.Series(self.values[:, column], index=self.datetime_index, name=_tag_name(self.tags[column]), copy=False)
+
+    def series(self, tag) -> pd.Series:
+        """
+        Zero-copy Series view of the values for one tag
+        """
+        return self._series_at(self._position(tag))
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        The whole block as the tag-per-column DataFrame Gordo expects, sharing memory with this block
+        """
+        return pd.DataFrame(self.values, index=self.datetime_index, columns=self.tag_names, copy=False)
+
+
+class PredictionBlock:
+    """
+    Columnar predictions for one Gordo target.
+
+    Keeps the UTC time index, one column-major float64 array with a column per prediction output and the
+    column keys (tuples for Gordo's two level columns), so storage writers and the spool can walk or
+    serialize the columns directly instead of going through a DataFrame again. The start and end of each
+    prediction window, which Gordo sends as ISO strings, are kept as UTC datetime64 arrays of their own.
+    """
+
+    __slots__ = ("target_name", "index", "values", "columns", "error_messages", "start", "end")
+
+    def __init__(self, target_name: str, index: np.ndarray, values: np.ndarray, columns: typing.Sequence[typing.Any], error_messages: typing.Optional[typing.List[str]] = None, start: typing.Optional[np.ndarray] = None, end: typing.Optional[np.ndarray] = None):
+        index = np.asarray(index, dtype="datetime64[ns]")
+        values = np.asfortranarray(values, dtype=np.float64)
+        if values.ndim != 2 or values.shape != (len(index), len(columns)):
+            raise Exception(f"Prediction values of shape {values.shape} do not match {len(index)} timestamps and {len(columns)} columns")
+        self.target_name = target_name
+        self.index = index
+        self.values = values
+        self.columns = list(columns)
+        self.error_messages = error_messages or []
+        self.start = None if start is None else np.asarray(start, dtype="datetime64[ns]")
+        self.end = None if end is None else np.asarray(end, dtype="datetime64[ns]")
+
+    @classmethod
+    def from_dataframe(cls, target_name: str, df: typing.Optional[pd.DataFrame], error_messages: typing.Optional[typing.List[str]] = None) -> "PredictionBlock":
+        """
+        Wrap the predictions from Gordo. A homogeneous float64 frame is taken over without copying its values,
+        the start and end columns are parsed into their own arrays and any other non-numeric column is dropped.
+        """
+        if df is None or df.empty:
+            return cls(target_name, np.empty(0, dtype="datetime64[ns]"), np.empty((0, 0), dtype=np.float64, order="F"), [], error_messages)
+        times: typing.Dict[str, np.ndarray] = {}
+        numeric_columns = []
+        for key in df.columns:
+            name = key[0] if isinstance(key, tuple) else key
+            if name in ("start", "end"):
+                times[name] = _to_utc_datetime64(pd.to_datetime(df[key], utc=True))
+            elif pd.api.types.is_numeric_dtype(df[key].dtype):
+                numeric_columns.append(key)
+        numeric = df if len(numeric_columns) == len(df.columns) else df[numeric_columns]
+        return cls(target_name, _to_utc_datetime64(df.index), numeric.to_numpy(dtype=np.float64), numeric_columns, error_messages, times.get("start", None), times.get("end", None))
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __str__(self):
+        return f"PredictionBlock({self.target_name}, {len(self.index)} timestamps x {len(self.columns)} columns, {len(self.error_messages)} errors)"
+
+    @property
+    def nbytes(self) -> int:
+        return self.index.nbytes + self.values.nbytes + sum(times.nbytes for times in [self.start, self.end] if times is not None)
+
+    def iter_columns(self) -> typing.Iterator[typing.Tuple[typing.Any, np.ndarray]]:
+        """
+        Iterate over (column key, zero-copy values view) pairs, all sharing self.index
+        """
+        for position, key in enumerate(self.columns):
+            yield key, self.values[:, position]
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        Rebuild the numeric part of the DataFrame Gordo returned, sharing memory with this block
+        """
+        if self.columns and all(isinstance(key, tuple) for key in self.columns):
+            columns = pd.MultiIndex.from_tuples(self.columns)
+        else:
+            columns = pd.Index(self.columns)
+        return pd.DataFrame(self.values, index=pd.DatetimeIndex(self.index).tz_localize("UTC"), columns=columns, copy=False)
@@ -10,13 +10,18 @@ from latigo.sensor_data import sensor_data_provider_factory
 
 from latigo.prediction_execution import prediction_execution_provider_factory
 from latigo.prediction_storage import prediction_storage_provider_factory
-from latigo.task_queue import task_queue_receiver_factory
+from latigo.task_queue import task_queue_receiver_factory, PartitionAssignmentListenerInterface
+from latigo.executor.coalescer import TaskCoalescer
+from latigo.metrics import registry as metrics_registry, start_metrics_server
+from latigo.tracing import Tracer, span_exporter_factory
+from latigo.profiling import Profiler
+from latigo.utils import parse_time_delta
 
 
 logger = logging.getLogger(__name__)
 
 
-class PredictionExecutor:
+class PredictionExecutor(PartitionAssignmentListenerInterface):
 
     # Inflate task queue connection from config
     def _prepare_task_queue(self):
@@ -24,8 +29,11 @@ class PredictionExecutor:
         if not self.task_queue_config:
             raise Exception("No task queue config specified")
         self.task_queue = task_queue_receiver_factory(self.task_queue_config)
-        self.idle_time = datetime.now()
-        self.idle_number = 0
+        # Idle accounting, updated on every poll of the task queue
+        self.poll_count = 0
+        self.idle_poll_count = 0
+        self.idle_seconds = 0.0
+        self.idle_since: typing.Optional[float] = None
         if not self.task_queue:
             raise Exception("No task queue configured")
 
@@ -58,10 +66,50 @@ class PredictionExecutor:
         if not self.prediction_executor_provider:
             raise Exception("No prediction_executor_provider configured, cannot continue...")
 
+    # Inflate task coalescing from config
+    def _prepare_task_coalescer(self):
+        self.executor_config = self.config.get("executor", dict())
+        self.task_coalescer = TaskCoalescer(self.executor_config.get("coalescing", dict()))
+        # Tasks whose window ended longer than max_age ago are skipped, or merged into one wider task per model
+        self.staleness_config = self.executor_config.get("staleness", None) or {}
+        max_age = self.staleness_config.get("max_age", None)
+        self.max_task_age = parse_time_delta(max_age).total_seconds() if max_age else None
+        self.stale_policy = self.staleness_config.get("policy", "skip")
+        if self.stale_policy not in ["skip", "merge"]:
+            raise Exception(f"Unknown staleness policy '{self.stale_policy}', expected 'skip' or 'merge'")
+        self.stale_skipped_count = 0
+        self.stale_merged_count = 0
+
+    # Inflate metrics from config
+    def _prepare_metrics(self):
+        self.metrics_config = self.config.get("metrics", None) or {}
+        self.metrics_server = None
+        stage_seconds = metrics_registry.histogram("latigo_executor_stage_seconds", "Seconds per task spent in each executor stage", ["stage"])
+        self.stage_seconds = {stage: stage_seconds.labels(stage) for stage in ["queue_wait", "queue", "fetch", "predict", "store"]}
+        tasks = metrics_registry.counter("latigo_executor_tasks_total", "Tasks by what became of them", ["outcome"])
+        self.task_outcomes = {outcome: tasks.labels(outcome) for outcome in ["received", "succeeded", "failed"]}
+        # When each model's held task was received, for the queue stage
+        self.received_at: typing.Dict[typing.Tuple[str, str], float] = {}
+        metrics_registry.add_collector("latigo_executor", self.stats)
+        metrics_registry.add_collector("latigo_task_queue", self.task_queue.stats)
+
+    # Inflate span exporter from config
+    def _prepare_tracing(self):
+        self.tracing_config = self.config.get("tracing", None) or {}
+        self.tracer = Tracer(span_exporter_factory(self.tracing_config))
+
+    # Inflate profiler from config
+    def _prepare_profiling(self):
+        self.profiler = Profiler(self.config.get("profiling", None))
+        metrics_registry.add_collector("latigo_profiler", self.profiler.stats)
+
     def __init__(self, config: dict):
         if not config:
             raise Exception("No config specified")
         self.config = config
+        self.done = False
+        # Merge and deduplicate incoming tasks
+        self._prepare_task_coalescer()
         # Make sure we have task queue
         self._prepare_task_queue()
         # Make sure we have input sensor data
@@ -70,11 +118,65 @@ class PredictionExecutor:
         self._prepare_prediction_storage_provider()
         # Create the predictor
         self._prepare_prediction_executor_provider()
+        # Let per model state follow our partitions
+        self.task_queue.set_assignment_listener(self)
+        self._prepare_metrics()
+        self._prepare_tracing()
+        self._prepare_profiling()
+
+    def on_partitions_assigned(self, partitions: typing.List[int], model_keys: typing.Set[typing.Tuple[str, str]]):
+        if model_keys:
+            logger.info(f"Pre-warming {len(model_keys)} models for partitions {sorted(partitions)}")
+            self.prediction_executor_provider.prewarm_models(model_keys)
+
+    def on_partitions_revoked(self, partitions: typing.List[int], model_keys: typing.Set[typing.Tuple[str, str]]):
+        if model_keys:
+            logger.info(f"Evicting {len(model_keys)} models for partitions {sorted(partitions)}")
+            self.task_coalescer.forget(model_keys)
+            for key in model_keys:
+                self.received_at.pop(key, None)
+            self.prediction_executor_provider.evict_models(model_keys)
 
     def _fetch_spec(self, project_name: str, model_name: str):
         tag_list: typing.List[LatigoSensorTag] = []
         return SensorDataSpec(tag_list=tag_list)
 
+    def _is_stale(self, task: Task) -> bool:
+        return self.max_task_age is not None and task.time_range.to_us < (time.time() - self.max_task_age) * 1000000
+
+    def _accept_task(self, task: Task):
+        """
+        Hand a received task to the coalescer, unless it is too old to be worth running on its own
+        """
+        self.task_outcomes["received"].inc()
+        if task.enqueued_us is not None:
+            received_us = int(time.time() * 1000000)
+            queue_wait = max(0.0, (received_us - task.enqueued_us) / 1000000)
+            self.stage_seconds["queue_wait"].observe(queue_wait)
+            self.tracer.record(task, "queue_wait", task.enqueued_us, queue_wait)
+        if not self._is_stale(task):
+            added = self.task_coalescer.add(task)
+        elif self.stale_policy == "merge":
+            self.stale_merged_count += 1
+            added = self.task_coalescer.add(task, stale=True)
+        else:
+            added = False
+            self.stale_skipped_count += 1
+            logger.info(f"Skipping stale task for '{task.project_name}.{task.model_name}' {task.time_range}")
+        if added:
+            self.received_at.setdefault((task.project_name, task.model_name), time.monotonic())
+        else:
+            self.task_queue.task_dropped(task)
+
+    def _receive_timeout(self) -> typing.Optional[float]:
+        """
+        Block on the queue no longer than until the next held task is due, or for the queue's own receive_timeout when nothing is held
+        """
+        deadline = self.task_coalescer.next_deadline()
+        if deadline is None:
+            return None
+        return max(0.0, deadline - time.monotonic())
+
     def _fetch_task(self) -> typing.Optional[Task]:
         """
         The task describes what the executor is supposed to do. This internal helper fetches one task from event hub
@@ -82,7 +184,7 @@ class PredictionExecutor:
         task = None
         try:
             if self.task_queue:
-                task = self.task_queue.get_task()
+                task = self.task_queue.get_task(self._receive_timeout())
             else:
                 logger.warning(f"No task queue")
         except Exception as e:
@@ -96,7 +198,7 @@ class PredictionExecutor:
         """
         sensor_data = None
         try:
-            time_range: TimeRange = TimeRange(task.from_time, task.to_time)
+            time_range: TimeRange = task.time_range
             project_name: str = task.project_name
             model_name: str = task.model_name
             spec: SensorDataSpec = self._fetch_spec(project_name, model_name)
@@ -130,34 +232,73 @@ class PredictionExecutor:
             raise e
             # traceback.print_exc()
 
-    def idle_count(self, has_task):
-        if self.idle_number > 0:
-            logger.info(f"Idle for {self.idle_number} cycles ({self.idle_time-datetime.now()})")
-            self.idle_number = 0
-            self.idle_time = datetime.now()
+    def _process_task(self, task: Task):
+        logger.info(f"Processing task for '{task.project_name}.{task.model_name}' from {task.from_time} for {task.time_range.duration()}")
+        received_at = self.received_at.pop((task.project_name, task.model_name), None)
+        if received_at is not None:
+            held = time.monotonic() - received_at
+            self.stage_seconds["queue"].observe(held)
+            self.tracer.record(task, "hold", int((time.time() - held) * 1000000), held)
+        with self.profiler.task(task), self.tracer.activate(task):
+            with self.stage_seconds["fetch"].time(), self.tracer.span(task, "fetch"):
+                sensor_data = self._fetch_sensor_data(task)
+            with self.stage_seconds["predict"].time(), self.tracer.span(task, "predict"):
+                prediction_data = self._execute_prediction(task, sensor_data)
+            with self.stage_seconds["store"].time(), self.tracer.span(task, "store"):
+                self._store_prediction_data(task, prediction_data)
+        self.task_coalescer.mark_completed(task)
+
+    def idle_count(self, has_task: bool, waited: float):
+        self.poll_count += 1
+        if has_task:
+            if self.idle_since is not None:
+                logger.info(f"Picked up work after idling for {time.monotonic() - self.idle_since:.1f}s")
+                self.idle_since = None
         else:
-            self.idle_number += 1
+            self.idle_poll_count += 1
+            self.idle_seconds += waited
+            if self.idle_since is None:
+                self.idle_since = time.monotonic() - waited
+
+    def stats(self) -> dict:
+        return {"polls": self.poll_count, "idle_polls": self.idle_poll_count, "idle_seconds": self.idle_seconds, "idle": self.idle_since is not None, "held_tasks": len(self.task_coalescer), "merged_tasks": self.task_coalescer.merged_count, "dropped_tasks": self.task_coalescer.dropped_count, "stale_skipped_tasks": self.stale_skipped_count, "stale_merged_tasks": self.stale_merged_count}
+
+    def stop(self):
+        """
+        Make run() return once it is done with the tasks it is working on, at the latest after the next receive timeout,
+        closing the prediction storage provider on the way out
+        """
+        self.done = True
 
     def run(self):
         if self.task_queue:
             logger.info(f"Starting processing in {self.__class__.__name__}")
-            done = False
+            self.profiler.start()
+            self.metrics_server = start_metrics_server(self.metrics_config)
             iteration_number = 0
             error_number = 0
-            while not done:
+            while not self.done:
                 iteration_number += 1
                 try:
+                    poll_start = time.monotonic()
                     task = self._fetch_task()
+                    self.idle_count(bool(task), time.monotonic() - poll_start)
                     if task:
-                        logger.info(f"Processing task for '{task.project_name}.{task.model_name}' from {task.from_time} for {task.to_time - task.from_time}")
-                        sensor_data = self._fetch_sensor_data(task)
-                        prediction_data = self._execute_prediction(task, sensor_data)
-                        self._store_prediction_data(task, prediction_data)
-                        self.idle_count(True)
-                    else:
-                        logger.warning(f"No task")
-                        self.idle_count(False)
-                        time.sleep(1)
+                        self._accept_task(task)
+                    # When the queue runs dry there is nothing left to merge with, so run everything held
+                    ready_tasks = self.task_coalescer.pop_ready(flush=not task)
+                    for ready_task in ready_tasks:
+                        try:
+                            self._process_task(ready_task)
+                            self.task_outcomes["succeeded"].inc()
+                            self.task_queue.task_succeeded(ready_task)
+                        except Exception as e:
+                            # One failing task must not take the rest of the held tasks down with it, the queue decides when to retry it
+                            error_number += 1
+                            self.task_outcomes["failed"].inc()
+                            logger.error(f"Could not process task for '{ready_task.project_name}.{ready_task.model_name}': {e}")
+                            traceback.print_exc()
+                            self.task_queue.task_failed(ready_task, e)
                 except Exception as e:
                     error_number += 1
                     logger.error("-----------------------------------")
@@ -165,6 +306,12 @@ class PredictionExecutor:
                     traceback.print_exc()
                     logger.error("")
                     time.sleep(1)
+            if self.metrics_server:
+                self.metrics_server.stop()
+            self.tracer.close()
+            self.profiler.stop()
             logger.info(f"Stopping processing in {self.__class__.__name__}")
         else:
             logger.info(f"Skipping processing in {self.__class__.__name__}")
+        # Lets a spooling provider finish its drain thread and release the spool lock
+        self.prediction_storage_provider.close()
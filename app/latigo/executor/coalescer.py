@@ -0,0 +1,113 @@
+import time
+import logging
+import typing
+from collections import OrderedDict
+
+from latigo.types import Task, TimeRange
+from latigo.utils import parse_time_delta
+
+logger = logging.getLogger(__name__)
+
+ModelKey = typing.Tuple[str, str]
+
+
+class TaskCoalescer:
+    """
+    Sits between the task queue and prediction in the executor.
+
+    Incoming tasks are held for a short while so that overlapping or adjacent windows for the same model
+    can be merged into one task, and tasks whose window is already covered by a recently completed task
+    are dropped. Completed windows are remembered per model in a bounded LRU index.
+    """
+
+    def __init__(self, config: typing.Optional[dict] = None):
+        self.config = config or {}
+        self.hold_time = parse_time_delta(self.config.get("hold_time", "0s")).total_seconds()
+        self.max_gap_us = int(parse_time_delta(self.config.get("max_gap", "0s")).total_seconds() * 1000000)
+        self.max_window_us = int(parse_time_delta(self.config.get("max_window", "1d")).total_seconds() * 1000000)
+        self.max_models = int(self.config.get("max_models", 20000))
+        self.max_ranges_per_model = int(self.config.get("max_ranges_per_model", 8))
+        # Held tasks per model, each as a merged time range, the monotonic time it was first seen and the task that started it, whose trace the merged task carries on
+        self.pending: typing.Dict[ModelKey, typing.List[typing.Tuple[TimeRange, float, Task]]] = {}
+        self.completed: "OrderedDict[ModelKey, typing.List[TimeRange]]" = OrderedDict()
+        self.merged_count = 0
+        self.dropped_count = 0
+
+    def _is_completed(self, key: ModelKey, time_range: TimeRange) -> bool:
+        for completed_range in self.completed.get(key, []):
+            if completed_range.from_us <= time_range.from_us and time_range.to_us <= completed_range.to_us:
+                return True
+        return False
+
+    def _can_merge(self, a: TimeRange, b: TimeRange, max_gap_us: int) -> bool:
+        if a.from_us > b.to_us + max_gap_us or b.from_us > a.to_us + max_gap_us:
+            return False
+        return max(a.to_us, b.to_us) - min(a.from_us, b.from_us) <= self.max_window_us
+
+    def add(self, task: Task, now: typing.Optional[float] = None, stale: bool = False) -> bool:
+        """
+        Offer a task for execution. Returns False if it was dropped as a duplicate of completed work.
+        Stale tasks merge with any held window for the model regardless of the gap, as long as the result fits in max_window.
+        """
+        now = time.monotonic() if now is None else now
+        key = (task.project_name, task.model_name)
+        time_range = task.time_range
+        if self._is_completed(key, time_range):
+            self.dropped_count += 1
+            logger.info(f"Dropping task for '{task.project_name}.{task.model_name}' {time_range}, already completed")
+            return False
+        held = self.pending.setdefault(key, [])
+        for position, (held_range, first_seen, origin) in enumerate(held):
+            if self._can_merge(held_range, time_range, self.max_window_us if stale else self.max_gap_us):
+                if not (held_range.from_us <= time_range.from_us and time_range.to_us <= held_range.to_us):
+                    held_range = TimeRange.from_epoch_us(min(held_range.from_us, time_range.from_us), max(held_range.to_us, time_range.to_us))
+                held[position] = (held_range, first_seen, origin)
+                self.merged_count += 1
+                return True
+        held.append((time_range, now, task))
+        return True
+
+    def pop_ready(self, now: typing.Optional[float] = None, flush: bool = False) -> typing.List[Task]:
+        """
+        Return held tasks whose hold time has passed, or all of them when flushing
+        """
+        now = time.monotonic() if now is None else now
+        ready = []
+        for key in list(self.pending.keys()):
+            held = self.pending[key]
+            keep = []
+            for time_range, first_seen, origin in held:
+                if flush or now - first_seen >= self.hold_time:
+                    ready.append(Task.from_epoch_us(key[0], key[1], time_range.from_us, time_range.to_us, origin.trace_id, origin.enqueued_us))
+                else:
+                    keep.append((time_range, first_seen, origin))
+            if keep:
+                self.pending[key] = keep
+            else:
+                del self.pending[key]
+        return ready
+
+    def next_deadline(self) -> typing.Optional[float]:
+        """
+        Monotonic time at which the next held task becomes ready, if any are held
+        """
+        first_seen = [first_seen for held in self.pending.values() for _, first_seen, _ in held]
+        return min(first_seen) + self.hold_time if first_seen else None
+
+    def mark_completed(self, task: Task):
+        key = (task.project_name, task.model_name)
+        ranges = self.completed.pop(key, [])
+        ranges.append(task.time_range)
+        self.completed[key] = ranges[-self.max_ranges_per_model :]
+        while len(self.completed) > self.max_models:
+            self.completed.popitem(last=False)
+
+    def forget(self, model_keys: typing.Iterable[ModelKey]):
+        """
+        Drop the completed index for models this executor no longer owns
+        """
+        for key in model_keys:
+            self.completed.pop(key, None)
+
+    def __len__(self) -> int:
+        return sum(len(held) for held in self.pending.values())
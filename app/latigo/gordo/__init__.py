@@ -1,80 +1,26 @@
 import typing
-import random
 import logging
-import pprint
-import numpy as np
-import pandas as pd
-import requests
-import json
-from datetime import datetime
 import latigo.utils
 from latigo.prediction_execution import PredictionExecutionProviderInterface
 
-from latigo.types import TimeRange, SensorDataSpec, SensorData, PredictionData
-from latigo.sensor_data import SensorDataProviderInterface
+from latigo.types import SensorData, PredictionData
 
 from latigo.model_info import ModelInfoProviderInterface
 from latigo.auth import create_auth_session
-from latigo.gordo.client import Client
-
-# from gordo_components.client import Client
-from gordo_components.data_provider.base import GordoBaseDataProvider, capture_args
-from gordo_components.client.forwarders import PredictionForwarder
-from gordo_components.dataset.sensor_tag import SensorTag
+from latigo.session import PooledSession
+from latigo.rate_limiter import get_rate_limiter
 
+# gordo_components pulls in sklearn, werkzeug, aiohttp and pandas, so the client and the data provider and prediction
+# forwarder built on its base classes are imported on first use in the functions below
+# from latigo.gordo.client import Client
+# from latigo.gordo.forwarding import LatigoDataProvider, LatigoPredictionForwarder
 
 logger = logging.getLogger(__name__)
 # logging.getLogger().setLevel(logging.WARNING)
 
 gordo_client_instances_by_hash: dict = {}
 gordo_client_instances_by_project: dict = {}
-gordo_client_auth_session: typing.Optional[requests.Session] = None
-
-# Defeat dependency on gordo
-def _gordo_to_latigo_tag_list(gordo_tag_list):
-    return gordo_tag_list
-
-
-class LatigoDataProvider(GordoBaseDataProvider):
-    """
-    A GordoBaseDataProvider that wraps Latigo spesific data providers
-    """
-
-    @capture_args
-    def __init__(self, sensor_data_provider: typing.Optional[SensorDataProviderInterface], config: dict):
-        super().__init__()
-        self.config = config
-        if not self.config:
-            raise Exception("No data_provider_config specified")
-        self.sensor_data_provider = sensor_data_provider
-
-    def load_series(self, from_ts: datetime, to_ts: datetime, tag_list: typing.List[SensorTag], dry_run: typing.Optional[bool] = False) -> typing.Iterable[pd.Series]:
-        if self.sensor_data_provider:
-            spec: SensorDataSpec = SensorDataSpec(tag_list=_gordo_to_latigo_tag_list(tag_list))
-            time_range = TimeRange(from_ts, to_ts)
-            sensor_data = self.sensor_data_provider.get_data_for_range(spec, time_range)
-            if sensor_data and sensor_data.data:
-                for item in sensor_data.data:
-                    yield item
-
-    def can_handle_tag(self, tag: SensorTag) -> bool:
-        if self.sensor_data_provider:
-            # TODO: Actually implement this
-            return True
-        return False
-
-
-class LatigoPredictionForwarder(PredictionForwarder):
-    """
-    A Gordo PredictionForwarder that wraps Latigo spesific prediction forwarders
-    """
-
-    def __init__(self, prediction_storage, config):
-        super().__init__()
-        self.config = config
-        if not self.config:
-            raise Exception("No prediction_forwarder_config specified")
-        self.prediction_storage = prediction_storage
+gordo_client_auth_session: typing.Optional[PooledSession] = None
 
 
 def gordo_config_hash(config: dict):
@@ -82,12 +28,12 @@ def gordo_config_hash(config: dict):
     parts = ["scheme", "host", "port", "project", "target", "gordo_version", "batch_size", "parallelism", "forward_resampled_sensors", "ignore_unhealthy_targets", "n_retries"]
     if config:
         for part in parts:
-            key += part + config.get("scheme", "")
+            key += f"|{part}={config.get(part, '')}"
     return key
 
 
 def clean_gordo_client_args(raw: dict):
-    whitelist = ["project", "target", "host", "port", "scheme", "gordo_version", "metadata", "data_provider", "prediction_forwarder", "batch_size", "parallelism", "forward_resampled_sensors", "ignore_unhealthy_targets", "n_retries", "data_provider", "prediction_forwarder", "session"]
+    whitelist = ["project", "target", "host", "port", "scheme", "gordo_version", "metadata", "data_provider", "prediction_forwarder", "batch_size", "parallelism", "forward_resampled_sensors", "ignore_unhealthy_targets", "n_retries", "data_provider", "prediction_forwarder", "session", "rate_limiter"]
     args = {}
     for w in whitelist:
         args[w] = raw.get(w)
@@ -96,24 +42,28 @@ def clean_gordo_client_args(raw: dict):
     return args
 
 
-def get_auth_session(auth_config: dict):
+def get_auth_session(auth_config: dict, session_config: typing.Optional[dict] = None):
     global gordo_client_auth_session
     if not gordo_client_auth_session:
         # logger.info("CREATING SESSION:")
-        gordo_client_auth_session = create_auth_session(auth_config)
+        gordo_client_auth_session = create_auth_session(auth_config, session_config)
     return gordo_client_auth_session
 
 
 def allocate_gordo_client_instances(raw_config: dict):
+    from latigo.gordo.client import Client
+
     projects = raw_config.get("projects", [])
     auth_config = raw_config.get("auth", dict())
-    session = get_auth_session(auth_config)
+    session_config = raw_config.get("session", dict())
+    session = get_auth_session(auth_config, session_config)
     if not isinstance(projects, list):
         projects = [projects]
     for project in projects:
         config = {**raw_config}
         config["project"] = project
         config["session"] = session
+        config["rate_limiter"] = get_rate_limiter(f"gordo:{config.get('host')}", raw_config.get("rate_limit"))
         key = gordo_config_hash(config)
         logger.info(f" + Instanciating Gordo Client: {key}")
         client = gordo_client_instances_by_hash.get(key, None)
@@ -136,17 +86,54 @@ def _expand_gordo_connection_string(config: dict):
 
 
 class GordoPredictionExecutionProvider(PredictionExecutionProviderInterface):
+    def _prepare_model_state(self):
+        # Endpoint and metadata per (project_name, model_name), loaded when partitions are assigned or on first use
+        self.model_state: typing.Dict[typing.Tuple[str, str], dict] = {}
+
     def __init__(self, sensor_data, prediction_storage, config):
         self.config = config
         if not self.config:
             raise Exception("No predictor_config specified")
         _expand_gordo_connection_string(self.config)
+        from latigo.gordo.forwarding import LatigoDataProvider, LatigoPredictionForwarder
+
         # Augment config with the latigo data provider and prediction forwarders
         self.data_provider_config = config.get("data_provider", {})
         self.config["data_provider"] = LatigoDataProvider(sensor_data, self.data_provider_config)
         self.prediction_forwarder_config = config.get("prediction_forwarder", {})
         self.config["prediction_forwarder"] = LatigoPredictionForwarder(prediction_storage, self.prediction_forwarder_config)
         allocate_gordo_client_instances(config)
+        self._prepare_model_state()
+
+    def _load_model_state(self, project_name: str, model_name: str) -> typing.Optional[dict]:
+        client = get_gordo_client_instance_by_project(project_name)
+        if not client:
+            return None
+        endpoint = client.get_endpoint(model_name)
+        if not endpoint:
+            return None
+        return {"endpoint": endpoint, "metadata": client.get_endpoint_metadata(endpoint)}
+
+    def _get_model_state(self, project_name: str, model_name: str) -> typing.Optional[dict]:
+        key = (project_name, model_name)
+        state = self.model_state.get(key, None)
+        if state is None:
+            try:
+                state = self._load_model_state(project_name, model_name)
+            except Exception as e:
+                logger.warning(f"Could not load state for model '{project_name}.{model_name}': {e}")
+                return None
+            if state is not None:
+                self.model_state[key] = state
+        return state
+
+    def prewarm_models(self, model_keys: typing.Set[typing.Tuple[str, str]]):
+        for project_name, model_name in model_keys:
+            self._get_model_state(project_name, model_name)
+
+    def evict_models(self, model_keys: typing.Set[typing.Tuple[str, str]]):
+        for key in model_keys:
+            self.model_state.pop(key, None)
 
     def execute_prediction(self, project_name: str, model_name: str, sensor_data: SensorData) -> PredictionData:
         if not project_name:
@@ -158,10 +145,15 @@ class GordoPredictionExecutionProvider(PredictionExecutionProviderInterface):
         client = get_gordo_client_instance_by_project(project_name)
         if not client:
             raise Exception("No client in gordo.execute_prediction()")
-        result = client.predict(sensor_data.time_range.from_time, sensor_data.time_range.to_time)
+        from latigo.columnar import PredictionBlock
+
+        # Predict for the model's own endpoint, or for the whole project when the model is not one of its targets
+        state = self._get_model_state(project_name, model_name)
+        result = client.predict(sensor_data.time_range.from_time, sensor_data.time_range.to_time, endpoints=[state["endpoint"]] if state else None)
         if not result:
             raise Exception("No result in gordo.execute_prediction()")
-        return PredictionData(name=model_name, time_range=sensor_data.time_range, data=result)
+        data = [PredictionBlock.from_dataframe(target_name, predictions, error_messages) for target_name, predictions, error_messages in result]
+        return PredictionData(name=model_name, time_range=sensor_data.time_range, data=data)
 
 
 class GordoModelInfoProvider(ModelInfoProviderInterface):
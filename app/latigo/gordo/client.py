@@ -6,7 +6,6 @@ import copy
 import requests
 import logging
 import itertools
-from time import sleep
 
 import typing
 from typing import Dict, Any
@@ -15,11 +14,12 @@ from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 
 import aiohttp
 import pandas as pd
-from sklearn.base import BaseEstimator
 from werkzeug.exceptions import BadRequest
 
 from gordo_components import serializer
-from gordo_components.client import io as gordo_io
+
+if typing.TYPE_CHECKING:
+    from sklearn.base import BaseEstimator
 from gordo_components.client.io import HttpUnprocessableEntity
 from gordo_components.client.forwarders import PredictionForwarder
 from gordo_components.client.utils import EndpointMetadata, PredictionResult
@@ -28,9 +28,27 @@ from gordo_components.data_provider.base import GordoBaseDataProvider
 from gordo_components.dataset.sensor_tag import normalize_sensor_tags
 from gordo_components.server import utils as server_utils
 
+from latigo.session import PooledSession
+from latigo import tracing
+from latigo.rate_limiter import RateLimiterInterface, DevNullRateLimiter, retry_after_seconds
+from latigo.single_flight import SingleFlight
+
 
 logger = logging.getLogger(__name__)
 
+class RateLimited(IOError):
+    """
+    The server answered 429, asking us to wait retry_after seconds
+    """
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# Shared by every client in the process, so identical watchman and metadata lookups in flight at the same time go upstream once
+upstream_single_flight = SingleFlight("gordo")
+
 
 class Client:
     """
@@ -39,7 +57,7 @@ class Client:
     Enables some basic communication with a deployed Gordo project
     """
 
-    def __init__(self, project: str, target: typing.Optional[str] = None, host: str = "localhost", port: int = 443, scheme: str = "https", gordo_version: str = "v0", metadata: typing.Optional[dict] = None, data_provider: typing.Optional[GordoBaseDataProvider] = None, prediction_forwarder: typing.Optional[PredictionForwarder] = None, batch_size: int = 100000, parallelism: int = 10, forward_resampled_sensors: bool = False, ignore_unhealthy_targets: bool = False, n_retries: int = 5, use_parquet: bool = False, session: typing.Optional[requests.Session] = None):
+    def __init__(self, project: str, target: typing.Optional[str] = None, host: str = "localhost", port: int = 443, scheme: str = "https", gordo_version: str = "v0", metadata: typing.Optional[dict] = None, data_provider: typing.Optional[GordoBaseDataProvider] = None, prediction_forwarder: typing.Optional[PredictionForwarder] = None, batch_size: int = 100000, parallelism: int = 10, forward_resampled_sensors: bool = False, ignore_unhealthy_targets: bool = False, n_retries: int = 5, use_parquet: bool = False, session: typing.Optional[typing.Union[requests.Session, PooledSession]] = None, rate_limiter: typing.Optional[RateLimiterInterface] = None):
         """
 
         Parameters
@@ -85,17 +103,23 @@ class Client:
             Pass the data to the server using the parquet protocol. Default is True
             and recommended as it's more efficient for larger batch sizes. If False JSON
             is used for sending the data back and forth.
-        session: Optional[requests.Session]
+        session: Optional[Union[requests.Session, PooledSession]]
             If present, this requests session will be used for all HTTP calls.
+            Pass a PooledSession when the client is shared between threads.
             This allows the caller to specify whatever session management she wants, including
             any authentication regime or special headers etc.
-            If not set, a standard session will be created.
+            If not set, a standard pooled session will be created.
+        rate_limiter: Optional[RateLimiterInterface]
+            If present, every HTTP call to this Gordo host first takes a token from this limiter,
+            which is expected to be shared with every other client talking to the same host.
+            If not set, calls are not rate limited.
         """
 
         self.base_url = f"{scheme}://{host}:{port}"
         self.watchman_endpoint = f"{self.base_url}/gordo/{gordo_version}/{project}/"
         self.metadata = metadata if metadata is not None else dict()
-        self.session = session or requests.Session()
+        self.session = session or PooledSession()
+        self.rate_limiter = rate_limiter or DevNullRateLimiter()
         self.endpoints = self._endpoints_from_watchman(self.watchman_endpoint)
         self.prediction_forwarder = prediction_forwarder
         self.data_provider = data_provider
@@ -157,17 +181,27 @@ class Client:
             raise ValueError(f"Found no endpoints out of supplied endpoints: {original_endpoints} after filtering")
         return endpoints
 
+    def _get(self, url: str) -> requests.Response:
+        """
+        Rate limited GET through the session, backing off every user of the limiter when the host asks us to
+        """
+        self.rate_limiter.acquire()
+        resp = self.session.get(url)
+        if resp.status_code == 429:
+            self.rate_limiter.penalize(retry_after_seconds(resp.headers))
+        return resp
+
     def _endpoints_from_watchman(self, endpoint: str) -> typing.List[EndpointMetadata]:
         """
         Get a list of endpoints by querying Watchman
         """
-        resp = self.session.get(endpoint)
+        resp = upstream_single_flight.do(("watchman", endpoint), self._get, endpoint)
         if not resp.ok:
             raise IOError(f"Failed to get endpoints: {resp.content}")
 
         return [EndpointMetadata(target_name=data["endpoint-metadata"]["metadata"]["name"], healthy=data["healthy"], endpoint=f'{self.base_url}{data["endpoint"].rstrip("/")}', tag_list=normalize_sensor_tags(data["endpoint-metadata"]["metadata"]["dataset"]["tag_list"]), target_tag_list=normalize_sensor_tags(data["endpoint-metadata"]["metadata"]["dataset"]["target_tag_list"]), resolution=data["endpoint-metadata"]["metadata"]["dataset"]["resolution"], model_offset=data["endpoint-metadata"]["metadata"]["model"].get("model-offset", 0)) if data["healthy"] else EndpointMetadata(target_name=None, healthy=data["healthy"], endpoint=f'{self.base_url}{data["endpoint"].rstrip("/")}', tag_list=None, target_tag_list=None, resolution=None, model_offset=None) for data in resp.json()["endpoints"]]
 
-    def download_model(self) -> typing.Dict[str, BaseEstimator]:
+    def download_model(self) -> typing.Dict[str, "BaseEstimator"]:
         """
         Download the actual model(s) from the ML server /download-model
 
@@ -178,7 +212,7 @@ class Client:
         """
         models = dict()
         for endpoint in self.endpoints:
-            resp = self.session.get(f"{endpoint.endpoint}/download-model")
+            resp = self._get(f"{endpoint.endpoint}/download-model")
             if resp.ok:
                 models[endpoint.target_name] = serializer.loads(resp.content)
             else:
@@ -199,16 +233,28 @@ class Client:
         Dict[str, dict]
             Mapping of target names to their metadata
         """
-        metadata = dict()
+        return {endpoint.target_name: self.get_endpoint_metadata(endpoint) for endpoint in self.endpoints}
+
+    def get_endpoint(self, target_name: str) -> typing.Optional[EndpointMetadata]:
+        """
+        The endpoint of one target, or None if the project has no healthy endpoint by that name
+        """
         for endpoint in self.endpoints:
-            resp = self.session.get(f"{endpoint.endpoint}/metadata")
-            if resp.ok:
-                metadata[endpoint.target_name] = resp.json()
-            else:
-                raise IOError(f"Failed to get metadata: '{resp.content}'")
-        return metadata
+            if endpoint.target_name == target_name:
+                return endpoint
+        return None
+
+    def get_endpoint_metadata(self, endpoint: EndpointMetadata) -> dict:
+        """
+        Get the metadata of one target
+        """
+        url = f"{endpoint.endpoint}/metadata"
+        resp = upstream_single_flight.do(("metadata", url), self._get, url)
+        if not resp.ok:
+            raise IOError(f"Failed to get metadata: '{resp.content}'")
+        return resp.json()
 
-    def predict(self, start: datetime, end: datetime) -> typing.Iterable[typing.Tuple[str, pd.DataFrame, typing.List[str]]]:
+    def predict(self, start: datetime, end: datetime, endpoints: typing.Optional[typing.List[EndpointMetadata]] = None) -> typing.Iterable[typing.Tuple[str, pd.DataFrame, typing.List[str]]]:
         """
         Start the prediction process.
 
@@ -216,6 +262,8 @@ class Client:
         ----------
         start: datetime
         end: datetime
+        endpoints: Optional[List[EndpointMetadata]]
+            Only predict for these endpoints. Leave as None to predict for all endpoints of the project.
 
         Returns
         -------
@@ -226,7 +274,7 @@ class Client:
               2nd element is a list of error messages (if any) for running the predictions
         """
         # For every endpoint, start making predictions for the time range
-        jobs = asyncio.gather(*[self._predict(endpoint=endpoint, start=start, end=end) for endpoint in self.endpoints])
+        jobs = asyncio.gather(*[self._predict(endpoint=endpoint, start=start, end=end) for endpoint in (self.endpoints if endpoints is None else endpoints)])
 
         # Create new event loop and process getting predictions
         loop = asyncio.get_event_loop()
@@ -290,7 +338,7 @@ class Client:
         PredictionResult
         """
 
-        kwargs: Dict[str, Any] = dict(session=session, url=f"{endpoint.endpoint}{self.prediction_path}{self.query}")
+        kwargs: Dict[str, Any] = dict(url=f"{endpoint.endpoint}{self.prediction_path}{self.query}")
 
         # We're going to serialize the data as either JSON or Arrow
         if self.use_parquet:
@@ -298,43 +346,77 @@ class Client:
         else:
             kwargs["json"] = {"X": server_utils.dataframe_to_dict(X.iloc[chunk]), "y": server_utils.dataframe_to_dict(y.iloc[chunk]) if y is not None else None}
 
-        # Start attempting to get predictions for this batch
-        for current_attempt in itertools.count(start=1):
-            try:
+        # Shows up as one span per chunk in the trace of the task being predicted, if it is traced
+        with tracing.span("gordo_chunk", target=endpoint.target_name, rows=len(X.index[chunk])):
+            # Start attempting to get predictions for this batch
+            for current_attempt in itertools.count(start=1):
+                await self.rate_limiter.acquire_async()
                 try:
-                    resp = await gordo_io.post(**kwargs)
-                except HttpUnprocessableEntity:
-                    self.prediction_path = "/prediction"
-                    kwargs["url"] = f"{endpoint.endpoint}{self.prediction_path}{self.query}"
-                    resp = await gordo_io.post(**kwargs)
-            # If it was an IO or TimeoutError, we can retry
-            except (IOError, TimeoutError, FutureTimeoutError, BadRequest, aiohttp.ClientError) as exc:
-                if current_attempt <= self.n_retries:
-                    time_to_sleep = min(2 ** (current_attempt + 2), 300)
-                    logger.warning(f"Failed to get response on attempt {current_attempt} out of {self.n_retries} attempts.")
-                    sleep(time_to_sleep)  # Not async on purpose.
-                    continue
-                else:
-                    msg = f"Failed to get predictions for dates {start} -> {end} " f"for target: '{endpoint.target_name}' Error: {exc}"
+                    try:
+                        resp = await self._post(session, **kwargs)
+                    except HttpUnprocessableEntity:
+                        self.prediction_path = "/prediction"
+                        kwargs["url"] = f"{endpoint.endpoint}{self.prediction_path}{self.query}"
+                        resp = await self._post(session, **kwargs)
+                # Back off every user of the limiter for as long as the server asks, without blocking the other chunks
+                except RateLimited as exc:
+                    self.rate_limiter.penalize(exc.retry_after)
+                    if current_attempt <= self.n_retries:
+                        logger.warning(f"Rate limited on attempt {current_attempt} out of {self.n_retries} attempts, retrying in {exc.retry_after:.1f}s.")
+                        await asyncio.sleep(exc.retry_after)
+                        continue
+                    else:
+                        msg = f"Failed to get predictions for dates {start} -> {end} " f"for target: '{endpoint.target_name}' Error: {exc}"
+                        logger.error(msg)
+                        return PredictionResult(name=endpoint.target_name, predictions=None, error_messages=[msg])
+                # If it was an IO or TimeoutError, we can retry
+                except (IOError, TimeoutError, FutureTimeoutError, BadRequest, aiohttp.ClientError) as exc:
+                    if current_attempt <= self.n_retries:
+                        time_to_sleep = min(2 ** (current_attempt + 2), 300)
+                        logger.warning(f"Failed to get response on attempt {current_attempt} out of {self.n_retries} attempts.")
+                        await asyncio.sleep(time_to_sleep)
+                        continue
+                    else:
+                        msg = f"Failed to get predictions for dates {start} -> {end} " f"for target: '{endpoint.target_name}' Error: {exc}"
+                        logger.error(msg)
+
+                        return PredictionResult(name=endpoint.target_name, predictions=None, error_messages=[msg])
+
+                # No point in retrying a BadRequest
+                except BadRequest as exc:
+                    msg = f"Failed with BadRequest error for dates {start} -> {end} " f"for target: '{endpoint.target_name}' Error: {exc}"
                     logger.error(msg)
-
                     return PredictionResult(name=endpoint.target_name, predictions=None, error_messages=[msg])
 
-            # No point in retrying a BadRequest
-            except BadRequest as exc:
-                msg = f"Failed with BadRequest error for dates {start} -> {end} " f"for target: '{endpoint.target_name}' Error: {exc}"
-                logger.error(msg)
-                return PredictionResult(name=endpoint.target_name, predictions=None, error_messages=[msg])
+                # Process response and return if no exception
+                else:
 
-            # Process response and return if no exception
-            else:
+                    predictions = self.dataframe_from_response(resp)
 
-                predictions = self.dataframe_from_response(resp)
+                    # Forward predictions to any other consumer if registered.
+                    if self.prediction_forwarder is not None:
+                        await self.prediction_forwarder(predictions=predictions, endpoint=endpoint, metadata=self.metadata)
+                    return PredictionResult(name=endpoint.target_name, predictions=predictions, error_messages=[])
 
-                # Forward predictions to any other consumer if registered.
-                if self.prediction_forwarder is not None:
-                    await self.prediction_forwarder(predictions=predictions, endpoint=endpoint, metadata=self.metadata)
-                return PredictionResult(name=endpoint.target_name, predictions=predictions, error_messages=[])
+    async def _post(self, session: typing.Optional[aiohttp.ClientSession], url: str, **kwargs) -> typing.Union[dict, bytes]:
+        """
+        POST like gordo_io.post, but turning a 429 into RateLimited with the server's Retry-After
+        """
+        if session is None:
+            async with aiohttp.ClientSession() as own_session:
+                return await self._post(own_session, url, **kwargs)
+        async with session.post(url, **kwargs) as resp:
+            if 200 <= resp.status <= 299:
+                return await resp.json() if resp.content_type == "application/json" else await resp.read()
+            content = await resp.read()
+            msg = f"We failed to get response from POST {url}: {content}"
+            if resp.status == 429:
+                raise RateLimited(msg, retry_after_seconds(resp.headers))
+            if resp.status == 422:
+                raise HttpUnprocessableEntity(msg)
+            if 400 <= resp.status <= 499:
+                raise BadRequest(msg)
+            raise IOError(msg)
 
     async def _accumulate_coroutine_predictions(self, endpoint: EndpointMetadata, jobs: typing.List[typing.Coroutine]) -> PredictionResult:
         """
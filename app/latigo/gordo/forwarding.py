@@ -0,0 +1,70 @@
+import typing
+import logging
+from datetime import datetime
+
+from gordo_components.data_provider.base import GordoBaseDataProvider, capture_args
+from gordo_components.client.forwarders import PredictionForwarder
+from gordo_components.dataset.sensor_tag import SensorTag
+
+from latigo.types import TimeRange, SensorDataSpec
+from latigo.sensor_data import SensorDataProviderInterface
+from latigo.single_flight import SingleFlight
+
+if typing.TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+# Defeat dependency on gordo
+def _gordo_to_latigo_tag_list(gordo_tag_list):
+    return gordo_tag_list
+
+
+class LatigoDataProvider(GordoBaseDataProvider):
+    """
+    A GordoBaseDataProvider that wraps Latigo spesific data providers
+    """
+
+    @capture_args
+    def __init__(self, sensor_data_provider: typing.Optional[SensorDataProviderInterface], config: dict):
+        super().__init__()
+        self.config = config
+        if not self.config:
+            raise Exception("No data_provider_config specified")
+        self.sensor_data_provider = sensor_data_provider
+        # Concurrent loads of the same tags and range (shared tags across models, retries) share one upstream fetch
+        self.single_flight = SingleFlight("load_series")
+
+    def load_series(self, from_ts: datetime, to_ts: datetime, tag_list: typing.List[SensorTag], dry_run: typing.Optional[bool] = False) -> typing.Iterable["pd.Series"]:
+        if self.sensor_data_provider:
+            spec: SensorDataSpec = SensorDataSpec(tag_list=_gordo_to_latigo_tag_list(tag_list))
+            time_range = TimeRange(from_ts, to_ts)
+            key = (tuple(sorted(tag.name for tag in tag_list)), self.config.get("resolution", None), time_range)
+            sensor_data = self.single_flight.do(key, self.sensor_data_provider.get_data_for_range, spec, time_range)
+            if sensor_data and sensor_data.data:
+                for item in sensor_data.data:
+                    yield item
+
+    def can_handle_tag(self, tag: SensorTag) -> bool:
+        if self.sensor_data_provider:
+            # TODO: Actually implement this
+            return True
+        return False
+
+
+class LatigoPredictionForwarder(PredictionForwarder):
+    """
+    A Gordo PredictionForwarder that wraps Latigo spesific prediction forwarders
+    """
+
+    def __init__(self, prediction_storage, config):
+        super().__init__()
+        self.config = config
+        if not self.config:
+            raise Exception("No prediction_forwarder_config specified")
+        self.prediction_storage = prediction_storage
+
+    async def __call__(self, *, predictions: "pd.DataFrame" = None, endpoint=None, metadata: typing.Optional[dict] = None, resampled_sensor_data: "pd.DataFrame" = None):
+        # The executor stores the predictions once execute_prediction returns them, the client awaits this for every chunk
+        pass
@@ -1,15 +1,45 @@
+import os
 import logging
 import inspect
 
 once = False
 
 
+def _fix_absl_logging():
+    try:
+        # FIXME(https://github.com/abseil/abseil-py/issues/99)
+        # FIXME(https://github.com/abseil/abseil-py/issues/102)
+        # Unfortunately, many libraries that include absl (including Tensorflow)
+        # will get bitten by double-logging due to absl's incorrect use of
+        # the python logging library:
+        #   2019-07-19 23:47:38,829 my_logger   779 : test
+        #   I0719 23:47:38.829330 139904865122112 foo.py:63] test
+        #   2019-07-19 23:47:38,829 my_logger   779 : test
+        #   I0719 23:47:38.829469 139904865122112 foo.py:63] test
+        # The code below fixes this double-logging.  FMI see:
+        #   https://github.com/tensorflow/tensorflow/issues/26691#issuecomment-500369493
+
+        import absl.logging
+
+        logging.root.removeHandler(absl.logging._absl_handler)
+        absl.logging._warn_preinit_stderr = False
+
+    except Exception:
+        # warnings.warn(f"Failed to fix absl logging bug {traceback.format_exc()}")
+        pass
+
+
 def setup_logging(filename, log_level=logging.INFO):
     """Set up the logging."""
     global once
     if not once:
         once = True
-        logging.basicConfig(level=log_level)
+        _fix_absl_logging()
+        # Set log level, defaulting to DEBUG
+        env_log_level = os.getenv("LOG_LEVEL", "DEBUG").upper()
+        azure_log_level = os.getenv("AZURE_DATALAKE_LOG_LEVEL", "INFO").upper()
+        logging.basicConfig(level=getattr(logging, env_log_level), format="[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s")
+        logging.getLogger("azure.datalake").setLevel(azure_log_level)
         fmt = "%(asctime)s %(levelname)s (%(threadName)s) " "[%(name)s] %(message)s"
         colorfmt = "%(log_color)s{}%(reset)s".format(fmt)
         datefmt = "%Y-%m-%d %H:%M:%S"
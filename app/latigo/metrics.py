@@ -0,0 +1,342 @@
+import re
+import time
+import bisect
+import logging
+import threading
+import typing
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from a fast local call to a slow Gordo prediction
+default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelValues = typing.Tuple[str, ...]
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_:]", "_", name)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: typing.Sequence[str], values: typing.Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if value == float("-inf"):
+        return "-Inf"
+    return repr(float(value))
+
+
+class CounterChild:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self.lock:
+            self.value += amount
+
+
+class GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = float(value)
+
+
+class HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count", "lock")
+
+    def __init__(self, bounds: typing.Sequence[float]):
+        self.bounds = bounds
+        # One count per bound plus +Inf, made cumulative only when rendered
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        position = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[position] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self) -> "Timer":
+        return Timer(self)
+
+
+class Timer:
+    """
+    Context manager observing the seconds spent in its block
+    """
+
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram: HistogramChild):
+        self.histogram = histogram
+        self.started = 0.0
+
+    def __enter__(self) -> "Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class Metric:
+    """
+    A named metric with one child per combination of label values. Children are created on first use and
+    kept, so hot paths should hold on to the child they get from labels().
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, label_names: typing.Sequence[str] = ()):
+        self.name = _metric_name(name)
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.children: typing.Dict[LabelValues, typing.Any] = {}
+        self.lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError()
+
+    def labels(self, *values, **labels):
+        if labels:
+            values = tuple(labels[name] for name in self.label_names)
+        key = tuple(str(value) for value in values)
+        if len(key) != len(self.label_names):
+            raise Exception(f"Metric {self.name} has labels {self.label_names}, got {key}")
+        child = self.children.get(key, None)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(key, self._new_child())
+        return child
+
+    def samples(self) -> typing.Iterator[typing.Tuple[str, str, float]]:
+        """
+        (name suffix, formatted labels, value) for every sample to expose
+        """
+        for values, child in list(self.children.items()):
+            yield "", _format_labels(self.label_names, values), child.value
+
+    def render(self) -> typing.List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{self.name}{suffix}{labels} {_format_value(value)}" for suffix, labels, value in self.samples())
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return GaugeChild()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, label_names: typing.Sequence[str] = (), buckets: typing.Sequence[float] = default_buckets):
+        super().__init__(name, help, label_names)
+        self.bounds = tuple(sorted(float(bound) for bound in buckets))
+
+    def _new_child(self):
+        return HistogramChild(self.bounds)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self) -> Timer:
+        return self.labels().time()
+
+    def samples(self) -> typing.Iterator[typing.Tuple[str, str, float]]:
+        for values, child in list(self.children.items()):
+            with child.lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(list(self.bounds) + [float("inf")], counts):
+                cumulative += bucket_count
+                yield "_bucket", _format_labels(self.label_names + ("le",), values + (_format_value(bound),)), cumulative
+            labels = _format_labels(self.label_names, values)
+            yield "_sum", labels, total
+            yield "_count", labels, count
+
+
+class MetricsRegistry:
+    """
+    Every metric of the process, plus collectors that are asked for their current numbers when metrics are
+    rendered, so components that already keep a stats() dict do not have to update anything on their hot path.
+    """
+
+    def __init__(self):
+        self.metrics: typing.Dict[str, Metric] = {}
+        self.collectors: typing.Dict[str, typing.Callable[[], typing.Optional[dict]]] = {}
+        self.lock = threading.Lock()
+
+    def _get_or_create(self, metric_class, name: str, help: str, label_names: typing.Sequence[str], **kwargs) -> typing.Any:
+        name = _metric_name(name)
+        with self.lock:
+            metric = self.metrics.get(name, None)
+            if metric is None:
+                metric = self.metrics[name] = metric_class(name, help, label_names, **kwargs)
+            elif not isinstance(metric, metric_class) or metric.label_names != tuple(label_names):
+                raise Exception(f"Metric {name} already registered as {metric.kind} with labels {metric.label_names}")
+        return metric
+
+    def counter(self, name: str, help: str, label_names: typing.Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help, label_names)
+
+    def gauge(self, name: str, help: str, label_names: typing.Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, help, label_names)
+
+    def histogram(self, name: str, help: str, label_names: typing.Sequence[str] = (), buckets: typing.Sequence[float] = default_buckets) -> Histogram:
+        return self._get_or_create(Histogram, name, help, label_names, buckets=buckets)
+
+    def add_collector(self, prefix: str, stats: typing.Callable[[], typing.Optional[dict]]):
+        """
+        Expose every number in the dict returned by stats as a gauge named prefix_key, booleans as 0 or 1
+        """
+        with self.lock:
+            self.collectors[_metric_name(prefix)] = stats
+
+    def remove_collector(self, prefix: str):
+        with self.lock:
+            self.collectors.pop(_metric_name(prefix), None)
+
+    def _render_collector(self, prefix: str, stats: typing.Callable[[], typing.Optional[dict]]) -> typing.List[str]:
+        try:
+            values = stats() or {}
+        except Exception as e:
+            logger.warning(f"Could not collect metrics for {prefix}: {e}")
+            return []
+        lines = []
+        for key, value in values.items():
+            if isinstance(value, bool):
+                value = int(value)
+            if not isinstance(value, (int, float)):
+                continue
+            name = _metric_name(f"{prefix}_{key}")
+            lines.extend([f"# TYPE {name} gauge", f"{name} {_format_value(value)}"])
+        return lines
+
+    def render(self) -> str:
+        """
+        Everything in Prometheus text exposition format
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+            collectors = list(self.collectors.items())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for prefix, stats in collectors:
+            lines.extend(self._render_collector(prefix, stats))
+        return "\n".join(lines) + "\n"
+
+
+# The registry of this process
+registry = MetricsRegistry()
+
+
+# Answers a POST to its path, given the query parameters, with a status code and a text body
+RequestHandler = typing.Callable[[typing.Dict[str, str]], typing.Tuple[int, str]]
+
+
+class MetricsServer:
+    """
+    Serves the registry, if any, at /metrics over HTTP from a background thread, plus any extra POST handlers
+    """
+
+    def __init__(self, registry: typing.Optional[MetricsRegistry], host: str = "127.0.0.1", port: int = 9100, handlers: typing.Optional[typing.Dict[str, RequestHandler]] = None):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import urlsplit, parse_qsl
+
+        metrics_registry = registry
+        post_handlers = dict(handlers or {})
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if metrics_registry is None or self.path.split("?")[0] not in ["/metrics", "/"]:
+                    self.send_error(404)
+                    return
+                payload = metrics_registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                url = urlsplit(self.path)
+                handler = post_handlers.get(url.path, None)
+                if handler is None:
+                    self.send_error(404)
+                    return
+                status, text = handler(dict(parse_qsl(url.query)))
+                payload = text.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "text/plain; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def start_metrics_server(config: typing.Optional[dict], registry: MetricsRegistry = registry, handlers: typing.Optional[typing.Dict[str, RequestHandler]] = None) -> typing.Optional[MetricsServer]:
+    """
+    Start serving metrics if the metrics config has a port, 0 picks a free one
+    """
+    config = config or {}
+    port = config.get("port", None)
+    if port is None:
+        return None
+    try:
+        server = MetricsServer(registry, config.get("host", "127.0.0.1"), int(port), handlers)
+    except OSError as e:
+        logger.error(f"Could not serve metrics on port {port}: {e}")
+        return None
+    logger.info(f"Serving metrics on http://{config.get('host', '127.0.0.1')}:{server.port}/metrics")
+    return server
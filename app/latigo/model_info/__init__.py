@@ -49,3 +49,54 @@ class DevNullModelInfoProvider(ModelInfoProviderInterface):
         Return a list of predictions matching the given filter.
         """
         return []
+
+
+class SyntheticModelInfoProvider(ModelInfoProviderInterface):
+    """
+    Made up models for exercising the scheduler without Gordo: model_count models spread round robin over
+    project_count projects, optionally with a per model interval.
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.model_count = int(config.get("model_count", 10000))
+        self.project_count = max(1, int(config.get("project_count", 10)))
+        self.interval = config.get("interval", None)
+
+    def get_model_info(self, model_name: str):
+        """
+        Return any information about a named prediction
+        """
+        return {}
+
+    def get_models(self, filter: dict):
+        """
+        Return a list of predictions matching the given filter.
+        """
+        projects = set((filter or {}).get("projects", None) or [])
+        models = []
+        for number in range(self.model_count):
+            project_name = f"project-{number % self.project_count}"
+            if projects and project_name not in projects:
+                continue
+            model = {"name": f"model-{number}", "project": project_name}
+            if self.interval:
+                model["interval"] = self.interval
+            models.append(model)
+        return models
+
+
+def model_info_provider_factory(model_info_config):
+    model_info_type = model_info_config.get("type", None)
+    model_info = None
+    if "gordo" == model_info_type:
+        from latigo.gordo import GordoModelInfoProvider
+
+        model_info = GordoModelInfoProvider(model_info_config)
+    elif "mock" == model_info_type:
+        model_info = MockModelInfoProvider(model_info_config)
+    elif "synthetic" == model_info_type:
+        model_info = SyntheticModelInfoProvider(model_info_config)
+    else:
+        model_info = DevNullModelInfoProvider(model_info_config)
+    return model_info
@@ -1,8 +1,6 @@
 from datetime import datetime
 import random
 import typing
-import numpy as np
-import pandas as pd
 from pprint import pprint
 from dataclasses import dataclass
 
@@ -15,6 +13,16 @@ class PredictionExecutionProviderInterface:
         Train and/or run data through a given model
         """
 
+    def prewarm_models(self, model_keys: typing.Set[typing.Tuple[str, str]]):
+        """
+        Optionally load per model state for (project_name, model_name) pairs this executor is about to receive
+        """
+
+    def evict_models(self, model_keys: typing.Set[typing.Tuple[str, str]]):
+        """
+        Optionally drop per model state for (project_name, model_name) pairs this executor will no longer receive
+        """
+
 
 class MockPredictionExecutionProvider(PredictionExecutionProviderInterface):
     def __init__(self, sensor_data, prediction_storage, config: dict):
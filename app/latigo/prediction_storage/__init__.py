@@ -1,3 +1,4 @@
+import typing
 from latigo.types import PredictionData
 import logging
 
@@ -11,6 +12,19 @@ class PredictionStorageProviderInterface:
         """
         pass
 
+    def put_predictions_batch(self, prediction_data_list: typing.List[PredictionData]):
+        """
+        Store several prediction data at once, providers that can write them in one go override this
+        """
+        for prediction_data in prediction_data_list:
+            self.put_predictions(prediction_data)
+
+    def close(self):
+        """
+        Release whatever the provider holds on to, once no more predictions will be put
+        """
+        pass
+
 
 class MockPredictionStorageProvider(PredictionStorageProviderInterface):
     def __init__(self, config: dict):
@@ -53,4 +67,10 @@ def prediction_storage_provider_factory(prediction_storage_provider_config):
         prediction_storage_provider = MockPredictionStorageProvider(prediction_storage_provider_config)
     else:
         prediction_storage_provider = DevNullPredictionStorageProvider(prediction_storage_provider_config)
+
+    spool_config = prediction_storage_provider_config.get("spool", None)
+    if spool_config:
+        from latigo.prediction_storage.spool import SpoolingPredictionStorageProvider
+
+        prediction_storage_provider = SpoolingPredictionStorageProvider(prediction_storage_provider, spool_config)
     return prediction_storage_provider
@@ -0,0 +1,261 @@
+import os
+import pickle
+import struct
+import threading
+import logging
+import traceback
+import typing
+
+from latigo.types import PredictionData
+from latigo.prediction_storage import PredictionStorageProviderInterface
+
+logger = logging.getLogger(__name__)
+
+# Every record in the spool file is a 4 byte big endian length followed by that many bytes of pickled PredictionData
+_record_header = struct.Struct(">I")
+
+
+class SpoolFullError(Exception):
+    pass
+
+
+class PredictionSpool:
+    """
+    Append-only spool file of pickled prediction data with the drain position kept in a sidecar offset file.
+    Records before the offset have been delivered, records after it are pending and will be replayed on startup.
+    The spool belongs to one process at a time, enforced with an exclusive lock on a sidecar lock file.
+    """
+
+    def __init__(self, filename: str, max_bytes: int = 1024 * 1024 * 1024, compact_bytes: int = 64 * 1024 * 1024):
+        self.filename = filename
+        self.offset_filename = f"{filename}.offset"
+        self.max_bytes = max_bytes
+        self.compact_bytes = compact_bytes
+        self.lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file()
+        # Make sure the file exists so that readers never have to care
+        with open(self.filename, "ab"):
+            pass
+        self.offset = self._load_offset()
+
+    def _lock_file(self):
+        import fcntl
+
+        self.lock_file = open(f"{self.filename}.lock", "a")
+        try:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self.lock_file.close()
+            raise Exception(f"Spool {self.filename} is in use by another process, give every executor on the host its own spool filename")
+
+    def close(self):
+        """
+        Release the spool for other processes
+        """
+        if not self.lock_file.closed:
+            self.lock_file.close()
+
+    def _load_offset(self) -> int:
+        offset = 0
+        try:
+            with open(self.offset_filename, "r") as f:
+                offset = int(f.read().strip() or 0)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            logger.warning(f"Ignoring corrupt spool offset in {self.offset_filename}: {e}")
+        # Never trust an offset beyond what is actually on disk
+        return min(offset, self.size())
+
+    def _save_offset(self, offset: int):
+        tmp_filename = f"{self.offset_filename}.tmp"
+        with open(tmp_filename, "w") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, self.offset_filename)
+
+    def size(self) -> int:
+        return os.path.getsize(self.filename)
+
+    def pending_bytes(self) -> int:
+        return self.size() - self.offset
+
+    def append(self, prediction_data: PredictionData):
+        """
+        Durably append one record to the spool, raising SpoolFullError if it would grow beyond max_bytes
+        """
+        payload = pickle.dumps(prediction_data, protocol=pickle.HIGHEST_PROTOCOL)
+        record = _record_header.pack(len(payload)) + payload
+        with self.lock:
+            if self.max_bytes and self.size() + len(record) > self.max_bytes:
+                raise SpoolFullError(f"Spool {self.filename} is full ({self.size()} of {self.max_bytes} bytes used)")
+            with open(self.filename, "ab") as f:
+                f.write(record)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def read_batch(self, max_records: int) -> typing.List[typing.Tuple[PredictionData, int]]:
+        """
+        Read up to max_records pending records, returning each with the offset just past it
+        """
+        batch: typing.List[typing.Tuple[PredictionData, int]] = []
+        with open(self.filename, "rb") as f:
+            f.seek(self.offset)
+            position = self.offset
+            while len(batch) < max_records:
+                header = f.read(_record_header.size)
+                if len(header) < _record_header.size:
+                    break
+                (length,) = _record_header.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length:
+                    # Torn write at the tail, it will be completed or truncated later
+                    break
+                position += _record_header.size + length
+                batch.append((pickle.loads(payload), position))
+        return batch
+
+    def commit(self, offset: int):
+        """
+        Mark everything before offset as delivered, truncating the spool once it has been drained completely and
+        compacting it once the delivered part is at least compact_bytes and half of the file
+        """
+        with self.lock:
+            size = self.size()
+            if offset >= size:
+                with open(self.filename, "wb"):
+                    pass
+                offset = 0
+            elif self.compact_bytes and offset >= self.compact_bytes and offset * 2 >= size:
+                self._compact(offset)
+                offset = 0
+            self.offset = offset
+            self._save_offset(offset)
+
+    def _compact(self, offset: int):
+        """
+        Replace the spool with a copy of its pending part, which then starts at offset 0. Appends wait on the lock.
+        """
+        tmp_filename = f"{self.filename}.tmp"
+        with open(self.filename, "rb") as source, open(tmp_filename, "wb") as target:
+            source.seek(offset)
+            while True:
+                chunk = source.read(1024 * 1024)
+                if not chunk:
+                    break
+                target.write(chunk)
+            target.flush()
+            os.fsync(target.fileno())
+        # Save the offset before the swap, a crash in between replays delivered records rather than skipping pending ones
+        self._save_offset(0)
+        os.replace(tmp_filename, self.filename)
+
+
+class SpoolingPredictionStorageProvider(PredictionStorageProviderInterface):
+    """
+    Write-behind layer in front of another prediction storage provider. Predictions are acknowledged as soon as
+    they are safely in the local spool, and a background thread drains them to the wrapped provider in batches,
+    retrying with exponential backoff while it is unavailable. A batch that still fails after max_attempts is
+    delivered one record at a time, and records that fail while others in the batch go through are moved to the
+    dead letter spool so they cannot hold up everything behind them. When every record fails the storage is
+    taken to be down, nothing is dead lettered and the backoff carries on.
+    """
+
+    def __init__(self, prediction_storage_provider: PredictionStorageProviderInterface, config: dict):
+        self.config = config
+        if not self.config:
+            raise Exception("No spool config specified")
+        self.prediction_storage_provider = prediction_storage_provider
+        self.filename = self.config.get("filename", "/tmp/latigo/prediction_spool.bin")
+        self.batch_size = int(self.config.get("batch_size", 10))
+        self.retry_delay = float(self.config.get("retry_delay", 1))
+        self.retry_delay_max = float(self.config.get("retry_delay_max", 300))
+        self.max_attempts = int(self.config.get("max_attempts", 10))
+        self.spool = PredictionSpool(self.filename, int(self.config.get("max_bytes", 1024 * 1024 * 1024)), int(self.config.get("compact_bytes", 64 * 1024 * 1024)))
+        # Records that kept failing, in the same format so they can be replayed by pointing a spool at the file
+        self.dead_letters = PredictionSpool(self.config.get("dead_letter_filename", None) or f"{self.filename}.dead", max_bytes=0, compact_bytes=0)
+        self.dead_count = 0
+        # Failed attempts at delivering the batch at the head of the spool
+        self.head_attempts = 0
+        pending = self.spool.pending_bytes()
+        if pending > 0:
+            logger.info(f"Replaying {pending} bytes of spooled predictions from {self.filename}")
+        self.wakeup = threading.Event()
+        self.done = threading.Event()
+        self.drain_thread = threading.Thread(target=self._drain_loop, name="prediction-spool-drain", daemon=True)
+        self.drain_thread.start()
+
+    def put_predictions(self, prediction_data: PredictionData):
+        """
+        Spool the prediction data for delivery and return immediately
+        """
+        self.spool.append(prediction_data)
+        self.wakeup.set()
+
+    def drain(self) -> int:
+        """
+        Deliver one batch of spooled predictions to the wrapped provider in one call, returning how many records
+        left the spool
+        """
+        batch = self.spool.read_batch(self.batch_size)
+        if not batch:
+            return 0
+        try:
+            self.prediction_storage_provider.put_predictions_batch([prediction_data for prediction_data, _ in batch])
+        except Exception:
+            self.head_attempts += 1
+            if self.max_attempts and self.head_attempts >= self.max_attempts:
+                return self._isolate_poison(batch)
+            raise
+        self.head_attempts = 0
+        self.spool.commit(batch[-1][1])
+        return len(batch)
+
+    def _isolate_poison(self, batch: typing.List[typing.Tuple[PredictionData, int]]) -> int:
+        """
+        Deliver a batch that keeps failing one record at a time. Records that fail while others get through are
+        dead lettered, when none get through the last error is raised so the batch is retried after the backoff.
+        """
+        self.head_attempts = 0
+        failures: typing.List[typing.Tuple[PredictionData, Exception]] = []
+        for prediction_data, _ in batch:
+            try:
+                self.prediction_storage_provider.put_predictions(prediction_data)
+            except Exception as e:
+                failures.append((prediction_data, e))
+        if len(failures) == len(batch):
+            raise failures[-1][1]
+        # Dead letter before committing, a crash in between duplicates records rather than losing them
+        for prediction_data, error in failures:
+            self.dead_letters.append(prediction_data)
+            self.dead_count += 1
+            logger.error(f"Giving up on spooled predictions for '{prediction_data.name}' after {self.max_attempts} attempts, moved to {self.dead_letters.filename}: {error}")
+        self.spool.commit(batch[-1][1])
+        return len(batch)
+
+    def _drain_loop(self):
+        delay = self.retry_delay
+        while not self.done.is_set():
+            try:
+                if self.drain() > 0:
+                    delay = self.retry_delay
+                    continue
+                self.wakeup.wait(timeout=self.retry_delay)
+                self.wakeup.clear()
+            except Exception as e:
+                logger.error(f"Could not drain prediction spool {self.filename}, retrying in {delay} seconds: {e}")
+                traceback.print_exc()
+                self.done.wait(delay)
+                delay = min(delay * 2, self.retry_delay_max)
+
+    def close(self, timeout: typing.Optional[float] = None):
+        self.done.set()
+        self.wakeup.set()
+        self.drain_thread.join(timeout)
+        if not self.drain_thread.is_alive():
+            self.spool.close()
+            self.dead_letters.close()
+        self.prediction_storage_provider.close()
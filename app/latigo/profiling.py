@@ -0,0 +1,263 @@
+import os
+import re
+import sys
+import time
+import signal
+import logging
+import threading
+import typing
+from collections import Counter
+
+from latigo.types import Task
+from latigo.utils import parse_time_delta
+
+logger = logging.getLogger(__name__)
+
+
+def _file_safe(value: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_.-]", "_", str(value))
+
+
+def _timestamp() -> str:
+    now = time.time()
+    return time.strftime("%Y%m%dT%H%M%S", time.gmtime(now)) + f"{int(now * 1000) % 1000:03d}Z"
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread of the process from a background thread for a time window and writes them
+    in folded format ("thread;outermost;...;innermost count" per line), which flamegraph.pl and speedscope read.
+    Costs nothing until started, as it only looks at frames while a window is open.
+    """
+
+    def __init__(self, directory: str, interval: float = 0.01):
+        self.directory = directory
+        self.interval = interval
+        self.thread: typing.Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+        self.last_filename: typing.Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, seconds: float) -> bool:
+        """
+        Open a sampling window of seconds, unless one is open already
+        """
+        with self.lock:
+            if self.running:
+                return False
+            self.thread = threading.Thread(target=self._sample, args=(seconds,), name="sampling-profiler", daemon=True)
+            self.thread.start()
+        logger.info(f"Sampling stacks every {self.interval * 1000:.0f}ms for {seconds:.0f}s")
+        return True
+
+    def join(self, timeout: typing.Optional[float] = None):
+        thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _sample(self, seconds: float):
+        own_id = threading.get_ident()
+        stacks: typing.Counter[str] = Counter()
+        sample_count = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                stacks[";".join(reversed(stack))] += 1
+            sample_count += 1
+            time.sleep(self.interval)
+        filename = os.path.join(self.directory, f"{_timestamp()}-sampling.folded")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(filename, "w") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        except Exception as e:
+            logger.error(f"Could not write stack samples to {filename}: {e}")
+            return
+        self.last_filename = filename
+        logger.info(f"Wrote {sample_count} stack samples to {filename}")
+
+
+class _NullCapture:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_null_capture = _NullCapture()
+
+
+class _SlowTaskCapture:
+    """
+    Runs cProfile over one task and keeps the profile, plus a tracemalloc snapshot, only if the task turned out slow
+    """
+
+    __slots__ = ("profiler", "task", "cprofile", "started")
+
+    def __init__(self, profiler: "Profiler", task: Task):
+        self.profiler = profiler
+        self.task = task
+
+    def __enter__(self):
+        import cProfile
+
+        self.cprofile = cProfile.Profile()
+        self.started = time.perf_counter()
+        try:
+            self.cprofile.enable()
+        except ValueError as e:
+            # Another profiler already hooks this thread
+            logger.warning(f"Could not profile task for '{self.task.project_name}.{self.task.model_name}': {e}")
+            self.cprofile = None
+        return self
+
+    def __exit__(self, *exc):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        duration = time.perf_counter() - self.started
+        if duration >= self.profiler.slow_task_threshold:
+            self.profiler.save_slow_task(self.task, duration, self.cprofile)
+
+
+class Profiler:
+    """
+    Opt-in profiling for the executor: stack sampling for a time window on a signal or HTTP request, and cProfile
+    plus tracemalloc captures of tasks slower than slow_task_threshold. Everything is off unless configured, and
+    task() is then a shared no-op context manager. The HTTP trigger has its own port, on localhost unless http_host
+    says otherwise, as it takes unauthenticated requests.
+    """
+
+    def __init__(self, config: typing.Optional[dict]):
+        config = config or {}
+        self.directory = config.get("directory", None) or "/tmp/latigo/profiles"
+        self.sampling_window = parse_time_delta(config.get("sampling_window", "30s")).total_seconds()
+        self.max_sampling_window = parse_time_delta(config.get("max_sampling_window", "10m")).total_seconds()
+        self.sampler = SamplingProfiler(self.directory, float(config.get("sampling_interval", 0.01)))
+        self.signal_name = config.get("signal", None)
+        slow_task_threshold = config.get("slow_task_threshold", None)
+        self.slow_task_threshold = parse_time_delta(slow_task_threshold).total_seconds() if slow_task_threshold else None
+        self.tracemalloc_frames = int(config.get("tracemalloc_frames", 0) or 0)
+        self.http_host = config.get("http_host", None) or "127.0.0.1"
+        self.http_port = config.get("http_port", None)
+        self.server = None
+        self.slow_task_count = 0
+        self.started_tracemalloc = False
+        self.signal_installed = False
+        self.previous_handler = None
+
+    @property
+    def captures_slow_tasks(self) -> bool:
+        return self.slow_task_threshold is not None
+
+    def start(self):
+        """
+        Install the signal and HTTP triggers and start tracing allocations, if configured
+        """
+        if self.signal_name:
+            try:
+                self.previous_handler = signal.signal(getattr(signal, self.signal_name), self._on_signal)
+                self.signal_installed = True
+                logger.info(f"Sampling profiler starts on {self.signal_name} (kill -{self.signal_name[3:]} {os.getpid()})")
+            except (AttributeError, ValueError) as e:
+                # Unknown signal, or not running in the main thread
+                logger.warning(f"Could not install profiling trigger on {self.signal_name}: {e}")
+        if self.http_port is not None:
+            from latigo.metrics import MetricsServer
+
+            try:
+                self.server = MetricsServer(None, self.http_host, int(self.http_port), {"/profile": self.handle_request})
+                logger.info(f"Sampling profiler starts on POST http://{self.http_host}:{self.server.port}/profile?seconds={self.sampling_window:.0f}")
+            except OSError as e:
+                logger.error(f"Could not serve profiling trigger on port {self.http_port}: {e}")
+        if self.captures_slow_tasks and self.tracemalloc_frames > 0:
+            import tracemalloc
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.tracemalloc_frames)
+                self.started_tracemalloc = True
+
+    def stop(self):
+        if self.signal_installed:
+            signal.signal(getattr(signal, self.signal_name), self.previous_handler if self.previous_handler is not None else signal.SIG_DFL)
+            self.signal_installed = False
+        if self.server:
+            self.server.stop()
+            self.server = None
+        if self.started_tracemalloc:
+            import tracemalloc
+
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+
+    def _on_signal(self, signum, frame):
+        self.sample(self.sampling_window)
+
+    def sample(self, seconds: typing.Optional[float] = None) -> bool:
+        """
+        Open a stack sampling window, at most max_sampling_window long
+        """
+        return self.sampler.start(min(seconds or self.sampling_window, self.max_sampling_window))
+
+    def handle_request(self, query: typing.Dict[str, str]) -> typing.Tuple[int, str]:
+        """
+        HTTP trigger, POST /profile?seconds=30
+        """
+        try:
+            seconds = float(query["seconds"]) if "seconds" in query else None
+        except ValueError:
+            return 400, f"Invalid seconds '{query['seconds']}'\n"
+        if not self.sample(seconds):
+            return 409, "Sampling already running\n"
+        return 202, f"Sampling into {self.directory}\n"
+
+    def task(self, task: Task):
+        """
+        Context manager around processing a task, capturing it if it turns out slow
+        """
+        if self.slow_task_threshold is None:
+            return _null_capture
+        return _SlowTaskCapture(self, task)
+
+    def save_slow_task(self, task: Task, duration: float, cprofile=None) -> typing.List[str]:
+        """
+        Write the cProfile stats and a tracemalloc snapshot of a slow task, named after its project and model
+        """
+        self.slow_task_count += 1
+        base = os.path.join(self.directory, f"{_timestamp()}-{_file_safe(task.project_name)}-{_file_safe(task.model_name)}")
+        filenames = []
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if cprofile is not None:
+                cprofile.dump_stats(f"{base}.prof")
+                filenames.append(f"{base}.prof")
+            if self.tracemalloc_frames > 0:
+                import tracemalloc
+
+                if tracemalloc.is_tracing():
+                    tracemalloc.take_snapshot().dump(f"{base}.tracemalloc")
+                    filenames.append(f"{base}.tracemalloc")
+        except Exception as e:
+            logger.error(f"Could not save profile of slow task for '{task.project_name}.{task.model_name}': {e}")
+        logger.warning(f"Task for '{task.project_name}.{task.model_name}' took {duration:.1f}s, profile saved to {', '.join(filenames) or 'nothing'}")
+        return filenames
+
+    def stats(self) -> dict:
+        return {"sampling": self.sampler.running, "slow_tasks": self.slow_task_count}
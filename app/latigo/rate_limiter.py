@@ -0,0 +1,206 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import typing
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+
+def retry_after_seconds(headers: typing.Optional[typing.Mapping[str, str]], default: float = 1.0) -> float:
+    """
+    Parse the Retry-After header, which may be either a number of seconds or a HTTP date
+    """
+    value = headers.get("Retry-After") if headers else None
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        logger.warning(f"Could not parse Retry-After header '{value}', using {default} seconds")
+        return default
+
+
+class RateLimiterInterface:
+    def reserve(self, tokens: float = 1) -> float:
+        """
+        Take tokens from the bucket and return the number of seconds the caller must wait before using them
+        """
+        return 0.0
+
+    def penalize(self, seconds: float):
+        """
+        Block all callers for the given number of seconds, typically as requested by a Retry-After header
+        """
+
+    def acquire(self, tokens: float = 1) -> float:
+        """
+        Block the calling thread until tokens are available, returning the time spent throttled
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens: float = 1) -> float:
+        """
+        Suspend the calling coroutine until tokens are available, returning the time spent throttled
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def stats(self) -> dict:
+        return {}
+
+
+class DevNullRateLimiter(RateLimiterInterface):
+    def __init__(self, name: str = "unlimited"):
+        self.name = name
+
+
+class TokenBucketRateLimiter(RateLimiterInterface):
+    """
+    Token bucket shared by all threads and coroutines in this process. Tokens are reserved up front so callers
+    that have to wait queue up fairly behind each other instead of waking up together.
+    """
+
+    def __init__(self, name: str, rate: float, burst: typing.Optional[float] = None):
+        if rate <= 0:
+            raise Exception(f"Rate limiter '{name}' needs a positive rate, got {rate}")
+        self.name = name
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.lock = threading.Lock()
+        self.tokens = self.burst
+        self.last_time = time.monotonic()
+        self.blocked_until = 0.0
+        self.throttled_seconds = 0.0
+        self.throttled_count = 0
+        self.acquired_count = 0
+
+    def _take(self, tokens: float, now: float) -> float:
+        self.tokens = min(self.burst, self.tokens + (now - self.last_time) * self.rate)
+        self.last_time = now
+        self.tokens -= tokens
+        wait = max(0.0, -self.tokens / self.rate, self.blocked_until - now)
+        return wait
+
+    def _account(self, wait: float):
+        self.acquired_count += 1
+        if wait > 0:
+            self.throttled_count += 1
+            self.throttled_seconds += wait
+
+    def reserve(self, tokens: float = 1) -> float:
+        with self.lock:
+            wait = self._take(tokens, time.monotonic())
+            self._account(wait)
+        return wait
+
+    def penalize(self, seconds: float):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        logger.warning(f"Rate limiter '{self.name}' blocked for {seconds:.1f} seconds by upstream")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"name": self.name, "rate": self.rate, "burst": self.burst, "acquired": self.acquired_count, "throttled": self.throttled_count, "throttled_seconds": self.throttled_seconds}
+
+
+class FileTokenBucketRateLimiter(TokenBucketRateLimiter):
+    """
+    Token bucket whose state lives in a small file guarded by an exclusive lock,
+    so that every process on the node shares the same budget.
+    """
+
+    def __init__(self, name: str, rate: float, burst: typing.Optional[float] = None, filename: str = ""):
+        super().__init__(name, rate, burst)
+        if not filename:
+            raise Exception(f"No shared_file specified for rate limiter '{name}'")
+        self.filename = filename
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+
+    def _transact(self, function: typing.Callable[[float], float]) -> float:
+        import fcntl
+
+        with self.lock, open(self.filename, "a+") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                parts = f.read().split()
+                now = time.time()
+                if len(parts) == 3:
+                    self.tokens, self.last_time, self.blocked_until = (float(part) for part in parts)
+                else:
+                    self.tokens, self.last_time, self.blocked_until = self.burst, now, 0.0
+                ret = function(now)
+                f.seek(0)
+                f.truncate()
+                f.write(f"{self.tokens} {self.last_time} {self.blocked_until}")
+                f.flush()
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        return ret
+
+    async def acquire_async(self, tokens: float = 1) -> float:
+        # Taking the file lock blocks, so it happens on a worker thread rather than on the event loop
+        wait = await asyncio.get_event_loop().run_in_executor(None, self.reserve, tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def reserve(self, tokens: float = 1) -> float:
+        wait = self._transact(lambda now: self._take(tokens, now))
+        with self.lock:
+            self._account(wait)
+        return wait
+
+    def penalize(self, seconds: float):
+        def block(now: float) -> float:
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            return 0.0
+
+        self._transact(block)
+        logger.warning(f"Rate limiter '{self.name}' blocked for {seconds:.1f} seconds by upstream")
+
+
+rate_limiters_lock = threading.Lock()
+rate_limiters_by_name: typing.Dict[str, RateLimiterInterface] = {}
+
+
+def rate_limiter_factory(name: str, rate_limit_config: typing.Optional[dict]) -> RateLimiterInterface:
+    rate_limit_config = rate_limit_config or {}
+    rate = rate_limit_config.get("rate", None)
+    if not rate:
+        return DevNullRateLimiter(name)
+    burst = rate_limit_config.get("burst", None)
+    shared_file = rate_limit_config.get("shared_file", None)
+    if shared_file:
+        return FileTokenBucketRateLimiter(name, rate, burst, shared_file.format(name=name.replace(":", "_").replace("/", "_")))
+    return TokenBucketRateLimiter(name, rate, burst)
+
+
+def get_rate_limiter(name: str, rate_limit_config: typing.Optional[dict] = None) -> RateLimiterInterface:
+    """
+    Return the process wide rate limiter for the named upstream, creating it from config on first use
+    """
+    with rate_limiters_lock:
+        rate_limiter = rate_limiters_by_name.get(name, None)
+        if not rate_limiter:
+            rate_limiter = rate_limiter_factory(name, rate_limit_config)
+            rate_limiters_by_name[name] = rate_limiter
+    return rate_limiter
+
+
+def rate_limiter_stats() -> typing.List[dict]:
+    with rate_limiters_lock:
+        rate_limiters = list(rate_limiters_by_name.values())
+    return [rate_limiter.stats() for rate_limiter in rate_limiters if rate_limiter.stats()]
@@ -1,16 +1,24 @@
+import math
 import traceback
 import time
+import asyncio
 import logging
 import pprint
 import typing
-import pandas as pd
 from datetime import datetime, timedelta
 from os import environ
 from latigo.types import Task
 from latigo.task_queue import task_queue_sender_factory
+from latigo.model_info import model_info_provider_factory
+from latigo.metrics import registry as metrics_registry, start_metrics_server
+from latigo.tracing import new_trace_id
 
-from latigo.utils import Timer, human_delta
-from latigo.gordo import GordoModelInfoProvider
+from latigo.utils import human_delta, parse_time_delta
+from latigo.scheduler.timing import Clock, DeadlineHeap, model_phase, phase_delay
+from latigo.scheduler.fair import FairQueue
+from latigo.scheduler.membership import ConsistentHashRing, membership_factory, default_instance_id
+
+ModelKey = typing.Tuple[str, str]
 
 logger = logging.getLogger(__name__)
 
@@ -22,17 +30,11 @@ class Scheduler:
         self.model_info_config = self.config.get("model_info", None)
         if not self.model_info_config:
             raise Exception("No model info config specified")
-        model_info_type = self.model_info_config.get("type", None)
-        self.model_info = None
+        self.model_info = model_info_provider_factory(self.model_info_config)
         self.model_filter = {}
-        self.model_filter["projects"] = []
-        if "gordo" == model_info_type:
-            self.model_info = GordoModelInfoProvider(self.model_info_config)
-            self.model_filter["projects"] = self.model_info_config.get("projects", [])
-            logger.info("FILTER:")
-            logger.info(self.model_filter["projects"])
-        else:
-            self.model_info = DevNullModelInfo(self.model_info_config)
+        self.model_filter["projects"] = self.model_info_config.get("projects", None) or []
+        if self.model_filter["projects"]:
+            logger.info(f"Only scheduling models in projects {self.model_filter['projects']}")
         self.idle_time = datetime.now()
         self.idle_number = 0
         if not self.model_info:
@@ -55,11 +57,59 @@ class Scheduler:
         if not self.scheduler_config:
             raise Exception("No scheduler config specified")
         self.name = self.scheduler_config.get("name", "unnamed_scheduler")
-        self.configuration_sync_interval = pd.to_timedelta(self.scheduler_config.get("configuration_sync_interval", "1m"))
-        self.continuous_prediction_interval = pd.to_timedelta(self.scheduler_config.get("continuous_prediction_interval", "30m"))
-        selfdback_fill_max_interval = pd.to_timedelta(self.scheduler_config.get("back_fill_max_interval", "1d"))
-        self.configuration_sync_timer = Timer(self.configuration_sync_interval)
-        self.continuous_prediction_timer = Timer(self.continuous_prediction_interval)
+        self.configuration_sync_interval = parse_time_delta(self.scheduler_config.get("configuration_sync_interval", "1m"))
+        self.continuous_prediction_interval = parse_time_delta(self.scheduler_config.get("continuous_prediction_interval", "30m"))
+        self.back_fill_max_interval = parse_time_delta(self.scheduler_config.get("back_fill_max_interval", "1d"))
+        self.prediction_window = parse_time_delta(self.scheduler_config.get("prediction_window", "30m"))
+        # Spread models over their interval instead of emitting them all at once, optionally capping tasks per second per project
+        self.spread_emission = self.scheduler_config.get("spread_emission", True)
+        self.project_rate_limits: typing.Dict[str, float] = {project: float(rate) for project, rate in (self.scheduler_config.get("project_rate_limits", None) or {}).items()}
+        self.project_next_slot: typing.Dict[str, float] = {}
+        # Models held back by a project rate limit, with the deadline they were originally due at
+        self.rate_limited: typing.Dict[ModelKey, float] = {}
+        # Due tasks wait in a fair queue, and leave it at no more than max_task_rate per second when that is set
+        self.fair_queueing_config = self.scheduler_config.get("fair_queueing", None) or {}
+        self.ready_tasks = FairQueue(self.fair_queueing_config)
+        self.model_deadlines = {model: parse_time_delta(deadline).total_seconds() for model, deadline in (self.fair_queueing_config.get("model_deadlines", None) or {}).items()}
+        self.max_task_rate = float(self.scheduler_config.get("max_task_rate", 0) or 0)
+        # The bucket holds at least one task, so a rate below one task per second still emits now and then
+        self.emit_burst = max(1.0, float(self.scheduler_config.get("max_task_burst", None) or self.max_task_rate))
+        self.emit_tokens = self.emit_burst
+        self.emit_tokens_time: typing.Optional[float] = None
+        # Stop emitting while the executors' backlog is above max_lag, until it drops to resume_lag again
+        self.backpressure_config = self.scheduler_config.get("backpressure", None) or {}
+        self.max_lag = int(self.backpressure_config.get("max_lag", 0) or 0)
+        self.resume_lag = int(self.backpressure_config.get("resume_lag", None) or self.max_lag // 2)
+        self.lag_check_interval = parse_time_delta(self.backpressure_config.get("check_interval", "10s")).total_seconds()
+        self.throttled = False
+        self.last_lag: typing.Optional[int] = None
+        # Sharded mode, several instances each own a consistent hash slice of the models
+        self.sharding_config = self.scheduler_config.get("sharding", None) or {}
+        self.instance_id = self.sharding_config.get("instance_id", None) or default_instance_id()
+        self.membership = membership_factory(self.instance_id, self.sharding_config)
+        self.heartbeat_interval = parse_time_delta(self.sharding_config.get("heartbeat_interval", "10s")).total_seconds()
+        self.virtual_nodes = int(self.sharding_config.get("virtual_nodes", 100))
+        self.members: typing.List[str] = [self.instance_id]
+        self.ring: typing.Optional[ConsistentHashRing] = None
+        # When our lease was last renewed, on the monotonic clock. Once it may have run out we own nothing until renewed.
+        self.last_heartbeat: typing.Optional[float] = None
+        self.lease_lost = False
+        # Every model has its own deadline on the monotonic clock, kept in a heap
+        self.clock = Clock()
+        self.deadlines = DeadlineHeap()
+        self.model_index: typing.Dict[ModelKey, typing.Dict] = {}
+        self.done = False
+        self.schedule_changed: typing.Optional[asyncio.Event] = None
+        self.stopping: typing.Optional[asyncio.Event] = None
+
+    # Inflate metrics from config
+    def _prepare_metrics(self):
+        self.metrics_config = self.config.get("metrics", None) or {}
+        phase_seconds = metrics_registry.histogram("latigo_scheduler_phase_seconds", "Seconds spent in each scheduler phase", ["phase"])
+        self.phase_seconds = {phase: phase_seconds.labels(phase) for phase in ["sync", "update_schedule", "step", "send", "lag_check"]}
+        tasks = metrics_registry.counter("latigo_scheduler_tasks_total", "Tasks by whether they could be put on the task queue", ["outcome"])
+        self.task_outcomes = {outcome: tasks.labels(outcome) for outcome in ["sent", "failed"]}
+        metrics_registry.add_collector("latigo_scheduler", self.stats)
 
     def __init__(self, config: dict):
         if not config:
@@ -68,69 +118,332 @@ class Scheduler:
         self._prepare_task_queue()
         self._prepare_model_info()
         self._prepare_scheduler()
+        self._prepare_metrics()
         self.task_serial = 0
         self.models: typing.List[typing.Dict] = []
+        self.owned_models: typing.List[typing.Dict] = []
+
+    @staticmethod
+    def _model_key(model: typing.Dict) -> ModelKey:
+        return (model.get("project", "unnamed"), model.get("name", "unnamed"))
+
+    def _model_interval(self, model: typing.Dict) -> float:
+        """
+        Seconds between predictions for one model, models may override the configured continuous_prediction_interval
+        """
+        interval = model.get("interval", None)
+        return parse_time_delta(interval).total_seconds() if interval else self.continuous_prediction_interval.total_seconds()
+
+    def _first_deadline(self, key: ModelKey, model: typing.Dict, now: float) -> float:
+        if not self.spread_emission:
+            return now
+        return now + phase_delay(self.clock.time(), self._model_interval(model), model_phase(*key))
+
+    def _next_deadline(self, deadline: float, interval: float, now: float) -> float:
+        """
+        The next deadline on the model's cadence after now, skipping slots missed while we were behind rather than bursting
+        """
+        interval = max(interval, 0.001)
+        next_deadline = deadline + interval
+        if next_deadline <= now:
+            next_deadline += math.floor((now - next_deadline) / interval + 1) * interval
+        return next_deadline
+
+    def _model_deadline(self, key: ModelKey, model: typing.Dict) -> float:
+        """
+        How long after coming due a model's task should be out, from the model itself, fair_queueing.model_deadlines or its interval
+        """
+        if model.get("deadline", None):
+            return parse_time_delta(model["deadline"]).total_seconds()
+        return self.model_deadlines.get(f"{key[0]}/{key[1]}", None) or self._model_interval(model)
+
+    def _emit_budget(self, now: float) -> typing.Optional[int]:
+        """
+        How many tasks may leave the scheduler now, None when unlimited
+        """
+        if self.throttled:
+            return 0
+        if self.max_task_rate <= 0:
+            return None
+        if self.emit_tokens_time is not None:
+            self.emit_tokens = min(self.emit_burst, self.emit_tokens + (now - self.emit_tokens_time) * self.max_task_rate)
+        self.emit_tokens_time = now
+        return int(self.emit_tokens)
+
+    def _next_emit_time(self, now: float) -> typing.Optional[float]:
+        """
+        When the fair queue can next make progress, if it has tasks waiting for budget
+        """
+        if not self.ready_tasks or self.max_task_rate <= 0 or self.throttled:
+            return None
+        return now + max(0.0, 1.0 - self.emit_tokens) / self.max_task_rate
+
+    def _rate_limit_slot(self, project_name: str, now: float) -> float:
+        """
+        Claim the next free emission slot for a rate limited project, which may be now
+        """
+        slot = max(now, self.project_next_slot.get(project_name, now))
+        self.project_next_slot[project_name] = slot + 1.0 / self.project_rate_limits[project_name]
+        return slot
+
+    def _owns(self, key: ModelKey) -> bool:
+        if self.lease_lost:
+            return False
+        return self.ring is None or self.ring.owner(f"{key[0]}/{key[1]}") == self.instance_id
+
+    def update_members(self, members: typing.List[str]):
+        """
+        Rebuild the hash ring when instances come or go and take up or hand over our share of the models. Models
+        that move start on their phase aligned deadline, so the instances agree on when they are due.
+        """
+        members = sorted(set(members) | {self.instance_id})
+        if members == self.members:
+            return
+        logger.info(f"Scheduler instances changed from {self.members} to {members}")
+        self.members = members
+        self.ring = ConsistentHashRing(members, self.virtual_nodes) if len(members) > 1 else None
+        self.update_schedule(self.models)
+
+    def membership_renewed(self, members: typing.List[str], renewed_at: float):
+        """
+        A heartbeat started at renewed_at went through and returned the live instances
+        """
+        self.last_heartbeat = renewed_at
+        if self.lease_lost:
+            logger.info("Renewed scheduler membership, taking up our share of the models again")
+            self.lease_lost = False
+            # Rebuild even if the instances are the same as before we lost our lease
+            self.members = []
+        self.update_members(members)
+
+    def membership_failed(self, now: float):
+        """
+        A heartbeat failed. Once our lease could run out before the next one, the others may take over our share
+        any moment, so stop scheduling it rather than risk sending the same tasks twice.
+        """
+        lease_time = self.membership.lease_time
+        if self.lease_lost or lease_time is None or self.last_heartbeat is None:
+            return
+        if now + self.heartbeat_interval - self.last_heartbeat < lease_time:
+            return
+        logger.error(f"Scheduler membership lease runs out {self.last_heartbeat + lease_time - now:.0f}s from now, not scheduling any models until it is renewed")
+        self.lease_lost = True
+        self.update_schedule(self.models)
+
+    def update_schedule(self, models: typing.List[typing.Dict]):
+        """
+        Start deadlines for new models we own and drop those of models that disappeared or moved to another
+        instance, leaving the rest on their cadence
+        """
+        with self.phase_seconds["update_schedule"].time():
+            self._update_schedule(models)
+
+    def _update_schedule(self, models: typing.List[typing.Dict]):
+        now = self.clock.monotonic()
+        model_index = {key: model for key, model in ((self._model_key(model), model) for model in models) if self._owns(key)}
+        for key in self.model_index.keys() - model_index.keys():
+            self.deadlines.cancel(key)
+            self.rate_limited.pop(key, None)
+            self.ready_tasks.remove(key)
+        for key, model in model_index.items():
+            if key not in self.deadlines:
+                self.deadlines.schedule(key, self._first_deadline(key, model, now))
+        self.model_index = model_index
+        self.models = models
+        self.owned_models = list(model_index.values())
+        if self.schedule_changed:
+            self.schedule_changed.set()
 
     def synchronize_configuration(self):
-        self.models = self.model_info.get_models(self.model_filter)
-        logger.info(f"Found {len(self.models)} models")
-        # logger.info(pprint.pformat(self.models))
+        with self.phase_seconds["sync"].time():
+            models = self.model_info.get_models(self.model_filter)
+            logger.info(f"Found {len(models)} models")
+            self.update_schedule(models)
+
+    def _make_task(self, key: ModelKey, now: float) -> Task:
+        from_us = int(now * 1000000)
+        return Task.from_epoch_us(key[0], key[1], from_us, from_us + int(self.prediction_window.total_seconds() * 1000000))
+
+    def perform_prediction_step(self) -> int:
+        """
+        Queue a task for every model whose deadline has passed and schedule its next one, then send as many
+        queued tasks as the emission budget allows in fair order, returning how many were sent
+        """
+        with self.phase_seconds["step"].time():
+            return self._perform_prediction_step()
+
+    def _perform_prediction_step(self) -> int:
+        now = self.clock.monotonic()
+        wall_now = self.clock.time()
+        due = self.deadlines.pop_due(now)
+        for deadline, key in due:
+            model = self.model_index.get(key, None)
+            if model is None:
+                continue
+            project_name, model_name = key
+            if key in self.rate_limited:
+                # This model already holds a slot, and its cadence follows the deadline it was originally due at
+                deadline = self.rate_limited.pop(key)
+            elif project_name in self.project_rate_limits:
+                slot = self._rate_limit_slot(project_name, now)
+                if slot > now:
+                    self.rate_limited[key] = deadline
+                    self.deadlines.schedule(key, slot)
+                    continue
+            self.deadlines.schedule(key, self._next_deadline(deadline, self._model_interval(model), now))
+            # A model still queued from its previous deadline is replaced by the fresher task
+            self.ready_tasks.push(key, self._make_task(key, wall_now), deadline + self._model_deadline(key, model))
+        return self._send_ready_tasks(now)
 
-    def perform_prediction_step(self):
+    def _send_ready_tasks(self, now: float) -> int:
         stats_projects_ok = {}
         stats_models_ok = {}
         stats_projects_bad = {}
         stats_models_bad = {}
         stats_start_time = datetime.now()
-        prediction_start_time = datetime.now()
-        prediction_end_time = prediction_start_time + timedelta(seconds=60 * 30)
-        for model in self.models:
-            model_name = model.get("name", "unnamed")
-            project_name = model.get("project", "unnamed")
-            task = Task(project_name=project_name, model_name=model_name, from_time=prediction_start_time, to_time=prediction_end_time)
+        budget = self._emit_budget(now)
+        tasks = self.ready_tasks.pop(budget)
+        if budget is not None:
+            self.emit_tokens -= len(tasks)
+        for task in tasks:
+            project_name, model_name = task.project_name, task.model_name
             try:
-                self.task_queue.put_task(task)
+                # Every task starts a trace the executor picks up, stamped with when it entered the queue
+                task = task.traced(new_trace_id(), int(self.clock.time() * 1000000))
+                with self.phase_seconds["send"].time():
+                    self.task_queue.put_task(task)
                 self.task_serial += 1
+                self.task_outcomes["sent"].inc()
                 # logger.info(f"Enqueued '{model_name}' in '{project_name}'")
                 stats_projects_ok[project_name] = stats_projects_ok.get(project_name, 0) + 1
                 stats_models_ok[model_name] = stats_models_ok.get(model_name, 0) + 1
             except Exception as e:
                 # logger.error(f"Could not send task: {e}")
                 # traceback.print_exc()
+                self.task_outcomes["failed"].inc()
                 stats_projects_bad[project_name] = stats_projects_bad.get(project_name, 0) + 1
                 stats_models_bad[model_name] = stats_models_bad.get(model_name, 0) + 1
-        stats_interval = datetime.now() - stats_start_time
-        logger.info(f"Scheduled {len(stats_models_ok)} models in {len(stats_projects_ok)} projects in {human_delta(stats_interval)}")
+        if tasks and logger.isEnabledFor(logging.DEBUG):
+            stats_interval = datetime.now() - stats_start_time
+            # With emission spread out this runs for a handful of models at a time, the sync loop logs the totals
+            logger.debug(f"Scheduled {len(stats_models_ok)} models in {len(stats_projects_ok)} projects in {human_delta(stats_interval)}")
         if len(stats_models_bad) > 0 or len(stats_projects_bad) > 0:
             logger.error(f"          {len(stats_models_bad)} models in {len(stats_projects_bad)} projects failed")
+        return len(tasks)
 
-    def run(self):
-        logger.info(f"Starting {self.__class__.__name__}")
-        logger.info(f"Configuration sync: {self.configuration_sync_timer}")
-        logger.info(f"Prediction step: {self.continuous_prediction_timer}")
-        done = False
-        while not done:
+    async def _configuration_sync_loop(self):
+        loop = asyncio.get_event_loop()
+        last_task_serial = self.task_serial
+        while not self.done:
+            started = self.clock.monotonic()
+            logger.info(f"Scheduled {self.task_serial - last_task_serial} tasks since last configuration sync, {len(self.deadlines)} models pending, {len(self.rate_limited)} held back by rate limits, {len(self.ready_tasks)} waiting in fair queue, lag {self.last_lag}{' (throttled)' if self.throttled else ''}")
+            last_task_serial = self.task_serial
+            try:
+                # Fetching models blocks on HTTP, so run it in a thread and keep scheduling meanwhile
+                sync_started = time.perf_counter()
+                models = await loop.run_in_executor(None, self.model_info.get_models, self.model_filter)
+                logger.info(f"Found {len(models)} models")
+                self.update_schedule(models)
+                self.phase_seconds["sync"].observe(time.perf_counter() - sync_started)
+                if self.ring is not None:
+                    logger.info(f"Own {len(self.model_index)} of them as one of {len(self.members)} scheduler instances")
+            except Exception as e:
+                logger.error(f"Could not synchronize configuration: {e}")
+                traceback.print_exc()
+            await self.clock.wait(self.stopping, self.configuration_sync_interval.total_seconds() - (self.clock.monotonic() - started))
+
+    def update_backpressure(self, lag: typing.Optional[int]):
+        """
+        Throttle emission on executor backlog, with hysteresis so we do not flap around max_lag. While throttled
+        due tasks wait in the fair queue, where each model only keeps its freshest task.
+        """
+        self.last_lag = lag
+        if lag is None or self.max_lag <= 0:
+            return
+        if not self.throttled and lag > self.max_lag:
+            self.throttled = True
+            logger.warning(f"Executors are {lag} tasks behind (more than {self.max_lag}), holding back new tasks")
+        elif self.throttled and lag <= self.resume_lag:
+            self.throttled = False
+            logger.info(f"Executors caught up to {lag} tasks behind, resuming emission of {len(self.ready_tasks)} queued tasks")
+            if self.schedule_changed:
+                self.schedule_changed.set()
+
+    async def _backpressure_loop(self):
+        if self.max_lag <= 0:
+            return
+        loop = asyncio.get_event_loop()
+        while not self.done:
+            try:
+                # Looking up lag talks to the broker, so keep it off the event loop
+                lag_check_started = time.perf_counter()
+                lag = await loop.run_in_executor(None, self.task_queue.lag)
+                self.phase_seconds["lag_check"].observe(time.perf_counter() - lag_check_started)
+                self.update_backpressure(lag)
+            except Exception as e:
+                logger.error(f"Could not check task queue lag: {e}")
+            await self.clock.wait(self.stopping, self.lag_check_interval)
+
+    async def _prediction_loop(self):
+        while not self.done:
             try:
-                if self.configuration_sync_timer.is_triggered():
-                    # Restart timer
-                    self.configuration_sync_timer.start()
-                    # Do the configuratio sync
-                    self.synchronize_configuration()
-
-                if self.continuous_prediction_timer.is_triggered():
-                    # Restart timer
-                    self.continuous_prediction_timer.start()
-                    # Do the prediction task queueing
-                    self.perform_prediction_step()
-
-                time.sleep(1)
-
-            except KeyboardInterrupt:
-                logger.info("Keyboard abort triggered, shutting down")
-                done = True
+                self.perform_prediction_step()
             except Exception as e:
                 logger.error("-----------------------------------")
                 logger.error(f"Error occurred in scheduler: {e}")
                 traceback.print_exc()
                 logger.error("")
+            # Sleep until the next model is due or queued tasks may go out, or the set of models changes
+            now = self.clock.monotonic()
+            wake_times = [t for t in [self.deadlines.next_deadline(), self._next_emit_time(now)] if t is not None]
+            self.schedule_changed.clear()
+            await self.clock.wait(self.schedule_changed, min(wake_times) - now if wake_times else None)
+
+    async def _membership_loop(self):
+        loop = asyncio.get_event_loop()
+        while not self.done:
+            await self.clock.wait(self.stopping, self.heartbeat_interval)
+            if self.done:
+                break
+            started = self.clock.monotonic()
+            try:
+                members = await loop.run_in_executor(None, self.membership.heartbeat)
+            except Exception as e:
+                logger.error(f"Could not renew scheduler membership: {e}")
+                self.membership_failed(self.clock.monotonic())
+                continue
+            self.membership_renewed(members, started)
+
+    async def run_async(self):
+        self.schedule_changed = asyncio.Event()
+        self.stopping = asyncio.Event()
+        # Know who else is around before the first sync, so we never start out scheduling everything
+        loop = asyncio.get_event_loop()
+        started = self.clock.monotonic()
+        self.membership_renewed(await loop.run_in_executor(None, self.membership.heartbeat), started)
+        try:
+            await asyncio.gather(self._configuration_sync_loop(), self._prediction_loop(), self._backpressure_loop(), self._membership_loop())
+        finally:
+            self.membership.leave()
+
+    def stats(self) -> dict:
+        return {"models": len(self.models), "owned_models": len(self.model_index), "pending_models": len(self.deadlines), "rate_limited_models": len(self.rate_limited), "queued_tasks": len(self.ready_tasks), "superseded_tasks": self.ready_tasks.superseded_count, "sent_tasks": self.task_serial, "lag": self.last_lag, "throttled": self.throttled, "instances": len(self.members), "lease_lost": self.lease_lost}
+
+    def stop(self):
+        self.done = True
+        for event in [self.stopping, self.schedule_changed]:
+            if event:
+                event.set()
+
+    def run(self):
+        logger.info(f"Starting {self.__class__.__name__}")
+        logger.info(f"Configuration sync every {human_delta(self.configuration_sync_interval)}, predictions every {human_delta(self.continuous_prediction_interval)} unless overridden per model")
+        metrics_server = start_metrics_server(self.metrics_config)
+        try:
+            asyncio.run(self.run_async())
+        except KeyboardInterrupt:
+            logger.info("Keyboard abort triggered, shutting down")
+        finally:
+            if metrics_server:
+                metrics_server.stop()
         logger.info(f"Stopping {self.__class__.__name__}")
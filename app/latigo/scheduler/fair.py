@@ -0,0 +1,144 @@
+import heapq
+import logging
+import typing
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+ModelKey = typing.Tuple[str, str]
+
+
+class FairQueue:
+    """
+    Tasks waiting to leave the scheduler, one per model, served fairly between projects.
+
+    Projects with a higher priority are always served first. Projects of equal priority take turns in
+    deficit round robin order, each turn allowing quantum * weight tasks, so a project with thousands of
+    models cannot starve one with a handful. Within a project the most urgent model goes first, where
+    urgency is the time by which its prediction should have been emitted.
+    """
+
+    def __init__(self, config: typing.Optional[dict] = None):
+        config = config or {}
+        self.quantum = float(config.get("quantum", 1.0))
+        self.default_weight = float(config.get("default_weight", 1.0))
+        self.default_priority = int(config.get("default_priority", 0))
+        projects = config.get("projects", None) or {}
+        self.weights: typing.Dict[str, float] = {project: float(settings.get("weight", self.default_weight)) for project, settings in projects.items()}
+        self.priorities: typing.Dict[str, int] = {project: int(settings.get("priority", self.default_priority)) for project, settings in projects.items()}
+        # A turn that never earns a whole task would make pop() go round the ring forever
+        if self.quantum <= 0:
+            raise Exception(f"Fair queueing quantum must be above 0, got {self.quantum}")
+        if self.default_weight <= 0:
+            raise Exception(f"Fair queueing default_weight must be above 0, got {self.default_weight}")
+        for project, weight in self.weights.items():
+            if weight <= 0:
+                raise Exception(f"Fair queueing weight for project {project} must be above 0, got {weight}")
+        # Per project heap of (urgency, sequence, key), and the live (urgency, sequence, item) of every queued model
+        self.queues: typing.Dict[str, typing.List[typing.Tuple[float, int, ModelKey]]] = {}
+        self.items: typing.Dict[ModelKey, typing.Tuple[float, int, typing.Any]] = {}
+        self.sequence = 0
+        # Round robin ring of projects with queued models per priority, and the deficit of each project
+        self.rings: typing.Dict[int, typing.Deque[str]] = {}
+        self.deficits: typing.Dict[str, float] = {}
+        self.in_turn: typing.Set[str] = set()
+        self.superseded_count = 0
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __contains__(self, key: ModelKey) -> bool:
+        return key in self.items
+
+    def weight(self, project_name: str) -> float:
+        return self.weights.get(project_name, self.default_weight)
+
+    def priority(self, project_name: str) -> int:
+        return self.priorities.get(project_name, self.default_priority)
+
+    def push(self, key: ModelKey, item: typing.Any, urgency: float):
+        """
+        Queue an item for a model, replacing any item still queued for it so a backlog never holds more than one per model
+        """
+        if key in self.items:
+            self.superseded_count += 1
+        self.sequence += 1
+        self.items[key] = (urgency, self.sequence, item)
+        project_name = key[0]
+        queue = self.queues.get(project_name, None)
+        if queue is None:
+            queue = self.queues[project_name] = []
+            self.rings.setdefault(self.priority(project_name), deque()).append(project_name)
+            self.deficits[project_name] = 0.0
+        heapq.heappush(queue, (urgency, self.sequence, key))
+
+    def remove(self, key: ModelKey):
+        """
+        Drop whatever is queued for a model, its heap entry is skipped once it comes up
+        """
+        self.items.pop(key, None)
+
+    def pending(self, project_name: str) -> int:
+        return sum(1 for key in self.items if key[0] == project_name)
+
+    def _pop_project(self, project_name: str) -> typing.Optional[typing.Any]:
+        queue = self.queues[project_name]
+        while queue:
+            urgency, sequence, key = heapq.heappop(queue)
+            entry = self.items.get(key, None)
+            if entry is not None and entry[1] == sequence:
+                del self.items[key]
+                return entry[2]
+        return None
+
+    def _has_items(self, project_name: str) -> bool:
+        queue = self.queues[project_name]
+        while queue:
+            _, sequence, key = queue[0]
+            entry = self.items.get(key, None)
+            if entry is not None and entry[1] == sequence:
+                return True
+            heapq.heappop(queue)
+        return False
+
+    def _retire(self, ring: typing.Deque[str], project_name: str):
+        ring.popleft()
+        del self.queues[project_name]
+        del self.deficits[project_name]
+        self.in_turn.discard(project_name)
+
+    def pop(self, limit: typing.Optional[int] = None) -> typing.List[typing.Any]:
+        """
+        Remove and return up to limit items (all of them when None) in fair order
+        """
+        items: typing.List[typing.Any] = []
+        for priority in sorted(self.rings.keys(), reverse=True):
+            ring = self.rings[priority]
+            while ring and (limit is None or len(items) < limit):
+                project_name = ring[0]
+                if not self._has_items(project_name):
+                    self._retire(ring, project_name)
+                    continue
+                if project_name not in self.in_turn:
+                    # A new turn, a turn cut short by the limit resumes with what was left of its deficit
+                    self.in_turn.add(project_name)
+                    self.deficits[project_name] += self.quantum * self.weight(project_name)
+                while self.deficits[project_name] >= 1.0 and (limit is None or len(items) < limit):
+                    item = self._pop_project(project_name)
+                    if item is None:
+                        break
+                    items.append(item)
+                    self.deficits[project_name] -= 1.0
+                if not self._has_items(project_name):
+                    self._retire(ring, project_name)
+                elif self.deficits[project_name] < 1.0:
+                    self.in_turn.discard(project_name)
+                    ring.rotate(-1)
+            if not ring:
+                del self.rings[priority]
+            if limit is not None and len(items) >= limit:
+                break
+        return items
+
+    def stats(self) -> dict:
+        return {"queued": len(self.items), "projects": len(self.queues), "superseded": self.superseded_count}
@@ -0,0 +1,113 @@
+import os
+import time
+import bisect
+import socket
+import hashlib
+import logging
+import typing
+import uuid
+
+from latigo.utils import parse_time_delta
+
+logger = logging.getLogger(__name__)
+
+
+def default_instance_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def _ring_hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class ConsistentHashRing:
+    """
+    Maps keys to members so that when a member joins or leaves only the keys on its arcs of the ring move.
+    Every member is placed on the ring virtual_nodes times to even out the share each one gets.
+    """
+
+    def __init__(self, members: typing.Iterable[str], virtual_nodes: int = 100):
+        self.members = sorted(set(members))
+        points = sorted((_ring_hash(f"{member}#{node}"), member) for member in self.members for node in range(virtual_nodes))
+        self.hashes = [point for point, _ in points]
+        self.owners = [member for _, member in points]
+
+    def owner(self, key: str) -> typing.Optional[str]:
+        if not self.hashes:
+            return None
+        position = bisect.bisect(self.hashes, _ring_hash(key)) % len(self.hashes)
+        return self.owners[position]
+
+
+class MembershipInterface:
+    # Seconds a heartbeat keeps us a member, None when membership never runs out
+    lease_time: typing.Optional[float] = None
+
+    def heartbeat(self) -> typing.List[str]:
+        """
+        Renew our lease and return the ids of all instances with a live lease, including ourselves
+        """
+
+    def leave(self):
+        """
+        Give up our lease so the others take over our share straight away
+        """
+
+
+class DevNullMembership(MembershipInterface):
+    """
+    A lone instance that owns everything
+    """
+
+    def __init__(self, instance_id: str):
+        self.instance_id = instance_id
+
+    def heartbeat(self) -> typing.List[str]:
+        return [self.instance_id]
+
+    def leave(self):
+        pass
+
+
+class SqliteMembership(MembershipInterface):
+    """
+    Leases in a SQLite database file shared by scheduler instances on one node or a shared volume. Each heartbeat
+    extends our lease by lease_time and expires everybody who has not renewed theirs, so the share of an
+    instance that died is taken over once its lease runs out.
+    """
+
+    def __init__(self, instance_id: str, config: dict):
+        import sqlite3
+
+        self.instance_id = instance_id
+        self.database = config.get("database", "/tmp/latigo/schedulers.db")
+        self.lease_time = parse_time_delta(config.get("lease_time", "30s")).total_seconds()
+        os.makedirs(os.path.dirname(os.path.abspath(self.database)), exist_ok=True)
+        # Autocommit, the statements below take the write lock themselves
+        self.connection = sqlite3.connect(self.database, timeout=10, isolation_level=None, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS scheduler_members (instance_id TEXT PRIMARY KEY, expires REAL NOT NULL)")
+
+    def heartbeat(self, now: typing.Optional[float] = None) -> typing.List[str]:
+        now = time.time() if now is None else now
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute("INSERT OR REPLACE INTO scheduler_members (instance_id, expires) VALUES (?, ?)", (self.instance_id, now + self.lease_time))
+            cursor.execute("DELETE FROM scheduler_members WHERE expires < ?", (now,))
+            members = [row[0] for row in cursor.execute("SELECT instance_id FROM scheduler_members ORDER BY instance_id")]
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        return members
+
+    def leave(self):
+        self.connection.execute("DELETE FROM scheduler_members WHERE instance_id = ?", (self.instance_id,))
+
+
+def membership_factory(instance_id: str, config: typing.Optional[dict]) -> MembershipInterface:
+    config = config or {}
+    membership_type = config.get("type", None)
+    if "sqlite" == membership_type:
+        return SqliteMembership(instance_id, config)
+    return DevNullMembership(instance_id)
@@ -0,0 +1,169 @@
+import sys
+import time
+import json
+import argparse
+import asyncio
+import logging
+import resource
+import tracemalloc
+import typing
+from collections import Counter
+
+from latigo.types import Task
+from latigo.task_queue import TaskQueueSenderInterface
+from latigo.scheduler import Scheduler
+from latigo.scheduler.timing import Clock
+from latigo.utils import parse_time_delta
+
+logger = logging.getLogger(__name__)
+
+
+class VirtualClock(Clock):
+    """
+    A clock that only moves when told to, so hours of scheduling can be simulated in seconds
+    """
+
+    def __init__(self, start_time: float = 1572566400.0):
+        self.now = 0.0
+        self.start_time = start_time
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.start_time + self.now
+
+    def advance_to(self, now: float):
+        self.now = max(self.now, now)
+
+    async def sleep(self, seconds: float):
+        self.advance_to(self.now + max(0.0, seconds))
+        await asyncio.sleep(0)
+
+    async def wait(self, event: asyncio.Event, timeout: typing.Optional[float]) -> bool:
+        if not event.is_set() and timeout is not None:
+            self.advance_to(self.now + max(0.0, timeout))
+        await asyncio.sleep(0)
+        return event.is_set()
+
+
+class CountingTaskQueueSender(TaskQueueSenderInterface):
+    """
+    Keeps count of the tasks it is given instead of sending them anywhere. With a consume_rate it pretends
+    executors take that many tasks per second off the queue, so lag() can drive backpressure.
+    """
+
+    def __init__(self, clock: typing.Optional[Clock] = None, consume_rate: typing.Optional[float] = None):
+        self.clock = clock or Clock()
+        self.consume_rate = consume_rate
+        self.count = 0
+        self.per_project: typing.Counter[str] = Counter()
+        self.per_model: typing.Counter[typing.Tuple[str, str]] = Counter()
+        # Tasks put per whole second of the clock, to see how evenly emission is spread
+        self.per_second: typing.Counter[int] = Counter()
+        self.consumed = 0.0
+        self.consumed_time: typing.Optional[float] = None
+
+    def put_task(self, task: Task):
+        self.count += 1
+        self.per_project[task.project_name] += 1
+        self.per_model[(task.project_name, task.model_name)] += 1
+        self.per_second[int(self.clock.monotonic())] += 1
+
+    def lag(self) -> typing.Optional[int]:
+        if self.consume_rate is None:
+            return None
+        now = self.clock.monotonic()
+        if self.consumed_time is not None:
+            self.consumed = min(float(self.count), self.consumed + (now - self.consumed_time) * self.consume_rate)
+        self.consumed_time = now
+        return int(self.count - self.consumed)
+
+
+def _percentile(values: typing.List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def simulate(config: dict, duration: float, consume_rate: typing.Optional[float] = None) -> dict:
+    """
+    Run a scheduler built from config for duration virtual seconds against a counting sender, stepping
+    configuration sync, lag checks and prediction steps in the order their timers come due, and report
+    what was emitted together with the real time and memory it took.
+    """
+    clock = VirtualClock()
+    sender = CountingTaskQueueSender(clock, consume_rate)
+    tracemalloc.start()
+    started = time.perf_counter()
+    scheduler = Scheduler({"task_queue": {"type": None}, **config})
+    scheduler.clock = clock
+    scheduler.task_queue = sender
+    sync_interval = scheduler.configuration_sync_interval.total_seconds()
+    next_sync = 0.0
+    next_lag_check = 0.0 if scheduler.max_lag > 0 else None
+    sync_latencies: typing.List[float] = []
+    step_seconds = 0.0
+    step_count = 0
+    while clock.now < duration:
+        if clock.now >= next_sync:
+            sync_started = time.perf_counter()
+            scheduler.synchronize_configuration()
+            sync_latencies.append(time.perf_counter() - sync_started)
+            next_sync += sync_interval
+        if next_lag_check is not None and clock.now >= next_lag_check:
+            scheduler.update_backpressure(sender.lag())
+            next_lag_check += scheduler.lag_check_interval
+        step_started = time.perf_counter()
+        scheduler.perform_prediction_step()
+        step_seconds += time.perf_counter() - step_started
+        step_count += 1
+        wake_times = [t for t in [next_sync, next_lag_check, scheduler.deadlines.next_deadline(), scheduler._next_emit_time(clock.now), duration] if t is not None]
+        clock.advance_to(max(min(wake_times), clock.now + 1e-6))
+    elapsed = time.perf_counter() - started
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    per_second = [sender.per_second.get(second, 0) for second in range(int(duration))]
+    mean_per_second = sum(per_second) / len(per_second) if per_second else 0.0
+    return {
+        "models": len(scheduler.models),
+        "virtual_seconds": duration,
+        "real_seconds": elapsed,
+        "tasks": sender.count,
+        "tasks_per_virtual_second": sender.count / duration if duration else 0.0,
+        "tasks_per_real_second": sender.count / step_seconds if step_seconds else 0.0,
+        "prediction_steps": step_count,
+        "sync_count": len(sync_latencies),
+        "sync_latency_p50": _percentile(sync_latencies, 0.5),
+        "sync_latency_max": max(sync_latencies) if sync_latencies else 0.0,
+        "emission_peak_to_mean": max(per_second) / mean_per_second if mean_per_second else 0.0,
+        "max_tasks_per_model": max(sender.per_model.values()) if sender.per_model else 0,
+        "min_tasks_per_model": min(sender.per_model.values()) if sender.per_model else 0,
+        "tasks_per_project": dict(sender.per_project),
+        "throttled": scheduler.throttled,
+        "peak_traced_bytes": peak_traced,
+        "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+def main(argv: typing.Optional[typing.List[str]] = None):
+    parser = argparse.ArgumentParser(description="Simulate the Latigo scheduler against synthetic models on a virtual clock")
+    parser.add_argument("--models", type=int, default=10000, help="Number of synthetic models")
+    parser.add_argument("--projects", type=int, default=10, help="Number of projects the models are spread over")
+    parser.add_argument("--duration", default="1h", help="Virtual time to simulate")
+    parser.add_argument("--interval", default="30m", help="Prediction interval per model")
+    parser.add_argument("--max-task-rate", type=float, default=0, help="Cap on tasks per second leaving the scheduler")
+    parser.add_argument("--consume-rate", type=float, default=None, help="Simulated executor throughput in tasks per second, for backpressure")
+    parser.add_argument("--max-lag", type=int, default=0, help="Backpressure threshold in tasks")
+    args = parser.parse_args(argv)
+    config = {
+        "model_info": {"type": "synthetic", "model_count": args.models, "project_count": args.projects},
+        "scheduler": {"continuous_prediction_interval": args.interval, "configuration_sync_interval": "1m", "max_task_rate": args.max_task_rate, "backpressure": {"max_lag": args.max_lag}},
+    }
+    report = simulate(config, parse_time_delta(args.duration).total_seconds(), args.consume_rate)
+    print(json.dumps(report, indent=4, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,117 @@
+import time
+import zlib
+import heapq
+import asyncio
+import typing
+
+Key = typing.Hashable
+
+
+def model_phase(project_name: str, model_name: str) -> float:
+    """
+    Deterministic position of a model within its interval, in [0, 1). The same in every process and across
+    restarts, unlike hash(), so all scheduler instances agree on when a model is due.
+    """
+    return zlib.crc32(f"{project_name}/{model_name}".encode("utf-8")) / 4294967296.0
+
+
+def phase_delay(wall_now: float, interval: float, phase: float) -> float:
+    """
+    Seconds from wall_now until the next time that sits phase * interval into an interval counted from the epoch
+    """
+    if interval <= 0:
+        return 0.0
+    return (phase * interval - wall_now) % interval
+
+
+class Clock:
+    """
+    The scheduler's view of time. Deadlines are kept on the monotonic clock so wall clock jumps never
+    trigger or stall anything, while task time ranges are stamped from the wall clock.
+    """
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def time(self) -> float:
+        return time.time()
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(max(0.0, seconds))
+
+    async def wait(self, event: asyncio.Event, timeout: typing.Optional[float]) -> bool:
+        """
+        Wait for event for at most timeout seconds (forever when None), returning whether it was set
+        """
+        if timeout is None:
+            await event.wait()
+            return True
+        try:
+            await asyncio.wait_for(event.wait(), max(0.0, timeout))
+        except asyncio.TimeoutError:
+            pass
+        return event.is_set()
+
+
+class DeadlineHeap:
+    """
+    One pending deadline per key in a binary heap, so finding what is due costs O(log n) per due key
+    no matter how many keys are scheduled. Rescheduling or cancelling a key leaves its old heap entry
+    behind, and stale entries are skipped when they reach the top.
+    """
+
+    def __init__(self):
+        self.heap: typing.List[typing.Tuple[float, int, Key]] = []
+        # The live deadline and sequence number of every scheduled key
+        self.entries: typing.Dict[Key, typing.Tuple[float, int]] = {}
+        self.sequence = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: Key) -> bool:
+        return key in self.entries
+
+    def deadline(self, key: Key) -> typing.Optional[float]:
+        entry = self.entries.get(key, None)
+        return entry[0] if entry else None
+
+    def schedule(self, key: Key, deadline: float):
+        self.sequence += 1
+        self.entries[key] = (deadline, self.sequence)
+        heapq.heappush(self.heap, (deadline, self.sequence, key))
+        # Keep stale entries from piling up when keys are rescheduled a lot without coming due
+        if len(self.heap) > 2 * len(self.entries) + 1024:
+            self._compact()
+
+    def cancel(self, key: Key):
+        self.entries.pop(key, None)
+
+    def _compact(self):
+        self.heap = [(deadline, sequence, key) for key, (deadline, sequence) in self.entries.items()]
+        heapq.heapify(self.heap)
+
+    def _drop_stale(self):
+        while self.heap:
+            deadline, sequence, key = self.heap[0]
+            if self.entries.get(key, None) == (deadline, sequence):
+                return
+            heapq.heappop(self.heap)
+
+    def next_deadline(self) -> typing.Optional[float]:
+        self._drop_stale()
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now: float, limit: typing.Optional[int] = None) -> typing.List[typing.Tuple[float, Key]]:
+        """
+        Remove and return (deadline, key) for every key due at now, earliest first, at most limit of them
+        """
+        due = []
+        while limit is None or len(due) < limit:
+            self._drop_stale()
+            if not self.heap or self.heap[0][0] > now:
+                break
+            deadline, _, key = heapq.heappop(self.heap)
+            del self.entries[key]
+            due.append((deadline, key))
+        return due
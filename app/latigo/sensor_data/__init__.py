@@ -1,6 +1,5 @@
 from dataclasses import dataclass
 from datetime import datetime, timedelta
-import pandas as pd
 import typing
 import latigo.utils
 
@@ -24,7 +23,9 @@ class MockSensorDataProvider(SensorDataProviderInterface):
         """
         return the actual data as per the range specified
         """
-        data = SensorData(time_range=time_range, data=[])
+        from latigo.columnar import SensorDataColumns
+
+        data = SensorData(time_range=time_range, data=SensorDataColumns.empty(spec.tag_list))
         return data
 
 
@@ -36,7 +37,9 @@ class DevNullSensorDataProvider(SensorDataProviderInterface):
         """
         return the actual data as per the range specified
         """
-        data = SensorData(time_range=time_range, data=[])
+        from latigo.columnar import SensorDataColumns
+
+        data = SensorData(time_range=time_range, data=SensorDataColumns.empty(spec.tag_list))
         return data
 
 
@@ -0,0 +1,87 @@
+import logging
+import threading
+import typing
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class PooledSession:
+    """
+    Thread safe stand-in for requests.Session.
+
+    By default every thread gets its own requests.Session so cookie jars and adapters are never shared,
+    while all of them share the same auth hook. With per_thread disabled one session with a pool sized
+    for the expected concurrency is shared instead. Either way every request gets explicit connect/read
+    timeouts unless the caller passes its own.
+    """
+
+    def __init__(self, config: typing.Optional[dict] = None, auth: typing.Optional[requests.auth.AuthBase] = None):
+        self.config = config or {}
+        self.auth = auth
+        self.per_thread = self.config.get("per_thread", True)
+        self.pool_connections = int(self.config.get("pool_connections", 10))
+        self.pool_maxsize = int(self.config.get("pool_maxsize", 32))
+        self.max_retries = int(self.config.get("max_retries", 0))
+        self.keep_alive = self.config.get("keep_alive", True)
+        self.timeout = (float(self.config.get("connect_timeout", 10)), float(self.config.get("read_timeout", 120)))
+        self.local = threading.local()
+        self.sessions_lock = threading.Lock()
+        # Per thread sessions by the thread using them, the sessions of threads that have ended are closed on the next insert
+        self.sessions: typing.Dict[threading.Thread, requests.Session] = {}
+        self.shared_session = None if self.per_thread else self._create_session()
+
+    def _create_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize, max_retries=self.max_retries)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers["Connection"] = "keep-alive" if self.keep_alive else "close"
+        session.auth = self.auth
+        return session
+
+    def _track_session(self, session: requests.Session):
+        with self.sessions_lock:
+            dead = [thread for thread in self.sessions if not thread.is_alive()]
+            dead_sessions = [self.sessions.pop(thread) for thread in dead]
+            self.sessions[threading.current_thread()] = session
+        for dead_session in dead_sessions:
+            dead_session.close()
+
+    @property
+    def session(self) -> requests.Session:
+        if self.shared_session:
+            return self.shared_session
+        session = getattr(self.local, "session", None)
+        if not session:
+            session = self._create_session()
+            self._track_session(session)
+            self.local.session = session
+        return session
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request("DELETE", url, **kwargs)
+
+    def close(self):
+        with self.sessions_lock:
+            sessions, self.sessions = list(self.sessions.values()), {}
+        if self.shared_session:
+            sessions.append(self.shared_session)
+        for session in sessions:
+            session.close()
+        self.local = threading.local()
+        self.shared_session = None if self.per_thread else self._create_session()
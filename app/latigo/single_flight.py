@@ -0,0 +1,63 @@
+import logging
+import threading
+import typing
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    __slots__ = ("event", "result", "error", "waiters")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: typing.Any = None
+        self.error: typing.Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Collapses concurrent identical calls into one.
+
+    The first thread to ask for a key runs the function, every other thread asking for the same key while
+    that call is in flight waits for it and gets the same result (or exception). Nothing is cached once the
+    call has finished, so later calls go upstream again.
+    """
+
+    def __init__(self, name: str = "single_flight"):
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls: typing.Dict[typing.Hashable, _Call] = {}
+        self.executed_count = 0
+        self.shared_count = 0
+
+    def do(self, key: typing.Hashable, function: typing.Callable, *args, **kwargs):
+        with self.lock:
+            existing = self.calls.get(key, None)
+            if existing is not None:
+                call = existing
+                call.waiters += 1
+                self.shared_count += 1
+            else:
+                call = _Call()
+                self.calls[key] = call
+                self.executed_count += 1
+        if existing is not None:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = function(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+        return call.result
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"name": self.name, "executed": self.executed_count, "shared": self.shared_count, "in_flight": len(self.calls)}
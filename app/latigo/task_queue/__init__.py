@@ -23,7 +23,7 @@ def serialize_task(task, mode="json") -> typing.Optional[bytes]:
             traceback.print_exc()
     else:
         try:
-            # Rely on dataclass_json
+            # Task.to_dict/from_dict keep the wire format dataclasses_json used
             task_bytes = task.to_json()
         except Exception as e:
             logger.error(f"Could not serialize task to json: {e}")
@@ -44,7 +44,7 @@ def deserialize_task(task_bytes, mode="json") -> typing.Optional[Task]:
             traceback.print_exc()
     else:
         try:
-            # Rely on dataclass_json
+            # Task.to_dict/from_dict keep the wire format dataclasses_json used
             task = Task.from_json(task_bytes)
         except Exception as e:
             logger.error(f"Could not deserialize task from json of size {len(task_bytes)}bytes: {e}")
@@ -52,17 +52,77 @@ def deserialize_task(task_bytes, mode="json") -> typing.Optional[Task]:
     return task
 
 
+def task_partition_key(task: Task, mode: typing.Optional[str] = "project_model") -> typing.Optional[bytes]:
+    """
+    Message key for a task, so that every task for the same model lands on the same partition and therefore
+    the same executor. Mode is one of "project_model", "model", "project" or None for no key.
+    """
+    if not mode or mode == "none":
+        return None
+    if mode == "project_model":
+        return f"{task.project_name}/{task.model_name}".encode("utf-8")
+    if mode == "model":
+        return task.model_name.encode("utf-8")
+    if mode == "project":
+        return task.project_name.encode("utf-8")
+    raise Exception(f"Unknown partition key mode '{mode}'")
+
+
+class PartitionAssignmentListenerInterface:
+    def on_partitions_assigned(self, partitions: typing.List[int], model_keys: typing.Set[typing.Tuple[str, str]]):
+        """
+        Called when partitions are assigned to this receiver, with the models previously seen on them
+        """
+
+    def on_partitions_revoked(self, partitions: typing.List[int], model_keys: typing.Set[typing.Tuple[str, str]]):
+        """
+        Called when partitions are taken away from this receiver, with the models seen on them
+        """
+
+
 class TaskQueueSenderInterface:
     def put_task(self, task: Task):
         """
         Put one task on the queue
         """
 
+    def lag(self) -> typing.Optional[int]:
+        """
+        Number of tasks put on the queue that the executors have not taken yet, or None if unknown
+        """
+        return None
+
 
 class TaskQueueReceiverInterface:
-    def get_task(self) -> Task:
+    def get_task(self, timeout: typing.Optional[float] = None) -> typing.Optional[Task]:
+        """
+        Return exactly one task from queue, blocking until one arrives or timeout seconds have passed,
+        in which case None is returned. Without a timeout the receiver's configured receive_timeout applies.
+        """
+
+    def set_assignment_listener(self, listener: PartitionAssignmentListenerInterface):
         """
-        Return exactly one task from queue or block
+        Register a listener for partition assignment changes, for receivers that have partitions
+        """
+
+    def task_failed(self, task: Task, error: BaseException):
+        """
+        Report that a task received from this queue could not be processed, for receivers that retry
+        """
+
+    def task_succeeded(self, task: Task):
+        """
+        Report that a task received from this queue was processed
+        """
+
+    def task_dropped(self, task: Task):
+        """
+        Report that a task received from this queue will not be processed, as it duplicates completed work or is too old
+        """
+
+    def stats(self) -> typing.Optional[dict]:
+        """
+        Optionally return counters worth exposing as metrics
         """
 
 
@@ -70,7 +130,7 @@ class DevNullTaskQueue(TaskQueueSenderInterface, TaskQueueReceiverInterface):
     def __init__(self, conf: dict):
         pass
 
-    def get_task(self) -> Task:
+    def get_task(self, timeout: typing.Optional[float] = None) -> typing.Optional[Task]:
         return Task("null")
 
     def put_task(self, task: Task):
@@ -84,8 +144,17 @@ def task_queue_receiver_factory(task_queue_config):
         from latigo.task_queue.kafka import KafkaTaskQueueReceiver
 
         task_queue = KafkaTaskQueueReceiver(task_queue_config)
+    elif "local" == task_queue_type:
+        from latigo.task_queue.local import LocalTaskQueueReceiver
+
+        task_queue = LocalTaskQueueReceiver(task_queue_config)
     else:
         task_queue = DevNullTaskQueue(task_queue_config)
+    retry_config = task_queue_config.get("retry", None)
+    if retry_config:
+        from latigo.task_queue.retry import RetryingTaskQueueReceiver
+
+        task_queue = RetryingTaskQueueReceiver(task_queue, retry_config)
     return task_queue
 
 
@@ -96,6 +165,10 @@ def task_queue_sender_factory(task_queue_config):
         from latigo.task_queue.kafka import KafkaTaskQueueSender
 
         task_queue = KafkaTaskQueueSender(task_queue_config)
+    elif "local" == task_queue_type:
+        from latigo.task_queue.local import LocalTaskQueueSender
+
+        task_queue = LocalTaskQueueSender(task_queue_config)
     else:
         task_queue = DevNullTaskQueue(task_queue_config)
     return task_queue
@@ -4,20 +4,56 @@ import json
 import logging
 import sys
 import pprint
-import time
 import typing
-from confluent_kafka import Producer, Consumer, KafkaException, KafkaError
+from confluent_kafka import Producer, Consumer, KafkaException, KafkaError, TopicPartition
 from confluent_kafka.admin import AdminClient, NewTopic
-from latigo.utils import parse_event_hub_connection_string
-from latigo.task_queue import deserialize_task, serialize_task, TaskQueueSenderInterface, TaskQueueReceiverInterface
+from latigo.utils import parse_event_hub_connection_string, parse_time_delta
+from latigo.task_queue import deserialize_task, serialize_task, task_partition_key, TaskQueueSenderInterface, TaskQueueReceiverInterface, PartitionAssignmentListenerInterface
 from latigo.types import Task
+from latigo.metrics import MetricsRegistry, registry as metrics_registry
 
 logger = logging.getLogger(__name__)
 
 
+def record_kafka_stats(stats: dict, registry: MetricsRegistry = metrics_registry):
+    """
+    Turn the librdkafka statistics of one client into gauges labelled with the client name
+    """
+    client = stats.get("name", "unknown")
+    client_gauge = registry.gauge("latigo_kafka_client", "Client wide librdkafka statistics", ["client", "stat"])
+    for stat in ["msg_cnt", "msg_size", "replyq", "tx", "tx_bytes", "rx", "rx_bytes", "txmsgs", "rxmsgs"]:
+        if stat in stats:
+            client_gauge.labels(client, stat).set(stats[stat])
+    rtt_gauge = registry.gauge("latigo_kafka_broker_rtt_seconds", "Broker round trip time", ["client", "broker", "quantile"])
+    outbuf_gauge = registry.gauge("latigo_kafka_broker_outbuf_messages", "Messages waiting to be sent to the broker", ["client", "broker"])
+    for broker_name, broker in stats.get("brokers", {}).items():
+        rtt = broker.get("rtt", {})
+        for quantile, key in [("0.5", "p50"), ("0.99", "p99"), ("avg", "avg")]:
+            if key in rtt:
+                rtt_gauge.labels(client, broker_name, quantile).set(rtt[key] / 1000000.0)
+        if "outbuf_msg_cnt" in broker:
+            outbuf_gauge.labels(client, broker_name).set(broker["outbuf_msg_cnt"])
+    partition_gauge = registry.gauge("latigo_kafka_partition", "Per partition librdkafka statistics", ["client", "topic", "partition", "stat"])
+    for topic_name, topic in stats.get("topics", {}).items():
+        for partition_name, partition in topic.get("partitions", {}).items():
+            # Partition -1 holds messages not yet assigned to a partition
+            if partition_name == "-1":
+                continue
+            for stat in ["consumer_lag", "msgq_cnt", "xmit_msgq_cnt", "fetchq_cnt"]:
+                if stat in partition and partition[stat] >= 0:
+                    partition_gauge.labels(client, topic_name, partition_name, stat).set(partition[stat])
+    cgrp = stats.get("cgrp", None)
+    if cgrp:
+        group_gauge = registry.gauge("latigo_kafka_consumer_group", "Consumer group statistics", ["client", "stat"])
+        for stat in ["rebalance_cnt", "assignment_size"]:
+            if stat in cgrp:
+                group_gauge.labels(client, stat).set(cgrp[stat])
+
+
 def stats_callback(stats_json_str):
     stats_json = json.loads(stats_json_str)
-    logger.info("\nKAFKA Stats: {}\n".format(pprint.pformat(stats_json)))
+    record_kafka_stats(stats_json)
+    logger.debug("\nKAFKA Stats: {}\n".format(pprint.pformat(stats_json)))
 
 
 def delivery_callback(err, msg):
@@ -31,7 +67,7 @@ def delivery_callback(err, msg):
 def prepare_kafka_config(config: typing.Dict[str, typing.Any]) -> dict:
     parts = parse_event_hub_connection_string(str(config.get("connection_string"))) or {}
     # fmt: off
-    return {
+    kafka_config = {
         "bootstrap.servers": f"{parts.get('endpoint')}:9093",
         "security.protocol": config.get("security.protocol"),
         "ssl.ca.location": config.get("ssl.ca.location"),
@@ -44,6 +80,11 @@ def prepare_kafka_config(config: typing.Dict[str, typing.Any]) -> dict:
         "session.timeout.ms": config.get("session.timeout.ms"),
         "enable.auto.commit": config.get("enable.auto.commit"), "auto.commit.interval.ms": config.get("auto.commit.interval.ms"), "default.topic.config": config.get("default.topic.config"), "debug": config.get("debug")}
     # fmt: on
+    # librdkafka reports its statistics every statistics.interval.ms, into the metrics registry
+    if config.get("statistics.interval.ms", None):
+        kafka_config["statistics.interval.ms"] = config.get("statistics.interval.ms")
+        kafka_config["stats_cb"] = stats_callback
+    return kafka_config
 
 
 class KafkaTaskQueueSender(TaskQueueSenderInterface):
@@ -71,6 +112,11 @@ class KafkaTaskQueueSender(TaskQueueSenderInterface):
         # Find our topic
         parts = parse_event_hub_connection_string(str(config.get("connection_string"))) or {}
         self.topic = parts.get("entity_path")
+        # Key tasks so the same model always goes to the same partition
+        self.partition_key = config.get("partition_key", "project_model")
+        # The consumer group whose backlog lag() reports, looked up through a consumer that never joins the group
+        self.lag_group_id = config.get("lag_group_id", config.get("group.id"))
+        self.lag_consumer: typing.Optional[Consumer] = None
         # self._create_topics()
         # Create Producer instance
         self.producer = Producer(self.config)
@@ -87,16 +133,33 @@ class KafkaTaskQueueSender(TaskQueueSenderInterface):
         try:
             task_bytes = serialize_task(task)
             if task_bytes:
-                self.producer.produce(self.topic, task_bytes, callback=delivery_callback)
+                self.producer.produce(self.topic, task_bytes, key=task_partition_key(task, self.partition_key), callback=delivery_callback)
             else:
                 raise Exception("Could not serialize task")
         except BufferError as e:
             logger.info(f"Local producer queue is full ({len(self.producer)} messages awaiting delivery): try again")
         self.producer.poll(0)
 
-
-def print_assignment(consumer, partitions):
-    print("Assignment:", partitions)
+    def lag(self) -> typing.Optional[int]:
+        """
+        Sum over partitions of the high watermark minus the consumer group's committed offset
+        """
+        if not self.topic or not self.lag_group_id:
+            return None
+        if self.lag_consumer is None:
+            self.lag_consumer = Consumer({**self.config, "group.id": self.lag_group_id, "enable.auto.commit": False})
+        metadata = self.lag_consumer.list_topics(self.topic, timeout=10)
+        topic_metadata = metadata.topics.get(self.topic, None)
+        if not topic_metadata or topic_metadata.error:
+            return None
+        partitions = [TopicPartition(self.topic, partition) for partition in topic_metadata.partitions]
+        lag = 0
+        for committed in self.lag_consumer.committed(partitions, timeout=10):
+            low, high = self.lag_consumer.get_watermark_offsets(committed, timeout=10, cached=False)
+            # Nothing committed yet means the group starts from the beginning
+            offset = committed.offset if committed.offset >= 0 else low
+            lag += max(0, high - offset)
+        return lag
 
 
 class KafkaTaskQueueReceiver(TaskQueueReceiverInterface):
@@ -107,16 +170,61 @@ class KafkaTaskQueueReceiver(TaskQueueReceiverInterface):
         # Find our topic
         parts = parse_event_hub_connection_string(str(config.get("connection_string"))) or {}
         self.topic = parts.get("entity_path")
+        # Partition bookkeeping, so per model state can follow the partitions on rebalance
+        self.assigned_partitions: typing.Set[int] = set()
+        self.models_by_partition: typing.Dict[int, typing.Set[typing.Tuple[str, str]]] = {}
+        # Models of revoked partitions, kept until the next assignment so partitions that come straight back are pre-warmed
+        self.revoked_models_by_partition: typing.Dict[int, typing.Set[typing.Tuple[str, str]]] = {}
+        self.last_partition: typing.Optional[int] = None
+        self.assignment_listener: typing.Optional[PartitionAssignmentListenerInterface] = None
+        # How long get_task blocks in poll waiting for a message by default
+        self.receive_timeout = parse_time_delta(config.get("receive_timeout", "10s")).total_seconds()
         # Create Consumer instance
         self.consumer = Consumer(self.config)
         # Subscribe to topics
-        self.consumer.subscribe([self.topic], on_assign=print_assignment)
+        self.consumer.subscribe([self.topic], on_assign=self._on_assign, on_revoke=self._on_revoke)
+
+    def set_assignment_listener(self, listener: PartitionAssignmentListenerInterface):
+        self.assignment_listener = listener
+
+    def _models_on(self, partitions: typing.List[int], models_by_partition: typing.Dict[int, typing.Set[typing.Tuple[str, str]]]) -> typing.Set[typing.Tuple[str, str]]:
+        model_keys: typing.Set[typing.Tuple[str, str]] = set()
+        for partition in partitions:
+            model_keys |= models_by_partition.get(partition, set())
+        return model_keys
+
+    def _on_assign(self, consumer, partitions):
+        assigned = [p.partition for p in partitions]
+        self.assigned_partitions |= set(assigned)
+        logger.info(f"Assigned partitions {sorted(assigned)} of '{self.topic}', now holding {sorted(self.assigned_partitions)}")
+        # Partitions we get back start out with the models we saw on them, the rest are forgotten
+        for partition in assigned:
+            if partition in self.revoked_models_by_partition:
+                self.models_by_partition[partition] = self.revoked_models_by_partition[partition]
+        self.revoked_models_by_partition = {}
+        if self.assignment_listener:
+            self.assignment_listener.on_partitions_assigned(assigned, self._models_on(assigned, self.models_by_partition))
+
+    def _on_revoke(self, consumer, partitions):
+        revoked = [p.partition for p in partitions]
+        self.assigned_partitions -= set(revoked)
+        logger.info(f"Revoked partitions {sorted(revoked)} of '{self.topic}', now holding {sorted(self.assigned_partitions)}")
+        for partition in revoked:
+            model_keys = self.models_by_partition.pop(partition, None)
+            if model_keys:
+                self.revoked_models_by_partition[partition] = model_keys
+        if self.assignment_listener:
+            self.assignment_listener.on_partitions_revoked(revoked, self._models_on(revoked, self.revoked_models_by_partition))
+
+    def _track_model(self, partition: typing.Optional[int], task: Task):
+        if partition is not None and partition in self.assigned_partitions:
+            self.models_by_partition.setdefault(partition, set()).add((task.project_name, task.model_name))
 
     def __del__(self):
         if self.consumer:
             self.consumer.close()
 
-    def receive_event(self, timeout=100):
+    def receive_event(self, timeout: float) -> typing.Optional[bytes]:
         msg = self.consumer.poll(timeout=timeout)
         if msg is None:
             return None
@@ -132,18 +240,17 @@ class KafkaTaskQueueReceiver(TaskQueueReceiverInterface):
                 logger.error(f"Error occurred: {e}")
         else:
             # Proper message
+            self.last_partition = msg.partition()
             return msg.value()
 
-    def receive_event_with_backoff(self, timeout=100, backoff=1000):
-        task_bytes = self.receive_event(timeout)
-        task = None
+    def get_task(self, timeout: typing.Optional[float] = None) -> typing.Optional[Task]:
+        # Long poll, the consumer returns as soon as a message arrives
+        task_bytes = self.receive_event(self.receive_timeout if timeout is None else timeout)
         if not task_bytes:
-            time.sleep(backoff)
-        else:
-            task = deserialize_task(task_bytes)
+            return None
+        task = deserialize_task(task_bytes)
         if not task:
             logger.error("Could not deserialize task")
+            return None
+        self._track_model(self.last_partition, task)
         return task
-
-    def get_task(self) -> Task:
-        return self.receive_event_with_backoff()
@@ -0,0 +1,374 @@
+import os
+import re
+import mmap
+import time
+import fcntl
+import struct
+import logging
+import typing
+
+from latigo.task_queue import deserialize_task, serialize_task, TaskQueueSenderInterface, TaskQueueReceiverInterface
+from latigo.types import Task
+from latigo.utils import parse_time_delta
+
+logger = logging.getLogger(__name__)
+
+# Every record is a 4 byte big endian payload length followed by the payload. Segments are preallocated with
+# zeros, so a zero length marks the end of what has been written so far, and the roll marker tells readers
+# to continue in the next segment.
+_record_header = struct.Struct(">I")
+_end_marker = 0
+_roll_marker = 0xFFFFFFFF
+_offset_width = 20
+_segment_regex = re.compile(r"^(?P<base>[0-9]{20})\.log$")
+
+
+class _LockedFile:
+    """
+    Exclusive advisory lock on a file, shared between processes on the same node
+    """
+
+    def __init__(self, filename: str):
+        self.fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def __enter__(self):
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class SegmentLog:
+    """
+    Append-only log of records in fixed size memory-mapped segment files in one directory.
+
+    Positions in the log are global byte offsets, and each segment file is named after the offset of its
+    first byte. Appends from any process on the node are serialized by a lock file. Each consumer group
+    keeps the offset of its next record in a sidecar file, and consumers in the same group claim records
+    under that file's lock so every record is handed to exactly one of them. Segments every group has
+    consumed are deleted when the log rolls over to a new segment.
+    """
+
+    def __init__(self, directory: str, segment_size: int = 64 * 1024 * 1024, fsync: bool = False):
+        if not directory:
+            raise Exception("No directory specified")
+        self.directory = directory
+        self.segment_size = int(segment_size)
+        self.fsync = fsync
+        os.makedirs(self.directory, exist_ok=True)
+        self.write_lock = _LockedFile(os.path.join(self.directory, "write.lock"))
+        # The segment we last mapped, as (base offset, mmap), for the writer and the reader side respectively
+        self.write_segment: typing.Optional[typing.Tuple[int, mmap.mmap]] = None
+        self.write_position = 0
+        self.read_segment: typing.Optional[typing.Tuple[int, mmap.mmap]] = None
+
+    def _segment_filename(self, base: int) -> str:
+        return os.path.join(self.directory, f"{base:0{_offset_width}d}.log")
+
+    def segment_bases(self) -> typing.List[int]:
+        bases = []
+        for filename in os.listdir(self.directory):
+            match = _segment_regex.match(filename)
+            if match:
+                bases.append(int(match.group("base")))
+        return sorted(bases)
+
+    def _map_segment(self, base: int) -> typing.Optional[mmap.mmap]:
+        try:
+            fd = os.open(self._segment_filename(base), os.O_RDWR)
+        except FileNotFoundError:
+            return None
+        try:
+            return mmap.mmap(fd, self.segment_size)
+        finally:
+            os.close(fd)
+
+    def _create_segment(self, base: int) -> mmap.mmap:
+        # Preallocate in a temporary file so nobody ever maps a short segment
+        filename = self._segment_filename(base)
+        tmp_filename = f"{filename}.tmp"
+        with open(tmp_filename, "wb") as f:
+            f.truncate(self.segment_size)
+        os.replace(tmp_filename, filename)
+        segment = self._map_segment(base)
+        if segment is None:
+            raise Exception(f"Could not create segment {filename}")
+        return segment
+
+    def _writable_segment(self) -> typing.Tuple[int, mmap.mmap]:
+        """
+        Find the head of the log, following whatever other writers appended since we last looked. Call with the write lock held.
+        """
+        if self.write_segment is None:
+            self._map_head_segment()
+        base, segment = self.write_segment
+        while True:
+            (length,) = _record_header.unpack_from(segment, self.write_position)
+            if length == _end_marker:
+                return base, segment
+            if length == _roll_marker:
+                next_base = base + self.segment_size
+                next_segment = self._map_segment(next_base)
+                if next_segment is None and all(other_base < next_base for other_base in self.segment_bases()):
+                    # A writer died between marking the roll and creating the next segment, finish the roll for it
+                    next_segment = self._create_segment(next_base)
+                segment.close()
+                if next_segment is None:
+                    # We fell so far behind that the segments after ours were consumed and deleted, start over from the head
+                    self._map_head_segment()
+                else:
+                    self.write_segment = (next_base, next_segment)
+                    self.write_position = 0
+                base, segment = self.write_segment
+            else:
+                self.write_position += _record_header.size + length
+
+    def _map_head_segment(self):
+        bases = self.segment_bases()
+        base = bases[-1] if bases else 0
+        segment = self._map_segment(base) if bases else None
+        self.write_segment = (base, segment or self._create_segment(base))
+        self.write_position = 0
+
+    def append(self, payload: bytes):
+        record_size = _record_header.size + len(payload)
+        if record_size + _record_header.size > self.segment_size:
+            raise Exception(f"Record of {len(payload)} bytes does not fit in segments of {self.segment_size} bytes")
+        with self.write_lock:
+            base, segment = self._writable_segment()
+            if self.write_position + record_size + _record_header.size > self.segment_size:
+                self._roll(base, segment)
+                base, segment = self._writable_segment()
+            position = self.write_position
+            # Payload first and length last, so readers never see a half written record
+            segment[position + _record_header.size : position + record_size] = payload
+            _record_header.pack_into(segment, position, len(payload))
+            if self.fsync:
+                segment.flush()
+            self.write_position += record_size
+
+    def _roll(self, base: int, segment: mmap.mmap):
+        next_base = base + self.segment_size
+        # Mark the roll before the next segment exists. Were it the other way round, a writer dying in between would
+        # leave records in the next segment behind an end marker that consumers never read past.
+        _record_header.pack_into(segment, self.write_position, _roll_marker)
+        if self.fsync:
+            segment.flush()
+        next_segment = self._create_segment(next_base)
+        segment.close()
+        self.write_segment = (next_base, next_segment)
+        self.write_position = 0
+        logger.info(f"Rolled task log in {self.directory} over to segment {next_base}")
+        self._delete_consumed_segments()
+
+    def _delete_consumed_segments(self):
+        offsets = [self._load_offset(os.path.join(self.directory, filename)) for filename in os.listdir(self.directory) if filename.endswith(".offset")]
+        if not offsets:
+            return
+        consumed = min(offsets)
+        for base in self.segment_bases():
+            if base + self.segment_size <= consumed:
+                os.remove(self._segment_filename(base))
+                logger.info(f"Deleted consumed segment {base} of task log in {self.directory}")
+
+    @staticmethod
+    def _load_offset(filename: str) -> int:
+        try:
+            with open(filename, "rb") as f:
+                return int(f.read(_offset_width).strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _readable_segment(self, base: int) -> typing.Optional[mmap.mmap]:
+        if self.read_segment is not None:
+            if self.read_segment[0] == base:
+                return self.read_segment[1]
+            self.read_segment[1].close()
+            self.read_segment = None
+        segment = self._map_segment(base)
+        if segment is not None:
+            self.read_segment = (base, segment)
+        return segment
+
+    def consumer(self, group: str) -> "SegmentLogConsumer":
+        return SegmentLogConsumer(self, group)
+
+    def close(self):
+        for pair in [self.write_segment, self.read_segment]:
+            if pair is not None:
+                pair[1].close()
+        self.write_segment = None
+        self.read_segment = None
+        self.write_lock.close()
+
+
+class SegmentLogConsumer:
+    """
+    Claims records from a SegmentLog on behalf of a consumer group, advancing the group's offset file as it goes
+    """
+
+    def __init__(self, log: SegmentLog, group: str):
+        if not group:
+            raise Exception("No consumer group specified")
+        self.log = log
+        self.group = group
+        self.offset_filename = os.path.join(log.directory, f"{group}.offset")
+        self.offset_lock = _LockedFile(self.offset_filename)
+
+    def _read_offset(self) -> int:
+        raw = os.pread(self.offset_lock.fd, _offset_width, 0)
+        if raw.strip():
+            return int(raw)
+        # New group, start from the oldest record still on disk
+        bases = self.log.segment_bases()
+        return bases[0] if bases else 0
+
+    def _write_offset(self, offset: int):
+        os.pwrite(self.offset_lock.fd, f"{offset:0{_offset_width}d}".encode("ascii"), 0)
+        if self.log.fsync:
+            os.fsync(self.offset_lock.fd)
+
+    def poll(self) -> typing.Optional[bytes]:
+        """
+        Claim the next record for this group, or return None if the group has consumed everything
+        """
+        with self.offset_lock:
+            offset = self._read_offset()
+            while True:
+                base = offset - offset % self.log.segment_size
+                position = offset - base
+                segment = self.log._readable_segment(base)
+                if segment is None:
+                    bases = self.log.segment_bases()
+                    if bases and bases[0] > offset:
+                        # Our segment was deleted from under us, skip ahead to what is left
+                        logger.warning(f"Consumer group '{self.group}' skipping from {offset} to {bases[0]} of task log in {self.log.directory}")
+                        offset = bases[0]
+                        self._write_offset(offset)
+                        continue
+                    return None
+                (length,) = _record_header.unpack_from(segment, position)
+                if length == _end_marker:
+                    return None
+                if length == _roll_marker:
+                    offset = base + self.log.segment_size
+                    self._write_offset(offset)
+                    continue
+                payload = bytes(segment[position + _record_header.size : position + _record_header.size + length])
+                self._write_offset(offset + _record_header.size + length)
+                return payload
+
+    def lag(self, limit: typing.Optional[int] = None) -> int:
+        """
+        Number of records written to the log that this group has not consumed yet, counting no further than limit
+        """
+        with self.offset_lock:
+            offset = self._read_offset()
+        count = 0
+        for base in self.log.segment_bases():
+            if base + self.log.segment_size <= offset:
+                continue
+            segment = self.log._map_segment(base)
+            if segment is None:
+                continue
+            try:
+                position = max(0, offset - base)
+                while limit is None or count < limit:
+                    (length,) = _record_header.unpack_from(segment, position)
+                    if length in (_end_marker, _roll_marker):
+                        break
+                    count += 1
+                    position += _record_header.size + length
+            finally:
+                segment.close()
+        return count
+
+    def close(self):
+        self.offset_lock.close()
+
+
+def _prepare_segment_log(config: dict) -> SegmentLog:
+    directory = config.get("directory", "/tmp/latigo/queue")
+    topic = config.get("topic", "latigo_topic")
+    segment_size = int(config.get("segment_size", 64 * 1024 * 1024))
+    fsync = bool(config.get("fsync", False))
+    return SegmentLog(os.path.join(directory, topic), segment_size=segment_size, fsync=fsync)
+
+
+class LocalTaskQueueSender(TaskQueueSenderInterface):
+    """
+    Puts tasks on a segment log on local disk, for single node deployments and broker-less benchmarks
+    """
+
+    def __init__(self, config: dict):
+        if not config:
+            raise Exception("No config specified")
+        self.config = config
+        self.log = _prepare_segment_log(config)
+        # The consumer group whose backlog lag() reports
+        self.lag_group_id = str(config.get("lag_group_id", config.get("group.id", "executor")))
+        self.lag_consumer: typing.Optional[SegmentLogConsumer] = None
+
+    def put_task(self, task: Task):
+        task_bytes = serialize_task(task)
+        if not task_bytes:
+            raise Exception("Could not serialize task")
+        if isinstance(task_bytes, str):
+            task_bytes = task_bytes.encode("utf-8")
+        self.log.append(task_bytes)
+
+    def lag(self) -> typing.Optional[int]:
+        if self.lag_consumer is None:
+            self.lag_consumer = self.log.consumer(self.lag_group_id)
+        return self.lag_consumer.lag()
+
+    def close(self):
+        if self.lag_consumer is not None:
+            self.lag_consumer.close()
+        self.log.close()
+
+
+class LocalTaskQueueReceiver(TaskQueueReceiverInterface):
+    """
+    Takes tasks from a segment log on local disk. Receivers with the same group.id share the work between them.
+    """
+
+    def __init__(self, config: dict):
+        if not config:
+            raise Exception("No config specified")
+        self.config = config
+        self.log = _prepare_segment_log(config)
+        self.consumer = self.log.consumer(str(config.get("group.id", "executor")))
+        self.receive_timeout = parse_time_delta(config.get("receive_timeout", "1s")).total_seconds()
+        self.poll_interval = parse_time_delta(config.get("poll_interval", "50ms")).total_seconds()
+
+    def receive_event(self, timeout: float) -> typing.Optional[bytes]:
+        deadline = time.monotonic() + timeout
+        # Check again quickly right after going idle, then back off towards poll_interval
+        interval = min(0.001, self.poll_interval)
+        while True:
+            task_bytes = self.consumer.poll()
+            if task_bytes is not None:
+                return task_bytes
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, self.poll_interval)
+
+    def get_task(self, timeout: typing.Optional[float] = None) -> typing.Optional[Task]:
+        task_bytes = self.receive_event(self.receive_timeout if timeout is None else timeout)
+        if not task_bytes:
+            return None
+        task = deserialize_task(task_bytes)
+        if not task:
+            logger.error("Could not deserialize task")
+        return task
+
+    def close(self):
+        self.consumer.close()
+        self.log.close()
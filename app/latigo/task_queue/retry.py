@@ -0,0 +1,222 @@
+import os
+import json
+import heapq
+import random
+import time
+import logging
+import traceback
+import typing
+from datetime import datetime, timezone
+
+from latigo.task_queue import TaskQueueReceiverInterface, PartitionAssignmentListenerInterface
+from latigo.types import Task
+from latigo.utils import parse_time_delta
+
+logger = logging.getLogger(__name__)
+
+# How many of the most recent errors to keep with a task
+_max_errors_kept = 5
+
+
+def _utc_now_string() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def error_context(error: BaseException, attempt: int) -> dict:
+    """
+    What we keep about one failed attempt, for the logs and the dead letter queue
+    """
+    return {"attempt": attempt, "time": _utc_now_string(), "type": type(error).__name__, "message": str(error), "traceback": "".join(traceback.format_exception(type(error), error, error.__traceback__)[-10:])}
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with jitter: attempt n waits initial_delay * multiplier^(n-1), capped at max_delay
+    """
+
+    def __init__(self, config: typing.Optional[dict] = None):
+        config = config or {}
+        self.max_attempts = int(config.get("max_attempts", 5))
+        self.initial_delay = parse_time_delta(config.get("initial_delay", "30s")).total_seconds()
+        self.max_delay = parse_time_delta(config.get("max_delay", "30m")).total_seconds()
+        self.multiplier = float(config.get("multiplier", 2.0))
+        self.jitter = float(config.get("jitter", 0.1))
+
+    def delay(self, attempt: int) -> float:
+        delay = min(self.max_delay, self.initial_delay * self.multiplier ** max(0, attempt - 1))
+        return delay * (1.0 + random.uniform(-self.jitter, self.jitter))
+
+    def exhausted(self, attempt: int) -> bool:
+        return attempt >= self.max_attempts
+
+
+class RetryEntry:
+    __slots__ = ("task", "attempts", "errors", "due")
+
+    def __init__(self, task: Task, attempts: int = 0, errors: typing.Optional[typing.List[dict]] = None, due: float = 0.0):
+        self.task = task
+        self.attempts = attempts
+        self.errors = errors or []
+        self.due = due
+
+    def to_dict(self) -> dict:
+        return {"task": self.task.to_dict(), "attempts": self.attempts, "errors": self.errors, "due": self.due}
+
+    @classmethod
+    def from_dict(cls, entry: dict) -> "RetryEntry":
+        return cls(Task.from_dict(entry["task"]), entry.get("attempts", 0), entry.get("errors", []), entry.get("due", 0.0))
+
+
+class DeadLetterQueue:
+    """
+    Append-only JSON lines file of tasks that ran out of attempts, with the errors of their last attempts
+    """
+
+    def __init__(self, filename: str):
+        if not filename:
+            raise Exception("No dead letter filename specified")
+        self.filename = filename
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+
+    def put(self, entry: RetryEntry):
+        record = {**entry.to_dict(), "dead_at": _utc_now_string()}
+        del record["due"]
+        with open(self.filename, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def entries(self) -> typing.Iterator[dict]:
+        try:
+            with open(self.filename, "r") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        except FileNotFoundError:
+            return
+
+
+class RetryingTaskQueueReceiver(TaskQueueReceiverInterface):
+    """
+    Wraps a task queue receiver with a delayed retry queue and a dead letter queue.
+
+    Tasks reported as failed are held back and handed out again by get_task once their backoff has passed,
+    ahead of anything new from the wrapped queue. After max_attempts they go to the dead letter queue
+    instead. Pending retries are kept in a state file, so they survive a restart of the executor.
+    """
+
+    def __init__(self, receiver: TaskQueueReceiverInterface, config: dict):
+        if not receiver:
+            raise Exception("No receiver specified")
+        self.receiver = receiver
+        self.config = config or {}
+        self.policy = RetryPolicy(self.config)
+        self.state_file = self.config.get("state_file", None)
+        self.dead_letters = DeadLetterQueue(self.config.get("dead_letter_file", "/tmp/latigo/dead_letter.jsonl"))
+        # Retries waiting for their due time, as a heap of (due, sequence, entry)
+        self.delayed: typing.List[typing.Tuple[float, int, RetryEntry]] = []
+        self.sequence = 0
+        # Retries that have been handed out again, per model, until they either succeed or fail again
+        self.in_flight: typing.Dict[typing.Tuple[str, str], typing.List[RetryEntry]] = {}
+        self.retried_count = 0
+        self.dead_count = 0
+        self._load_state()
+
+    def _schedule(self, entry: RetryEntry):
+        self.sequence += 1
+        heapq.heappush(self.delayed, (entry.due, self.sequence, entry))
+
+    def _load_state(self):
+        if not self.state_file:
+            return
+        try:
+            with open(self.state_file, "r") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            logger.warning(f"Ignoring corrupt retry state in {self.state_file}: {e}")
+            return
+        for entry in entries:
+            self._schedule(RetryEntry.from_dict(entry))
+        if self.delayed:
+            logger.info(f"Loaded {len(self.delayed)} pending retries from {self.state_file}")
+
+    def _save_state(self):
+        if not self.state_file:
+            return
+        # Retries in flight when we stop are due again straight away on the next start
+        entries = [entry.to_dict() for _, _, entry in self.delayed] + [entry.to_dict() for entries in self.in_flight.values() for entry in entries]
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_file)), exist_ok=True)
+        tmp_filename = f"{self.state_file}.tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp_filename, self.state_file)
+
+    def _take_in_flight(self, task: Task) -> typing.List[RetryEntry]:
+        """
+        Remove and return retries covered by this task. The executor may have merged a retry into a wider task.
+        """
+        key = (task.project_name, task.model_name)
+        entries = self.in_flight.get(key, [])
+        covered = [entry for entry in entries if task.time_range.from_us <= entry.task.time_range.from_us and entry.task.time_range.to_us <= task.time_range.to_us]
+        if covered:
+            remaining = [entry for entry in entries if entry not in covered]
+            if remaining:
+                self.in_flight[key] = remaining
+            else:
+                del self.in_flight[key]
+        return covered
+
+    def next_due(self) -> typing.Optional[float]:
+        """
+        Wall clock time at which the next delayed retry becomes due, if any are waiting
+        """
+        return self.delayed[0][0] if self.delayed else None
+
+    def pending_count(self) -> int:
+        return len(self.delayed)
+
+    def get_task(self, timeout: typing.Optional[float] = None) -> typing.Optional[Task]:
+        now = time.time()
+        if self.delayed and self.delayed[0][0] <= now:
+            _, _, entry = heapq.heappop(self.delayed)
+            self.in_flight.setdefault((entry.task.project_name, entry.task.model_name), []).append(entry)
+            logger.info(f"Retrying task for '{entry.task.project_name}.{entry.task.model_name}' {entry.task.time_range}, attempt {entry.attempts + 1} of {self.policy.max_attempts}")
+            return entry.task
+        if self.delayed:
+            # Wake up in time for the next retry
+            remaining = self.delayed[0][0] - now
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        return self.receiver.get_task(timeout)
+
+    def task_failed(self, task: Task, error: BaseException):
+        previous = self._take_in_flight(task)
+        attempts = max([entry.attempts for entry in previous] + [0]) + 1
+        errors = [context for entry in previous for context in entry.errors]
+        errors.append(error_context(error, attempts))
+        entry = RetryEntry(task, attempts, errors[-_max_errors_kept:])
+        if self.policy.exhausted(attempts):
+            self.dead_count += 1
+            self.dead_letters.put(entry)
+            logger.error(f"Giving up on task for '{task.project_name}.{task.model_name}' {task.time_range} after {attempts} attempts, moved to dead letter queue {self.dead_letters.filename}")
+        else:
+            delay = self.policy.delay(attempts)
+            entry.due = time.time() + delay
+            self.retried_count += 1
+            self._schedule(entry)
+            logger.warning(f"Task for '{task.project_name}.{task.model_name}' {task.time_range} failed on attempt {attempts}, retrying in {delay:.1f}s: {error}")
+        self._save_state()
+
+    def task_succeeded(self, task: Task):
+        if self._take_in_flight(task):
+            self._save_state()
+
+    def task_dropped(self, task: Task):
+        # A retry the executor skips is settled, it must not come back on the next start
+        if self._take_in_flight(task):
+            self._save_state()
+
+    def set_assignment_listener(self, listener: PartitionAssignmentListenerInterface):
+        self.receiver.set_assignment_listener(listener)
+
+    def stats(self) -> dict:
+        return {"delayed": len(self.delayed), "in_flight": sum(len(entries) for entries in self.in_flight.values()), "retried": self.retried_count, "dead": self.dead_count}
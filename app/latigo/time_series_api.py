@@ -1,31 +1,49 @@
 import typing
 import logging
-import requests
 
-from latigo.types import Task, SensorDataSpec, SensorData, TimeRange, PredictionData
+from latigo.types import Task, SensorDataSpec, SensorData, TimeRange, PredictionData, LatigoSensorTag
 from latigo.sensor_data import SensorDataProviderInterface
 from latigo.prediction_storage import PredictionStorageProviderInterface
 import latigo.utils
 from latigo.auth import create_auth_session
+from latigo.session import PooledSession
+from latigo.rate_limiter import get_rate_limiter, retry_after_seconds
+
+if typing.TYPE_CHECKING:
+    from latigo.columnar import SensorDataColumns
 
 logger = logging.getLogger(__name__)
 
-timeseries_client_auth_session: typing.Optional[requests.Session] = None
+timeseries_client_auth_session: typing.Optional[PooledSession] = None
 
 
-def transform_from_timeseries_to_gordo(data: typing.Optional[dict]):
-    return data
+def transform_from_timeseries_to_gordo(data: typing.Optional[dict]) -> "SensorDataColumns":
+    """
+    Turn a time series API data response into one columnar block with a column per time series
+    """
+    # numpy and pandas are only loaded once there is sensor data to hold
+    from latigo.columnar import SensorDataColumns
+
+    if not data or not data.get("latigo-ok", True):
+        return SensorDataColumns.empty()
+    items = data.get("data", {}).get("items", [])
+    columns = []
+    for item in items:
+        datapoints = item.get("datapoints", [])
+        tag = LatigoSensorTag(name=item.get("name", item.get("id")), asset=item.get("assetId", None))
+        columns.append((tag, [datapoint.get("time") for datapoint in datapoints], [datapoint.get("value") for datapoint in datapoints]))
+    return SensorDataColumns.from_datapoints(columns)
 
 
 def transform_from_gordo_to_timeseries(data: typing.Optional[dict]):
     return data
 
 
-def get_auth_session(auth_config: dict):
+def get_auth_session(auth_config: dict, session_config: typing.Optional[dict] = None):
     global timeseries_client_auth_session
     if not timeseries_client_auth_session:
         # logger.info("CREATING SESSION:")
-        timeseries_client_auth_session = create_auth_session(auth_config)
+        timeseries_client_auth_session = create_auth_session(auth_config, session_config)
     return timeseries_client_auth_session
 
 
@@ -39,7 +57,13 @@ class TimeSeriesAPIClient:
 
     def _parse_auth_config(self):
         self.auth_config = self.config.get("auth", dict())
-        self.session = get_auth_session(self.auth_config)
+        self.session_config = self.config.get("session", dict())
+        self.session = get_auth_session(self.auth_config, self.session_config)
+
+    def _parse_rate_limit_config(self):
+        self.rate_limit_config = self.config.get("rate_limit", dict())
+        self.read_rate_limiter = get_rate_limiter("time_series_read", self.rate_limit_config.get("read"))
+        self.write_rate_limiter = get_rate_limiter("time_series_write", self.rate_limit_config.get("write"))
 
     def __init__(self, config: dict):
         self.config = config
@@ -47,28 +71,37 @@ class TimeSeriesAPIClient:
             raise Exception("No time_series_config specified")
         self._parse_auth_config()
         self._parse_base_url()
+        self._parse_rate_limit_config()
         self.do_async = self.config.get("async", False)
 
+    def _throttle_on_too_many_requests(self, res, rate_limiter):
+        if res is not None and res.status_code == 429:
+            rate_limiter.penalize(retry_after_seconds(res.headers))
+
     def _fetch_data(self, id: str, time_range: TimeRange) -> typing.Optional[dict]:
         url = f"{self.base_url}/timeseries/v1.5/{id}/data?startTime={time_range.rfc3339_from()}&endTime={time_range.rfc3339_to()}&limit=100000&includeOutsidePoints=true"
+        self.read_rate_limiter.acquire()
         res = self.session.get(url)
+        self._throttle_on_too_many_requests(res, self.read_rate_limiter)
         if res:
             ret = res.json()
             ret["latigo-ok"] = True
             return ret
         else:
-            logger.warning("Could not fetch data from {url}")
+            logger.warning(f"Could not fetch data from {url}")
             return {"latigo-ok": False}
 
     def _store_data(self, id: str, data: dict):
         url = f"{self.base_url}/timeseries/v1.5/{id}/data?async={self.do_async}"
+        self.write_rate_limiter.acquire()
         res = self.session.post(url, data=data)
+        self._throttle_on_too_many_requests(res, self.write_rate_limiter)
         if res:
             ret = res.json()
             ret["latigo-ok"] = True
             return ret
         else:
-            logger.warning("Could not store data to {url}")
+            logger.warning(f"Could not store data to {url}")
             return {"latigo-ok": False}
 
 
@@ -79,6 +112,7 @@ class TimeSeriesAPISensorDataProvider(TimeSeriesAPIClient, SensorDataProviderInt
             raise Exception("No time_series_config specified")
         self._parse_auth_config()
         self._parse_base_url()
+        self._parse_rate_limit_config()
 
     def _look_up_meta(self):
         pass
@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import typing
+import contextvars
+from collections import deque
+
+from latigo.types import Task
+
+logger = logging.getLogger(__name__)
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+class Span:
+    """
+    One timed step in the life of a traced task
+    """
+
+    __slots__ = ("trace_id", "name", "start_us", "duration", "attributes")
+
+    def __init__(self, trace_id: str, name: str, start_us: int, duration: float, attributes: typing.Optional[dict] = None):
+        self.trace_id = trace_id
+        self.name = name
+        self.start_us = start_us
+        self.duration = duration
+        self.attributes = attributes or {}
+
+    def to_dict(self) -> dict:
+        return {"trace_id": self.trace_id, "name": self.name, "start_time": self.start_us / 1000000, "duration": self.duration, **self.attributes}
+
+
+class SpanExporterInterface:
+    def export(self, span: Span):
+        """
+        Hand over one finished span
+        """
+
+    def close(self):
+        """
+        Flush and release whatever the exporter holds on to
+        """
+
+
+class DevNullSpanExporter(SpanExporterInterface):
+    def export(self, span: Span):
+        pass
+
+
+class RingBufferSpanExporter(SpanExporterInterface):
+    """
+    Keeps the most recent capacity spans in memory
+    """
+
+    def __init__(self, config: dict):
+        self.capacity = int(config.get("capacity", 10000))
+        self.buffer: typing.Deque[Span] = deque(maxlen=self.capacity)
+
+    def export(self, span: Span):
+        self.buffer.append(span)
+
+    def spans(self, trace_id: typing.Optional[str] = None) -> typing.List[Span]:
+        return [span for span in list(self.buffer) if trace_id is None or span.trace_id == trace_id]
+
+
+class JsonlSpanExporter(SpanExporterInterface):
+    """
+    Appends one JSON line per span to a file
+    """
+
+    def __init__(self, config: dict):
+        self.filename = config.get("filename", None)
+        if not self.filename:
+            raise Exception("No span filename specified")
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        self.lock = threading.Lock()
+        # Line buffered, so a crash loses at most the span being written
+        self.file = open(self.filename, "a", buffering=1)
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict()) + "\n"
+        with self.lock:
+            self.file.write(line)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def span_exporter_factory(tracing_config: typing.Optional[dict]) -> SpanExporterInterface:
+    tracing_config = tracing_config or {}
+    exporter_type = tracing_config.get("type", None)
+    if "jsonl" == exporter_type:
+        return JsonlSpanExporter(tracing_config)
+    elif "ring_buffer" == exporter_type:
+        return RingBufferSpanExporter(tracing_config)
+    return DevNullSpanExporter()
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_null_span = _NullSpan()
+
+
+class _TimedSpan:
+    __slots__ = ("tracer", "task", "name", "attributes", "start_us", "started")
+
+    def __init__(self, tracer: "Tracer", task: Task, name: str, attributes: dict):
+        self.tracer = tracer
+        self.task = task
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.start_us = int(time.time() * 1000000)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.tracer.record(self.task, self.name, self.start_us, time.perf_counter() - self.started, **self.attributes)
+
+
+class _Activation:
+    __slots__ = ("tracer", "task", "token")
+
+    def __init__(self, tracer: "Tracer", task: Task):
+        self.tracer = tracer
+        self.task = task
+
+    def __enter__(self):
+        self.token = _current.set((self.tracer, self.task))
+        return self
+
+    def __exit__(self, *exc):
+        _current.reset(self.token)
+
+
+# The tracer and task of what the current thread or coroutine is working on
+_current: "contextvars.ContextVar[typing.Optional[typing.Tuple[Tracer, Task]]]" = contextvars.ContextVar("latigo_trace", default=None)
+
+
+class Tracer:
+    """
+    Records spans for traced tasks. Tasks without a trace id, and everything when the exporter is a DevNull, cost
+    one attribute check per span.
+    """
+
+    def __init__(self, exporter: SpanExporterInterface):
+        self.exporter = exporter
+        self.enabled = not isinstance(exporter, DevNullSpanExporter)
+
+    def record(self, task: Task, name: str, start_us: int, duration: float, **attributes):
+        """
+        Export a span for a step that has already been timed
+        """
+        if not self.enabled or not task.trace_id:
+            return
+        try:
+            self.exporter.export(Span(task.trace_id, name, start_us, duration, {"project_name": task.project_name, "model_name": task.model_name, **attributes}))
+        except Exception as e:
+            logger.warning(f"Could not export span '{name}' of trace {task.trace_id}: {e}")
+
+    def span(self, task: Task, name: str, **attributes):
+        """
+        Context manager timing its block as a span of the task's trace
+        """
+        if not self.enabled or not task.trace_id:
+            return _null_span
+        return _TimedSpan(self, task, name, attributes)
+
+    def activate(self, task: Task):
+        """
+        Make task the current trace for span() calls further down, including coroutines started inside the block
+        """
+        if not self.enabled or not task.trace_id:
+            return _null_span
+        return _Activation(self, task)
+
+    def close(self):
+        self.exporter.close()
+
+
+def span(name: str, **attributes):
+    """
+    Time a block as a span of the current trace, if there is one
+    """
+    current = _current.get()
+    if current is None:
+        return _null_span
+    tracer, task = current
+    return tracer.span(task, name, **attributes)
@@ -1,37 +1,219 @@
-import pandas as pd
+import json
 import typing
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from collections import namedtuple
 from dataclasses import dataclass
-from dataclasses_json import dataclass_json, DataClassJsonMixin
 
-from latigo.utils import rfc3339_from_datetime
+if typing.TYPE_CHECKING:
+    from latigo.columnar import SensorDataColumns, PredictionBlock
 
+_epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_one_microsecond = timedelta(microseconds=1)
 
-@dataclass
-class Task(DataClassJsonMixin):
-    project_name: str = "unknown"
-    model_name: str = "unknown"
-    from_time: datetime = datetime.now() - timedelta(0, 20)
-    to_time: datetime = datetime.now()
 
+def epoch_us_from_datetime(dt: datetime) -> int:
+    """
+    Canonical representation of a point in time: integer microseconds since the epoch in UTC.
+    Naive datetimes are taken to be in UTC, like rfc3339_from_datetime does.
+    """
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - _epoch) // _one_microsecond
+
+
+def datetime_from_epoch_us(epoch_us: int) -> datetime:
+    return _epoch + timedelta(microseconds=epoch_us)
+
+
+def rfc3339_from_epoch_us(epoch_us: int) -> str:
+    dt = datetime_from_epoch_us(epoch_us)
+    if dt.microsecond:
+        return dt.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
 
-@dataclass
-class TimeRange:
 
-    from_time: datetime
-    to_time: datetime
+def _epoch_us_from_json(value) -> int:
+    if isinstance(value, (int, float)):
+        return int(round(value * 1000000))
+    return epoch_us_from_datetime(datetime.fromisoformat(str(value).replace("Z", "+00:00")))
 
-    def rfc3339_from(self):
-        return rfc3339_from_datetime(self.from_time)
 
-    def rfc3339_to(self):
-        return rfc3339_from_datetime(self.to_time)
+class TimeRange:
+    """
+    Immutable half open time window stored as UTC epoch microseconds.
+    Cheap to hash and compare, and formats its RFC3339 bounds only once.
+    """
+
+    __slots__ = ("from_us", "to_us", "_hash", "_rfc3339_from", "_rfc3339_to")
+    from_us: int
+    to_us: int
+    _hash: int
+    _rfc3339_from: typing.Optional[str]
+    _rfc3339_to: typing.Optional[str]
+
+    def __init__(self, from_time: datetime, to_time: datetime):
+        self._init(epoch_us_from_datetime(from_time), epoch_us_from_datetime(to_time))
+
+    def _init(self, from_us: int, to_us: int):
+        object.__setattr__(self, "from_us", from_us)
+        object.__setattr__(self, "to_us", to_us)
+        object.__setattr__(self, "_hash", hash((from_us, to_us)))
+        object.__setattr__(self, "_rfc3339_from", None)
+        object.__setattr__(self, "_rfc3339_to", None)
+
+    @classmethod
+    def from_epoch_us(cls, from_us: int, to_us: int) -> "TimeRange":
+        time_range = cls.__new__(cls)
+        time_range._init(from_us, to_us)
+        return time_range
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __reduce__(self):
+        return (TimeRange.from_epoch_us, (self.from_us, self.to_us))
+
+    @property
+    def from_time(self) -> datetime:
+        return datetime_from_epoch_us(self.from_us)
+
+    @property
+    def to_time(self) -> datetime:
+        return datetime_from_epoch_us(self.to_us)
+
+    def duration(self) -> timedelta:
+        return timedelta(microseconds=self.to_us - self.from_us)
+
+    def rfc3339_from(self) -> str:
+        rfc3339 = self._rfc3339_from
+        if rfc3339 is None:
+            rfc3339 = rfc3339_from_epoch_us(self.from_us)
+            object.__setattr__(self, "_rfc3339_from", rfc3339)
+        return rfc3339
+
+    def rfc3339_to(self) -> str:
+        rfc3339 = self._rfc3339_to
+        if rfc3339 is None:
+            rfc3339 = rfc3339_from_epoch_us(self.to_us)
+            object.__setattr__(self, "_rfc3339_to", rfc3339)
+        return rfc3339
+
+    def __eq__(self, other):
+        if not isinstance(other, TimeRange):
+            return NotImplemented
+        return self.from_us == other.from_us and self.to_us == other.to_us
+
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        return f"TimeRange({self.rfc3339_from()}, {self.rfc3339_to()})"
 
     def __str__(self):
         return f"TimeRange({self.from_time} -> {self.to_time})"
 
 
+class Task:
+    """
+    Immutable description of one prediction job: which model to run over which time window.
+    Usable directly as a key in caches, deduplication sets and watermark indexes.
+
+    A task sent by the scheduler also carries a trace id and the wall clock time it was enqueued, so its
+    journey can be followed through the executor. Neither takes part in equality or hashing.
+    """
+
+    __slots__ = ("project_name", "model_name", "time_range", "trace_id", "enqueued_us", "_hash")
+    project_name: str
+    model_name: str
+    time_range: TimeRange
+    trace_id: typing.Optional[str]
+    enqueued_us: typing.Optional[int]
+    _hash: int
+
+    def __init__(self, project_name: str = "unknown", model_name: str = "unknown", from_time: typing.Optional[datetime] = None, to_time: typing.Optional[datetime] = None, trace_id: typing.Optional[str] = None, enqueued_us: typing.Optional[int] = None):
+        # Defaults are evaluated per task, not once at import
+        now = datetime.now(timezone.utc)
+        from_time = from_time if from_time is not None else now - timedelta(0, 20)
+        to_time = to_time if to_time is not None else now
+        self._init(project_name, model_name, TimeRange(from_time, to_time), trace_id, enqueued_us)
+
+    def _init(self, project_name: str, model_name: str, time_range: TimeRange, trace_id: typing.Optional[str] = None, enqueued_us: typing.Optional[int] = None):
+        object.__setattr__(self, "project_name", project_name)
+        object.__setattr__(self, "model_name", model_name)
+        object.__setattr__(self, "time_range", time_range)
+        object.__setattr__(self, "trace_id", trace_id)
+        object.__setattr__(self, "enqueued_us", enqueued_us)
+        object.__setattr__(self, "_hash", hash((project_name, model_name, time_range)))
+
+    @classmethod
+    def from_epoch_us(cls, project_name: str, model_name: str, from_us: int, to_us: int, trace_id: typing.Optional[str] = None, enqueued_us: typing.Optional[int] = None) -> "Task":
+        task = cls.__new__(cls)
+        task._init(project_name, model_name, TimeRange.from_epoch_us(from_us, to_us), trace_id, enqueued_us)
+        return task
+
+    def traced(self, trace_id: str, enqueued_us: int) -> "Task":
+        """
+        Return a copy of this task stamped with a trace id and enqueue time
+        """
+        task = Task.__new__(Task)
+        task._init(self.project_name, self.model_name, self.time_range, trace_id, enqueued_us)
+        return task
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __reduce__(self):
+        return (Task.from_epoch_us, (self.project_name, self.model_name, self.time_range.from_us, self.time_range.to_us, self.trace_id, self.enqueued_us))
+
+    @property
+    def from_time(self) -> datetime:
+        return self.time_range.from_time
+
+    @property
+    def to_time(self) -> datetime:
+        return self.time_range.to_time
+
+    def replace(self, **changes) -> "Task":
+        """
+        Return a copy of this task with some fields replaced
+        """
+        fields: typing.Dict[str, typing.Any] = {"project_name": self.project_name, "model_name": self.model_name, "from_time": self.from_time, "to_time": self.to_time, "trace_id": self.trace_id, "enqueued_us": self.enqueued_us}
+        fields.update(changes)
+        return Task(**fields)
+
+    def __eq__(self, other):
+        if not isinstance(other, Task):
+            return NotImplemented
+        return self._hash == other._hash and self.project_name == other.project_name and self.model_name == other.model_name and self.time_range == other.time_range
+
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        return f"Task(project_name={self.project_name!r}, model_name={self.model_name!r}, from_time={self.time_range.rfc3339_from()}, to_time={self.time_range.rfc3339_to()})"
+
+    def to_dict(self) -> dict:
+        # Times are epoch seconds, the same encoding dataclasses_json used so older peers can still read them
+        data = {"project_name": self.project_name, "model_name": self.model_name, "from_time": self.time_range.from_us / 1000000, "to_time": self.time_range.to_us / 1000000}
+        if self.trace_id is not None:
+            data["trace_id"] = self.trace_id
+        if self.enqueued_us is not None:
+            data["enqueued_time"] = self.enqueued_us / 1000000
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Task":
+        enqueued_time = data.get("enqueued_time", None)
+        return cls.from_epoch_us(data.get("project_name", "unknown"), data.get("model_name", "unknown"), _epoch_us_from_json(data["from_time"]), _epoch_us_from_json(data["to_time"]), data.get("trace_id", None), _epoch_us_from_json(enqueued_time) if enqueued_time is not None else None)
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def from_json(cls, task_json: typing.Union[str, bytes]) -> "Task":
+        return cls.from_dict(json.loads(task_json))
+
+
 LatigoSensorTag = namedtuple("LatigoSensorTag", ["name", "asset"])
 
 
@@ -44,17 +226,21 @@ class SensorDataSpec:
 class SensorData:
 
     time_range: TimeRange
-    data: typing.Iterable[pd.Series]
+    data: "SensorDataColumns"
 
     def __str__(self):
-        return f"PredictionData({self.time_range})"
+        return f"SensorData({self.time_range}, {self.data})"
 
 
 @dataclass
 class PredictionData:
     name: str
     time_range: TimeRange
-    data: typing.Iterable[typing.Tuple[str, pd.DataFrame, typing.List[str]]]
+    data: typing.List["PredictionBlock"]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(block.nbytes for block in self.data)
 
     def __str__(self):
-        return f"PredictionData({self.time_range}, result={len(self.result)})"
+        return f"PredictionData({self.name}, {self.time_range}, blocks={len(self.data)}, bytes={self.nbytes})"
@@ -3,6 +3,7 @@ import pprint
 import logging
 from datetime import datetime, timedelta
 import asyncio
+import time
 import typing
 import yaml
 import os.path
@@ -15,6 +16,25 @@ def rfc3339_from_datetime(dt: datetime):
     return dt.isoformat("T") + "Z"
 
 
+_time_delta_regex = re.compile(r"^\s*(?P<value>[0-9]+(\.[0-9]+)?)\s*(?P<unit>ms|s|sec|m|min|h|hr|d|day|days)\s*$")
+_time_delta_units = {"ms": "milliseconds", "s": "seconds", "sec": "seconds", "m": "minutes", "min": "minutes", "h": "hours", "hr": "hours", "d": "days", "day": "days", "days": "days"}
+
+
+def parse_time_delta(value) -> timedelta:
+    """
+    Parse simple durations like "20s", "30m" or "1d" without pulling in pandas,
+    falling back to pandas.to_timedelta for anything more elaborate
+    """
+    if isinstance(value, timedelta):
+        return value
+    match = _time_delta_regex.match(str(value))
+    if match:
+        return timedelta(**{_time_delta_units[match.group("unit")]: float(match.group("value"))})
+    import pandas as pd
+
+    return pd.to_timedelta(value).to_pytimedelta()
+
+
 def load_yaml(filename, output=False):
     if not os.path.exists(filename):
         return None, f"File did not exist: '{filename}'."
@@ -76,13 +96,14 @@ def load_config(config_filename: str, overlay_config: dict, output=False):
     return config
 
 
+_event_hub_connection_string_regex = re.compile(r"Endpoint=sb://(?P<endpoint>.*)/;SharedAccessKeyName=(?P<shared_access_key_name>.*);SharedAccessKey=(?P<shared_access_key>.*);EntityPath=(?P<entity_path>.*)")
+
+
 def parse_event_hub_connection_string(connection_string: str):
     if not connection_string:
         return None
-    regex = r"Endpoint=sb://(?P<endpoint>.*)/;SharedAccessKeyName=(?P<shared_access_key_name>.*);SharedAccessKey=(?P<shared_access_key>.*);EntityPath=(?P<entity_path>.*)"
-    matches = list(re.finditer(regex, connection_string))
-    if len(matches) > 0:
-        match = matches[0]
+    match = _event_hub_connection_string_regex.search(connection_string)
+    if match:
         return match.groupdict()
 
 
@@ -112,10 +133,8 @@ def parse_gordo_connection_string(connection_string: str):
 def parse_time_series_api_base_url(connection_string: str):
     if not connection_string:
         return None
-    regex = r"Endpoint=sb://(?P<endpoint>.*)/;SharedAccessKeyName=(?P<shared_access_key_name>.*);SharedAccessKey=(?P<shared_access_key>.*);EntityPath=(?P<entity_path>.*)"
-    matches = list(re.finditer(regex, connection_string))
-    if len(matches) > 0:
-        match = matches[0]
+    match = _event_hub_connection_string_regex.search(connection_string)
+    if match:
         return match.groupdict()
 
 
@@ -148,32 +167,37 @@ def human_delta(td_object: timedelta, max: int = 0):
 
 
 class Timer:
+    """
+    Interval timer on the monotonic clock, so wall clock adjustments never trigger it early or late
+    """
+
     def __init__(self, trigger_interval: timedelta):
         self.trigger_interval = trigger_interval
-        self.start_time: typing.Optional[datetime] = None
+        self.start_time: typing.Optional[float] = None
 
-    def start(self, start_time: typing.Optional[datetime] = None):
-        if start_time:
-            self.start_time = start_time
-        else:
-            self.start_time = datetime.now()
+    def start(self, start_time: typing.Optional[float] = None):
+        self.start_time = time.monotonic() if start_time is None else start_time
 
     def stop(self):
         self.start_time = None
 
     def interval(self) -> typing.Optional[timedelta]:
-        if not self.start_time:
+        if self.start_time is None:
             return None
-        return datetime.now() - self.start_time
+        return timedelta(seconds=time.monotonic() - self.start_time)
+
+    def remaining(self) -> timedelta:
+        iv = self.interval()
+        if iv is None or iv > self.trigger_interval:
+            return timedelta(0)
+        return self.trigger_interval - iv
 
     def is_triggered(self) -> bool:
         iv = self.interval()
-        return True if not iv else (iv > self.trigger_interval)
+        return True if iv is None else (iv > self.trigger_interval)
 
     async def wait_for_trigger(self):
-        iv = self.interval()
-        if iv:
-            await asyncio.sleep(iv)
+        await asyncio.sleep(self.remaining().total_seconds())
 
     def __str__(self):
-        return f"Timer(start_time={self.start_time}, trigger_interval={self.trigger_interval} {'[triggered]' if self.is_triggered() else ''})"
+        return f"Timer(interval={self.interval()}, trigger_interval={self.trigger_interval} {'[triggered]' if self.is_triggered() else ''})"
@@ -0,0 +1,253 @@
+"""
+Micro-benchmarks for hot path helpers, on fixed size synthetic inputs so results are comparable between runs.
+
+Results are seconds per call, the best of a few repeats. A baseline is kept in benchmark_baseline.json next to this
+file; record it on the machine you compare on, as absolute numbers do not carry over between machines:
+
+    PYTHONPATH=app python -m tests.load.benchmarks baseline
+    PYTHONPATH=app python -m tests.load.benchmarks compare --threshold 0.2
+"""
+import os
+import sys
+import json
+import timeit
+import random
+import asyncio
+import argparse
+import platform
+import typing
+from types import SimpleNamespace
+from datetime import datetime, timedelta, timezone
+
+baseline_filename: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# Synthetic input sizes
+prediction_rows = 1000
+prediction_chunks = 10
+prediction_tags = 4
+
+
+class SkipBenchmark(Exception):
+    pass
+
+
+def _sample_task():
+    from latigo.types import Task
+
+    return Task("ioc-1130", "1130-12-ab-1234", datetime(2019, 11, 1, 12, 0, tzinfo=timezone.utc), datetime(2019, 11, 1, 12, 30, tzinfo=timezone.utc))
+
+
+def _prediction_frame(rows: int, start: int = 0):
+    """
+    A Gordo anomaly response shaped frame: model input, output and per tag anomaly columns plus the total anomaly
+    """
+    import numpy as np
+    import pandas as pd
+
+    tags = [f"tag-{tag}" for tag in range(prediction_tags)]
+    columns = pd.MultiIndex.from_tuples([(group, tag) for group in ["model-input", "model-output", "tag-anomaly-scaled"] for tag in tags] + [("total-anomaly-scaled", "")])
+    # A named zone, pyarrow 0.15 can not read a fixed offset zone back from parquet
+    index = pd.date_range(datetime(2019, 11, 1) + timedelta(minutes=10 * start), periods=rows, freq="10min", tz="UTC")
+    return pd.DataFrame(np.random.RandomState(start).random_sample((rows, len(columns))), index=index, columns=columns)
+
+
+def setup_serialize_task():
+    from latigo.task_queue import serialize_task
+
+    task = _sample_task()
+    return lambda: serialize_task(task)
+
+
+def setup_deserialize_task():
+    from latigo.task_queue import serialize_task, deserialize_task
+
+    task_bytes = serialize_task(_sample_task())
+    return lambda: deserialize_task(task_bytes)
+
+
+def _gordo_client():
+    try:
+        from latigo.gordo.client import Client
+        from gordo_components.server import utils as server_utils
+    except ImportError as e:
+        raise SkipBenchmark(f"Gordo client not importable: {e}")
+    return Client, server_utils
+
+
+def setup_dataframe_from_response_json():
+    Client, server_utils = _gordo_client()
+    response = json.loads(json.dumps({"data": server_utils.dataframe_to_dict(_prediction_frame(prediction_rows))}))
+    return lambda: Client.dataframe_from_response(response)
+
+
+def setup_dataframe_from_response_parquet():
+    Client, server_utils = _gordo_client()
+    response = server_utils.dataframe_into_parquet_bytes(_prediction_frame(prediction_rows))
+    return lambda: Client.dataframe_from_response(response)
+
+
+def setup_accumulate_coroutine_predictions():
+    """
+    Client._accumulate_coroutine_predictions over batches that come back out of order, with the posts already done
+    """
+    Client, _ = _gordo_client()
+    from gordo_components.client.utils import PredictionResult
+
+    # Only parallelism is used by the accumulation, the constructor would go looking for the project
+    client = Client.__new__(Client)
+    client.parallelism = 10
+    endpoint = SimpleNamespace(target_name="1130-12-ab-1234")
+    chunk_rows = prediction_rows // prediction_chunks
+    prediction_dfs = [_prediction_frame(chunk_rows, chunk * chunk_rows) for chunk in range(prediction_chunks)]
+    random.Random(0).shuffle(prediction_dfs)
+
+    async def posted(predictions):
+        return PredictionResult(name=endpoint.target_name, predictions=predictions, error_messages=[])
+
+    loop = asyncio.new_event_loop()
+    return lambda: loop.run_until_complete(client._accumulate_coroutine_predictions(endpoint, [posted(predictions) for predictions in prediction_dfs]))
+
+
+def setup_rfc3339_time_range():
+    from latigo.types import TimeRange
+
+    from_us = 1572609600000000
+    # A fresh range every call, formatting is cached per range
+    return lambda: TimeRange.from_epoch_us(from_us, from_us + 1800000000).rfc3339_from()
+
+
+def setup_rfc3339_time_range_cached():
+    time_range = _sample_task().time_range
+    return lambda: (time_range.rfc3339_from(), time_range.rfc3339_to())
+
+
+def setup_rfc3339_from_datetime():
+    from latigo.utils import rfc3339_from_datetime
+
+    dt = datetime(2019, 11, 1, 12, 0)
+    return lambda: rfc3339_from_datetime(dt)
+
+
+def setup_parse_event_hub_connection_string():
+    from latigo.utils import parse_event_hub_connection_string
+
+    connection_string = "Endpoint=sb://latigo.servicebus.windows.net/;SharedAccessKeyName=scheduler;SharedAccessKey=c2VjcmV0c2VjcmV0c2VjcmV0c2VjcmV0=;EntityPath=latigo_topic"
+    return lambda: parse_event_hub_connection_string(connection_string)
+
+
+# Name, setup returning the function to time, and calls per repeat
+benchmarks: typing.List[typing.Tuple[str, typing.Callable[[], typing.Callable], int]] = [
+    ("serialize_task", setup_serialize_task, 20000),
+    ("deserialize_task", setup_deserialize_task, 20000),
+    ("dataframe_from_response_json", setup_dataframe_from_response_json, 20),
+    ("dataframe_from_response_parquet", setup_dataframe_from_response_parquet, 50),
+    ("accumulate_coroutine_predictions", setup_accumulate_coroutine_predictions, 100),
+    ("rfc3339_time_range", setup_rfc3339_time_range, 20000),
+    ("rfc3339_time_range_cached", setup_rfc3339_time_range_cached, 200000),
+    ("rfc3339_from_datetime", setup_rfc3339_from_datetime, 50000),
+    ("parse_event_hub_connection_string", setup_parse_event_hub_connection_string, 50000),
+]
+
+
+def run_benchmarks(names: typing.Optional[typing.List[str]] = None, repeat: int = 5, scale: float = 1.0) -> dict:
+    """
+    Time every benchmark (or the named ones), scale shrinks or grows the number of calls per repeat
+    """
+    results: typing.Dict[str, float] = {}
+    skipped: typing.Dict[str, str] = {}
+    for name, setup, number in benchmarks:
+        if names and name not in names:
+            continue
+        try:
+            function = setup()
+        except SkipBenchmark as e:
+            skipped[name] = str(e)
+            continue
+        number = max(1, int(number * scale))
+        results[name] = min(timeit.Timer(function).repeat(repeat, number)) / number
+    return {"python": platform.python_version(), "machine": platform.machine(), "results": results, "skipped": skipped}
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.2) -> typing.List[dict]:
+    """
+    Compare two runs benchmark by benchmark, flagging those that got slower than the baseline by more than threshold
+    """
+    rows = []
+    baseline_results = baseline.get("results", {})
+    for name, seconds in current.get("results", {}).items():
+        baseline_seconds = baseline_results.get(name, None)
+        ratio = seconds / baseline_seconds if baseline_seconds else None
+        rows.append({"name": name, "baseline": baseline_seconds, "current": seconds, "ratio": ratio, "regressed": ratio is not None and ratio > 1.0 + threshold})
+    return rows
+
+
+def environment_mismatches(baseline: dict, current: dict) -> typing.List[str]:
+    """
+    Describe how the interpreter or machine of two runs differ, as timings only compare on the same ones
+    """
+    return [f"{key} {baseline.get(key)} in the baseline, {current.get(key)} now" for key in ["python", "machine"] if baseline.get(key) != current.get(key)]
+
+
+def _format_seconds(seconds: typing.Optional[float]) -> str:
+    if seconds is None:
+        return "-"
+    for unit, factor in [("s", 1.0), ("ms", 1e-3), ("us", 1e-6)]:
+        if seconds >= factor:
+            return f"{seconds / factor:.2f}{unit}"
+    return f"{seconds / 1e-9:.0f}ns"
+
+
+def print_comparison(rows: typing.List[dict], current: dict):
+    print(f"{'benchmark':40} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for row in rows:
+        ratio = f"{row['ratio']:.2f}" if row["ratio"] is not None else "new"
+        print(f"{row['name']:40} {_format_seconds(row['baseline']):>10} {_format_seconds(row['current']):>10} {ratio:>7}{'  REGRESSED' if row['regressed'] else ''}")
+    for name, reason in current.get("skipped", {}).items():
+        print(f"{name:40} skipped: {reason}")
+
+
+def load_results(filename: str) -> dict:
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+def save_results(results: dict, filename: str):
+    with open(filename, "w") as f:
+        json.dump(results, f, indent=4, sort_keys=True)
+        f.write("\n")
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Latigo hot path micro-benchmarks")
+    parser.add_argument("command", choices=["run", "compare", "baseline"], help="run: print results, compare: run and compare against the baseline, baseline: run and store as the new baseline")
+    parser.add_argument("names", nargs="*", help="Only these benchmarks")
+    parser.add_argument("--baseline", default=baseline_filename, help="Baseline results file")
+    parser.add_argument("--current", default=None, help="Compare this results file instead of running the benchmarks")
+    parser.add_argument("--output", default=None, help="Also write the results to this file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Fraction a benchmark may get slower before it counts as a regression")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeats per benchmark, the best one counts")
+    args = parser.parse_args(argv)
+    current = load_results(args.current) if args.current else run_benchmarks(args.names, args.repeat)
+    if args.output:
+        save_results(current, args.output)
+    if args.command == "baseline":
+        save_results(current, args.baseline)
+        print(f"Stored baseline for {len(current['results'])} benchmarks in {args.baseline}")
+        return 0
+    if args.command == "run":
+        print(json.dumps(current, indent=4, sort_keys=True))
+        return 0
+    baseline = load_results(args.baseline)
+    for mismatch in environment_mismatches(baseline, current):
+        print(f"WARNING: baseline was recorded elsewhere, {mismatch}, ratios are not meaningful", file=sys.stderr)
+    rows = compare(baseline, current, args.threshold)
+    print_comparison(rows, current)
+    regressed = [row["name"] for row in rows if row["regressed"]]
+    if regressed:
+        print(f"{len(regressed)} benchmarks regressed by more than {args.threshold:.0%}: {', '.join(regressed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
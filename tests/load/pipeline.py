@@ -0,0 +1,373 @@
+"""
+End-to-end pipeline load test: scheduler -> local task queue -> executors, against local stand-in HTTP servers
+for the Gordo ML server and the Time Series API, so it runs on a laptop without secrets or a live cluster.
+
+Run it directly for a JSON report to compare against a previous run:
+
+    PYTHONPATH=app python -m tests.load.pipeline --models 500 --duration 20s
+"""
+import os
+import sys
+import copy
+import json
+import time
+import random
+import asyncio
+import argparse
+import logging
+import resource
+import tempfile
+import threading
+import typing
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime
+
+from latigo.types import Task, rfc3339_from_epoch_us, epoch_us_from_datetime
+from latigo.auth import token_cache_key
+from latigo.task_queue import TaskQueueSenderInterface
+from latigo.scheduler import Scheduler
+from latigo.executor import PredictionExecutor
+from latigo.utils import parse_time_delta
+
+logger = logging.getLogger(__name__)
+
+stages = ["queue", "fetch", "predict", "store", "total"]
+
+
+def _percentile(values: typing.List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def _epoch_us_from_rfc3339(value: str) -> int:
+    return epoch_us_from_datetime(datetime.fromisoformat(value.replace("Z", "+00:00")))
+
+
+class StandInServer:
+    """
+    A JSON over HTTP server on a free local port, serving from a background thread and answering every request after latency seconds
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.request_count = 0
+        self.lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, like the services we stand in for
+            protocol_version = "HTTP/1.1"
+            # Send headers and body in one segment, or delayed ACKs add 40ms to every response
+            wbufsize = 65536
+            disable_nagle_algorithm = True
+
+            def _respond(self, method: str):
+                length = int(self.headers.get("Content-Length", 0) or 0)
+                body = self.rfile.read(length) if length else b""
+                url = urlparse(self.path)
+                with stand_in.lock:
+                    stand_in.request_count += 1
+                if stand_in.latency > 0:
+                    time.sleep(stand_in.latency)
+                status, response = stand_in.handle(method, url.path, {key: values[0] for key, values in parse_qs(url.query).items()}, json.loads(body) if body else None)
+                payload = json.dumps(response).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self._respond("GET")
+
+            def do_POST(self):
+                self._respond("POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name=self.__class__.__name__, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handle(self, method: str, path: str, query: dict, body: typing.Optional[dict]) -> typing.Tuple[int, typing.Any]:
+        return 404, {"error": f"No {method} {path}"}
+
+    def start(self) -> "StandInServer":
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "StandInServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class FakeTimeSeriesAPI(StandInServer):
+    """
+    Answers data requests for any time series id with series_count series of point_count evenly spaced datapoints
+    across the requested range, and accepts every write
+    """
+
+    def __init__(self, latency: float = 0.0, series_count: int = 1, point_count: int = 100):
+        super().__init__(latency)
+        self.series_count = series_count
+        self.point_count = point_count
+
+    def handle(self, method: str, path: str, query: dict, body: typing.Optional[dict]) -> typing.Tuple[int, typing.Any]:
+        parts = path.strip("/").split("/")
+        if len(parts) != 4 or parts[:2] != ["timeseries", "v1.5"] or parts[3] != "data":
+            return super().handle(method, path, query, body)
+        if method == "POST":
+            return 200, {"data": {"items": []}}
+        from_us = _epoch_us_from_rfc3339(query["startTime"])
+        to_us = _epoch_us_from_rfc3339(query["endTime"])
+        step = max(1, (to_us - from_us) // max(1, self.point_count))
+        times = [rfc3339_from_epoch_us(from_us + step * point) for point in range(self.point_count)]
+        items = [{"id": f"{parts[2]}-{series}", "name": f"tag-{series}", "datapoints": [{"time": t, "value": random.random(), "status": 192} for t in times]} for series in range(self.series_count)]
+        return 200, {"data": {"items": items}}
+
+
+class FakeGordoServer(StandInServer):
+    """
+    Watchman, metadata and anomaly prediction endpoints of a Gordo deployment with models_per_project healthy models
+    in every project, each with tag_count input tags. Predictions echo the posted rows, or row_count made up rows
+    when nothing was posted, with model input, output and anomaly columns for every tag.
+    """
+
+    def __init__(self, latency: float = 0.0, models_per_project: int = 10, tag_count: int = 4, row_count: int = 100, gordo_version: str = "v0"):
+        super().__init__(latency)
+        self.models_per_project = models_per_project
+        self.tag_count = tag_count
+        self.row_count = row_count
+        self.gordo_version = gordo_version
+
+    @property
+    def connection_string(self) -> str:
+        return f"{self.base_url}/gordo/{self.gordo_version}/"
+
+    def tag_list(self) -> typing.List[str]:
+        return [f"tag-{tag}" for tag in range(self.tag_count)]
+
+    def metadata(self, model_name: str) -> dict:
+        # With their asset, as gordo only guesses the asset of tag names it knows the pattern of
+        tags = [{"name": tag, "asset": "stand-in"} for tag in self.tag_list()]
+        return {"name": model_name, "dataset": {"tag_list": tags, "target_tag_list": tags, "resolution": "10T"}, "model": {"model-offset": 0}}
+
+    def handle(self, method: str, path: str, query: dict, body: typing.Optional[dict]) -> typing.Tuple[int, typing.Any]:
+        parts = path.strip("/").split("/")
+        if len(parts) < 3 or parts[:2] != ["gordo", self.gordo_version]:
+            return super().handle(method, path, query, body)
+        project_name = parts[2]
+        if len(parts) == 3 and method == "GET":
+            endpoints = [{"endpoint": f"/gordo/{self.gordo_version}/{project_name}/model-{model}/", "healthy": True, "endpoint-metadata": {"metadata": self.metadata(f"model-{model}")}} for model in range(self.models_per_project)]
+            return 200, {"project-name": project_name, "endpoints": endpoints}
+        if len(parts) == 5 and parts[4] == "metadata" and method == "GET":
+            return 200, {"endpoint-metadata": {"metadata": self.metadata(parts[3])}}
+        if parts[4:] in [["anomaly", "prediction"], ["prediction"]] and method == "POST":
+            return 200, {"data": self.predictions(body)}
+        return super().handle(method, path, query, body)
+
+    def predictions(self, body: typing.Optional[dict]) -> dict:
+        X = (body or {}).get("X", None) or {}
+        timestamps = list(next(iter(X.values()))) if X else [rfc3339_from_epoch_us(row * 600000000) for row in range(self.row_count)]
+        columns: typing.Dict[str, dict] = {}
+        for group in ["model-input", "model-output", "tag-anomaly-scaled"]:
+            columns[group] = {tag: {t: random.random() for t in timestamps} for tag in self.tag_list()}
+        columns["total-anomaly-scaled"] = {"": {t: random.random() for t in timestamps}}
+        # Like Gordo, the window of every row as ISO strings
+        columns["start"] = {"": {t: rfc3339_from_epoch_us(_epoch_us_from_rfc3339(t)) for t in timestamps}}
+        columns["end"] = {"": {t: rfc3339_from_epoch_us(_epoch_us_from_rfc3339(t) + 600000000) for t in timestamps}}
+        return columns
+
+
+def seed_token_cache(auth_config: dict):
+    """
+    Put a long lived token for auth_config in the shared token cache, so clients of the stand-ins never go to the authority
+    """
+    cache_dir = auth_config.get("token_cache_dir", "/tmp/latigo/tokens")
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    token = {"access_token": "stand-in", "refresh_token": "", "token_type": "Bearer", "expires_in": 86400, "expires_at": time.time() + 86400}
+    with open(os.path.join(cache_dir, f"{token_cache_key(auth_config)}.json"), "w") as f:
+        json.dump(token, f)
+
+
+class RecordingTaskQueueSender(TaskQueueSenderInterface):
+    """
+    Passes tasks on to the real sender, noting when each was put so executors can tell how long it sat in the queue
+    """
+
+    def __init__(self, sender: TaskQueueSenderInterface):
+        self.sender = sender
+        self.put_times: typing.Dict[typing.Tuple[str, str, int], float] = {}
+
+    def put_task(self, task: Task):
+        self.put_times[(task.project_name, task.model_name, task.time_range.from_us)] = time.monotonic()
+        self.sender.put_task(task)
+
+    def lag(self) -> typing.Optional[int]:
+        return self.sender.lag()
+
+
+class InstrumentedPredictionExecutor(PredictionExecutor):
+    """
+    A PredictionExecutor that records how long every task spends in each stage
+    """
+
+    def __init__(self, config: dict, put_times: typing.Dict[typing.Tuple[str, str, int], float]):
+        self.put_times = put_times
+        self.stage_times: typing.Dict[str, typing.List[float]] = {stage: [] for stage in stages}
+        self.processed_count = 0
+        super().__init__(config)
+
+    def run(self):
+        # The gordo client runs its posts on the event loop of the thread, which only the main thread gets by itself
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        super().run()
+
+    def _timed(self, stage: str, function, *args):
+        started = time.monotonic()
+        try:
+            return function(*args)
+        finally:
+            self.stage_times[stage].append(time.monotonic() - started)
+
+    def _fetch_sensor_data(self, task):
+        return self._timed("fetch", super()._fetch_sensor_data, task)
+
+    def _execute_prediction(self, task, sensor_data):
+        return self._timed("predict", super()._execute_prediction, task, sensor_data)
+
+    def _store_prediction_data(self, task, prediction_data):
+        return self._timed("store", super()._store_prediction_data, task, prediction_data)
+
+    def _process_task(self, task):
+        put_time = self.put_times.get((task.project_name, task.model_name, task.time_range.from_us), None)
+        if put_time is not None:
+            self.stage_times["queue"].append(time.monotonic() - put_time)
+        super()._process_task(task)
+        if put_time is not None:
+            self.stage_times["total"].append(time.monotonic() - put_time)
+        self.processed_count += 1
+
+
+def pipeline_config(directory: str, gordo: FakeGordoServer, time_series: FakeTimeSeriesAPI, model_count: int, project_count: int, interval: str, use_gordo: bool) -> typing.Tuple[dict, dict]:
+    """
+    Scheduler and executor configs wired to the stand-ins and a task queue under directory
+    """
+    auth_config = {"client_id": "stand-in", "tenant": "stand-in", "authority_host_url": "http://127.0.0.1", "resource": "stand-in", "token_cache_dir": os.path.join(directory, "tokens")}
+    seed_token_cache(auth_config)
+    task_queue_config = {"type": "local", "directory": os.path.join(directory, "queue"), "topic": "latigo_topic", "group.id": "executor", "receive_timeout": "100ms", "poll_interval": "10ms"}
+    projects = [f"project-{project}" for project in range(project_count)]
+    gordo_config = {"type": "gordo", "connection_string": gordo.connection_string, "projects": projects, "auth": auth_config, "batch_size": 1000, "parallelism": 10, "n_retries": 0, "data_provider": {"debug": False, "n_retries": 0}, "prediction_forwarder": {"debug": False, "n_retries": 0}}
+    if use_gordo:
+        model_info_config = {**gordo_config}
+        predictor_config = {**gordo_config}
+    else:
+        model_info_config = {"type": "synthetic", "model_count": model_count, "project_count": project_count}
+        predictor_config = {"type": "mock"}
+    scheduler_config = {
+        "scheduler": {"continuous_prediction_interval": interval, "prediction_window": interval, "configuration_sync_interval": "1h", "spread_emission": True},
+        "model_info": model_info_config,
+        "task_queue": {**task_queue_config},
+    }
+    executor_config = {
+        "executor": {"coalescing": {"hold_time": "0s"}},
+        "task_queue": {**task_queue_config},
+        "sensor_data": {"type": "time_series_api", "base_url": time_series.base_url, "auth": auth_config},
+        "prediction_storage": {"type": "mock"},
+        "predictor": predictor_config,
+    }
+    return scheduler_config, executor_config
+
+
+def run_pipeline(model_count: int = 200, project_count: int = 4, duration: float = 10.0, interval: str = "5s", executor_count: int = 2, gordo_latency: float = 0.0, time_series_latency: float = 0.0, point_count: int = 100, use_gordo: bool = False, drain_timeout: float = 60.0) -> dict:
+    """
+    Run a scheduler and executor_count executors (as threads) for duration seconds, let the executors drain the
+    queue and report throughput, per stage latency percentiles and peak memory
+    """
+    with tempfile.TemporaryDirectory() as directory, FakeGordoServer(gordo_latency, max(1, model_count // max(1, project_count)), row_count=point_count) as gordo, FakeTimeSeriesAPI(time_series_latency, series_count=gordo.tag_count, point_count=point_count) as time_series:
+        scheduler_config, executor_config = pipeline_config(directory, gordo, time_series, model_count, project_count, interval, use_gordo)
+        scheduler = Scheduler(scheduler_config)
+        sender = RecordingTaskQueueSender(scheduler.task_queue)
+        scheduler.task_queue = sender
+        if use_gordo:
+            import latigo.gordo
+
+            # Gordo clients are cached per process, the executors must not get the ones made for the scheduler's model info
+            latigo.gordo.gordo_client_instances_by_hash.clear()
+            latigo.gordo.gordo_client_instances_by_project.clear()
+        # Providers keep and rewrite parts of their config, so every executor gets its own like separate processes would
+        executors = [InstrumentedPredictionExecutor(copy.deepcopy(executor_config), sender.put_times) for _ in range(executor_count)]
+        loop = asyncio.new_event_loop()
+        scheduler_thread = threading.Thread(target=loop.run_until_complete, args=(scheduler.run_async(),), name="scheduler", daemon=True)
+        executor_threads = [threading.Thread(target=executor.run, name=f"executor-{number}", daemon=True) for number, executor in enumerate(executors)]
+        started = time.monotonic()
+        scheduler_thread.start()
+        for thread in executor_threads:
+            thread.start()
+        time.sleep(duration)
+        loop.call_soon_threadsafe(scheduler.stop)
+        scheduler_thread.join()
+        scheduled_count = len(sender.put_times)
+        drain_deadline = time.monotonic() + drain_timeout
+        while sum(executor.processed_count for executor in executors) < scheduled_count and time.monotonic() < drain_deadline:
+            time.sleep(0.05)
+        elapsed = time.monotonic() - started
+        for executor in executors:
+            executor.stop()
+        for thread in executor_threads:
+            thread.join()
+        loop.close()
+        processed_count = sum(executor.processed_count for executor in executors)
+        report: typing.Dict[str, typing.Any] = {
+            "models": model_count,
+            "executors": executor_count,
+            "seconds": elapsed,
+            "scheduled": scheduled_count,
+            "processed": processed_count,
+            "tasks_per_second": processed_count / elapsed if elapsed else 0.0,
+            "gordo_requests": gordo.request_count,
+            "time_series_requests": time_series.request_count,
+            "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        }
+        for stage in stages:
+            times = [t for executor in executors for t in executor.stage_times[stage]]
+            report[f"{stage}_p50"] = _percentile(times, 0.5)
+            report[f"{stage}_p99"] = _percentile(times, 0.99)
+            report[f"{stage}_max"] = max(times) if times else 0.0
+        return report
+
+
+def main(argv: typing.Optional[typing.List[str]] = None):
+    parser = argparse.ArgumentParser(description="Run scheduler, local task queue and executors against stand-in Gordo and Time Series API servers")
+    parser.add_argument("--models", type=int, default=200, help="Number of models")
+    parser.add_argument("--projects", type=int, default=4, help="Number of projects the models are spread over")
+    parser.add_argument("--duration", default="10s", help="How long the scheduler runs")
+    parser.add_argument("--interval", default="5s", help="Prediction interval per model")
+    parser.add_argument("--executors", type=int, default=2, help="Number of executors")
+    parser.add_argument("--gordo-latency", default="0s", help="Response time of the stand-in Gordo server")
+    parser.add_argument("--time-series-latency", default="0s", help="Response time of the stand-in Time Series API")
+    parser.add_argument("--points", type=int, default=100, help="Datapoints per series and prediction rows per response")
+    parser.add_argument("--gordo", action="store_true", help="Predict through the Gordo client instead of the mock predictor, needs gordo_components")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    report = run_pipeline(args.models, args.projects, parse_time_delta(args.duration).total_seconds(), args.interval, args.executors, parse_time_delta(args.gordo_latency).total_seconds(), parse_time_delta(args.time_series_latency).total_seconds(), args.points, args.gordo)
+    print(json.dumps(report, indent=4, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,30 @@
+from tests.load.benchmarks import benchmarks, run_benchmarks, compare, environment_mismatches, load_results, baseline_filename
+
+
+def test_every_benchmark_runs_or_says_why_not():
+    report = run_benchmarks(repeat=1, scale=0.01)
+    assert sorted(list(report["results"].keys()) + list(report["skipped"].keys())) == sorted(name for name, _, _ in benchmarks)
+    assert all(seconds > 0 for seconds in report["results"].values())
+
+
+def test_baseline_covers_every_benchmark():
+    baseline = load_results(baseline_filename)
+    assert set(baseline["results"].keys()) | set(baseline["skipped"].keys()) == set(name for name, _, _ in benchmarks)
+
+
+def test_compare_flags_regressions_above_threshold():
+    baseline = {"results": {"fast": 1.0, "slow": 1.0, "gone": 1.0}}
+    current = {"results": {"fast": 0.5, "slow": 1.5, "new": 1.0}}
+    rows = {row["name"]: row for row in compare(baseline, current, threshold=0.2)}
+    assert sorted(rows.keys()) == ["fast", "new", "slow"]
+    assert not rows["fast"]["regressed"] and rows["fast"]["ratio"] == 0.5
+    assert rows["slow"]["regressed"]
+    assert rows["new"]["ratio"] is None and not rows["new"]["regressed"]
+    assert not compare(baseline, current, threshold=0.6)[1]["regressed"]
+
+
+def test_compare_notices_runs_from_other_environments():
+    baseline = {"python": "3.7.4", "machine": "x86_64", "results": {}}
+    assert environment_mismatches(baseline, dict(baseline)) == []
+    mismatches = environment_mismatches(baseline, {"python": "3.11.7", "machine": "x86_64", "results": {}})
+    assert mismatches == ["python 3.7.4 in the baseline, 3.11.7 now"]
@@ -0,0 +1,45 @@
+import os
+import sys
+import json
+import subprocess
+import statistics
+from os import environ
+
+# Cold start budget per entry point in seconds, override when running on slow machines
+import_time_threshold = float(environ.get("LATIGO_IMPORT_TIME_THRESHOLD", "0.5"))
+
+# Dependencies that entry points should only import once a configured provider actually needs them
+heavy_modules = ["pandas", "numpy", "sklearn", "gordo_components", "werkzeug", "aiohttp", "azure", "msrestazure", "adal", "confluent_kafka", "dataclasses_json", "marshmallow"]
+
+latigo_path: str = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../app/"))
+
+measure_script = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "modules": sorted(set(m.split(".")[0] for m in sys.modules))}}))
+"""
+
+
+def measure_import(module: str) -> dict:
+    env = {**environ, "PYTHONPATH": latigo_path}
+    output = subprocess.check_output([sys.executable, "-c", measure_script.format(module=module)], env=env)
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def check_entry_point(module: str, runs: int = 3):
+    measurements = [measure_import(module) for _ in range(runs)]
+    elapsed = statistics.median(m["elapsed"] for m in measurements)
+    print(f"Importing {module} took {elapsed*1000:.1f}ms (threshold {import_time_threshold*1000:.0f}ms)")
+    loaded_heavy_modules = [m for m in heavy_modules if m in measurements[0]["modules"]]
+    assert loaded_heavy_modules == [], f"{module} eagerly imports {loaded_heavy_modules}"
+    assert elapsed < import_time_threshold, f"{module} took {elapsed:.3f}s to import"
+
+
+def test_scheduler_import_time():
+    check_entry_point("latigo.scheduler")
+
+
+def test_executor_import_time():
+    check_entry_point("latigo.executor")
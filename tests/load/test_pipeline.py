@@ -0,0 +1,41 @@
+import json
+from os import environ
+import pytest
+import requests
+from tests.load.pipeline import FakeGordoServer, FakeTimeSeriesAPI, run_pipeline
+
+# Minimum end-to-end throughput in tasks per second, override when running on slow machines
+min_task_rate = float(environ.get("LATIGO_PIPELINE_MIN_TASK_RATE", "50"))
+
+
+def test_stand_ins_answer_like_the_real_services():
+    with FakeGordoServer(models_per_project=3, tag_count=2) as gordo, FakeTimeSeriesAPI(point_count=10) as time_series:
+        watchman = requests.get(f"{gordo.connection_string}project-0/").json()
+        assert [endpoint["endpoint"] for endpoint in watchman["endpoints"]] == [f"/gordo/v0/project-0/model-{model}/" for model in range(3)]
+        assert requests.get(f"{gordo.base_url}/gordo/v0/project-0/model-1/metadata").json()["endpoint-metadata"]["metadata"]["name"] == "model-1"
+        X = {"tag-0": {"2019-11-01T00:00:00Z": 1.0, "2019-11-01T00:10:00Z": 2.0}, "tag-1": {"2019-11-01T00:00:00Z": 3.0, "2019-11-01T00:10:00Z": 4.0}}
+        predictions = requests.post(f"{gordo.base_url}/gordo/v0/project-0/model-1/anomaly/prediction?format=json", json={"X": X, "y": None}).json()["data"]
+        assert sorted(predictions.keys()) == ["end", "model-input", "model-output", "start", "tag-anomaly-scaled", "total-anomaly-scaled"]
+        assert predictions["end"][""]["2019-11-01T00:00:00Z"] == "2019-11-01T00:10:00Z"
+        assert list(predictions["model-output"]["tag-1"].keys()) == ["2019-11-01T00:00:00Z", "2019-11-01T00:10:00Z"]
+        data = requests.get(f"{time_series.base_url}/timeseries/v1.5/test_id/data?startTime=2019-11-01T00:00:00Z&endTime=2019-11-01T01:00:00Z&limit=100000").json()
+        assert [datapoint["time"] for datapoint in data["data"]["items"][0]["datapoints"]][:2] == ["2019-11-01T00:00:00Z", "2019-11-01T00:06:00Z"]
+        assert requests.get(f"{time_series.base_url}/nothing").status_code == 404
+        assert gordo.request_count == 3 and time_series.request_count == 2
+
+
+def test_pipeline_processes_every_scheduled_task():
+    report = run_pipeline(model_count=200, project_count=4, duration=5.0, interval="1s", executor_count=2)
+    print(json.dumps(report, indent=4, sort_keys=True))
+    assert report["scheduled"] > 0
+    assert report["processed"] == report["scheduled"]
+    assert report["time_series_requests"] == report["processed"]
+    assert report["tasks_per_second"] > min_task_rate
+
+
+def test_pipeline_through_gordo_client():
+    pytest.importorskip("gordo_components")
+    report = run_pipeline(model_count=20, project_count=2, duration=5.0, interval="2s", executor_count=2, use_gordo=True)
+    print(json.dumps(report, indent=4, sort_keys=True))
+    assert report["processed"] == report["scheduled"] > 0
+    assert report["gordo_requests"] > 0
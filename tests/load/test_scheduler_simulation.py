@@ -0,0 +1,31 @@
+from os import environ
+from latigo.scheduler.simulation import simulate
+
+# Minimum scheduling throughput in tasks per second of real time, override when running on slow machines
+min_task_rate = float(environ.get("LATIGO_SCHEDULER_MIN_TASK_RATE", "2000"))
+model_count = int(environ.get("LATIGO_SCHEDULER_SIMULATION_MODELS", "10000"))
+
+
+def make_config(**scheduler_config):
+    return {"model_info": {"type": "synthetic", "model_count": model_count, "project_count": 10}, "scheduler": {"continuous_prediction_interval": "30m", "configuration_sync_interval": "10m", **scheduler_config}}
+
+
+def test_scheduler_emits_every_model_once_per_interval_evenly():
+    report = simulate(make_config(), 3600)
+    print(f"Scheduled {report['tasks']} tasks for {report['models']} models at {report['tasks_per_real_second']:.0f} tasks/s, sync p50 {report['sync_latency_p50']*1000:.1f}ms, peak traced memory {report['peak_traced_bytes']/1024/1024:.1f}MiB")
+    assert report["models"] == model_count
+    assert report["min_tasks_per_model"] == report["max_tasks_per_model"] == 2
+    # Spread over the interval rather than a burst every 30 minutes
+    assert report["emission_peak_to_mean"] < 5
+    assert report["tasks_per_real_second"] > min_task_rate
+
+
+def test_scheduler_holds_back_when_executors_fall_behind():
+    consume_rate = model_count / 1800 / 2
+    report = simulate(make_config(backpressure={"max_lag": 500, "check_interval": "10s"}), 3600, consume_rate=consume_rate)
+    print(f"Emitted {report['tasks']} tasks with executors consuming {consume_rate:.1f} tasks/s")
+    # Tasks held back are superseded in the fair queue, so emission follows what executors take rather than the schedule
+    assert report["tasks"] < 0.6 * 2 * model_count
+    # and every project still gets its share
+    assert len(report["tasks_per_project"]) == 10
+    assert min(report["tasks_per_project"].values()) > 0.8 * max(report["tasks_per_project"].values())
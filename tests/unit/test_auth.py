@@ -0,0 +1,68 @@
+import time
+import pytest
+import tempfile
+import latigo.auth
+from latigo.auth import TokenManager, TokenManagerAuth, create_auth_session
+
+
+class FakeRequest:
+    def __init__(self):
+        self.headers = {}
+
+
+def make_fetcher(calls, expires_in=3600):
+    def fetch_access_token(auth_config):
+        calls.append(auth_config)
+        return {"access_token": f"token-{len(calls)}", "refresh_token": "", "token_type": "Bearer", "expires_in": expires_in}
+
+    return fetch_access_token
+
+
+def test_token_manager_shares_token_through_cache(monkeypatch):
+    calls: list = []
+    monkeypatch.setattr(latigo.auth, "fetch_access_token", make_fetcher(calls))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        auth_config = {"client_id": "client", "resource": "resource", "token_cache_dir": cache_dir}
+        first = TokenManager(auth_config)
+        second = TokenManager(auth_config)
+        first.stop()
+        second.stop()
+        # The second process-like manager picked the token up from the cache file
+        assert len(calls) == 1
+        assert first.get_access_token() == second.get_access_token() == "token-1"
+
+
+def test_token_manager_refreshes_in_background(monkeypatch):
+    calls: list = []
+    monkeypatch.setattr(latigo.auth, "fetch_access_token", make_fetcher(calls, expires_in=1))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        token_manager = TokenManager({"client_id": "client", "token_cache_dir": cache_dir, "refresh_margin": 0.5})
+        deadline = time.time() + 5
+        while len(calls) < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        token_manager.stop()
+        assert len(calls) >= 2
+        request = TokenManagerAuth(token_manager)(FakeRequest())
+        assert request.headers["Authorization"].startswith("Bearer token-")
+
+
+def test_token_manager_does_not_spin_on_short_lived_tokens(monkeypatch):
+    calls: list = []
+    monkeypatch.setattr(latigo.auth, "fetch_access_token", make_fetcher(calls, expires_in=2))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # The default refresh_margin of 300 seconds is longer than the whole life of the token
+        token_manager = TokenManager({"client_id": "client", "token_cache_dir": cache_dir})
+        assert 0.9 < token_manager._seconds_until_refresh() <= 1.0
+        time.sleep(0.5)
+        token_manager.stop()
+        assert len(calls) == 1
+
+
+def test_create_auth_session_raises_when_no_token_can_be_fetched(monkeypatch):
+    def fetch_access_token(auth_config):
+        raise Exception("Authority is down")
+
+    monkeypatch.setattr(latigo.auth, "fetch_access_token", fetch_access_token)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        with pytest.raises(Exception, match="Authority is down"):
+            create_auth_session({"client_id": "unreachable", "resource": "resource", "token_cache_dir": cache_dir})
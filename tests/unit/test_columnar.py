@@ -0,0 +1,76 @@
+import pickle
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from latigo.types import LatigoSensorTag, PredictionData, TimeRange
+from latigo.columnar import SensorDataColumns, PredictionBlock
+
+
+def make_series(name, timestamps, values):
+    return pd.Series(values, index=pd.DatetimeIndex(timestamps, tz="UTC"), name=name)
+
+
+def test_sensor_data_columns_aligns_on_shared_index():
+    a = make_series("tag-a", ["2019-11-01T00:00:00", "2019-11-01T00:10:00"], [1.0, 2.0])
+    b = make_series("tag-b", ["2019-11-01T00:10:00", "2019-11-01T00:20:00"], [3.0, 4.0])
+    columns = SensorDataColumns.from_series([a, b])
+    assert columns.tag_names == ["tag-a", "tag-b"]
+    assert columns.values.shape == (3, 2)
+    assert columns.values.flags["F_CONTIGUOUS"]
+    np.testing.assert_array_equal(columns.column("tag-a"), [1.0, 2.0, np.nan])
+    np.testing.assert_array_equal(columns.column(LatigoSensorTag("tag-b", None)), [np.nan, 3.0, 4.0])
+
+
+def test_sensor_data_columns_views_share_memory():
+    columns = SensorDataColumns.from_datapoints([("tag-a", ["2019-11-01T00:00:00Z", "2019-11-01T00:10:00Z"], [1.0, 2.0]), ("tag-b", ["2019-11-01T00:00:00Z"], [5.0])])
+    series = columns.series("tag-a")
+    assert series.name == "tag-a"
+    assert np.shares_memory(series.values, columns.values)
+    df = columns.to_dataframe()
+    assert list(df.columns) == ["tag-a", "tag-b"]
+    assert str(df.index.tz) == "UTC"
+    assert [s.name for s in columns] == ["tag-a", "tag-b"]
+
+
+def test_sensor_data_columns_empty():
+    columns = SensorDataColumns.empty()
+    assert len(columns) == 0
+    assert not columns
+    assert columns.to_dataframe().empty
+
+
+def make_predictions():
+    # Without a freq, as the blocks do not keep one and assert_frame_equal only ignores it from pandas 1.1 on
+    index = pd.to_datetime([f"2019-11-01T00:{minute}0:00Z" for minute in range(4)], utc=True)
+    columns = pd.MultiIndex.from_tuples([("model-output", "tag-a"), ("model-output", "tag-b"), ("total-anomaly", "")])
+    df = pd.DataFrame(np.arange(12, dtype=np.float64).reshape(4, 3), index=index, columns=columns)
+    # Gordo sends the window of every row as ISO strings
+    df[("start", "")] = [timestamp.isoformat() for timestamp in index]
+    df[("end", "")] = [(timestamp + timedelta(minutes=10)).isoformat() for timestamp in index]
+    return df
+
+
+def test_prediction_block_round_trip():
+    df = make_predictions()
+    block = PredictionBlock.from_dataframe("target", df, ["some error"])
+    assert len(block) == 4
+    assert block.columns[2] == ("total-anomaly", "")
+    keys = [key for key, _ in block.iter_columns()]
+    numeric = df.drop(columns=[("start", ""), ("end", "")])
+    assert keys == list(numeric.columns)
+    np.testing.assert_array_equal(dict(block.iter_columns())[("model-output", "tag-b")], df[("model-output", "tag-b")].values)
+    np.testing.assert_array_equal(block.start, block.index)
+    np.testing.assert_array_equal(block.end - block.start, np.full(4, np.timedelta64(10, "m")))
+    pd.testing.assert_frame_equal(block.to_dataframe(), numeric, check_index_type=False)
+    assert np.shares_memory(block.to_dataframe().values, block.values)
+
+
+def test_prediction_data_pickles_blocks():
+    now = datetime(2019, 11, 1)
+    prediction_data = PredictionData(name="model", time_range=TimeRange(now, now + timedelta(minutes=30)), data=[PredictionBlock.from_dataframe("target", make_predictions()), PredictionBlock.from_dataframe("failed", None, ["error"])])
+    assert prediction_data.nbytes == 4 * 8 + 12 * 8 + 2 * 4 * 8
+    restored = pickle.loads(pickle.dumps(prediction_data))
+    np.testing.assert_array_equal(restored.data[0].values, prediction_data.data[0].values)
+    np.testing.assert_array_equal(restored.data[0].end, prediction_data.data[0].end)
+    assert restored.data[1].error_messages == ["error"]
+    assert "blocks=2" in str(prediction_data)
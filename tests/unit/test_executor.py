@@ -0,0 +1,21 @@
+import threading
+from latigo.executor import PredictionExecutor
+
+
+def test_stop_before_run_is_not_lost():
+    # The devnull queue hands out a task on every poll, so a lost stop keeps run() going for good
+    executor = PredictionExecutor({"task_queue": {"type": "devnull"}, "sensor_data": {"type": "mock"}, "prediction_storage": {"type": "mock"}, "predictor": {"type": "mock"}})
+    executor.stop()
+    thread = threading.Thread(target=executor.run, daemon=True)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def test_run_closes_the_prediction_storage_provider():
+    executor = PredictionExecutor({"task_queue": {"type": "devnull"}, "sensor_data": {"type": "mock"}, "prediction_storage": {"type": "mock"}, "predictor": {"type": "mock"}})
+    closed = []
+    executor.prediction_storage_provider.close = lambda: closed.append(True)
+    executor.stop()
+    executor.run()
+    assert closed == [True]
@@ -0,0 +1,44 @@
+import pytest
+from latigo.scheduler.fair import FairQueue
+
+
+def fill(queue, project_name, count, urgency=0.0):
+    for number in range(count):
+        queue.push((project_name, f"model-{number}"), (project_name, number), urgency + number)
+
+
+def test_small_projects_are_not_starved_by_big_ones():
+    queue = FairQueue()
+    fill(queue, "big", 1000)
+    fill(queue, "small", 3)
+    served = queue.pop(6)
+    assert sorted(served) == [("big", 0), ("big", 1), ("big", 2), ("small", 0), ("small", 1), ("small", 2)]
+    assert len(queue) == 997
+
+
+def test_weights_and_priorities():
+    queue = FairQueue({"projects": {"heavy": {"weight": 3}, "critical": {"priority": 1}}})
+    fill(queue, "heavy", 100)
+    fill(queue, "light", 100)
+    served = queue.pop(40)
+    assert sum(1 for project_name, _ in served if project_name == "heavy") == 30
+    fill(queue, "critical", 5)
+    assert queue.pop(5) == [("critical", number) for number in range(5)]
+
+
+def test_most_urgent_model_first_and_newer_items_replace_queued_ones():
+    queue = FairQueue()
+    queue.push(("project", "relaxed"), "relaxed", 100.0)
+    queue.push(("project", "urgent"), "urgent", 10.0)
+    queue.push(("project", "urgent"), "urgent again", 20.0)
+    queue.remove(("project", "gone"))
+    assert queue.superseded_count == 1
+    assert queue.pop() == ["urgent again", "relaxed"]
+    assert len(queue) == 0
+    assert queue.pop() == []
+
+
+def test_weights_that_never_earn_a_task_are_rejected():
+    for config in [{"quantum": 0}, {"default_weight": 0}, {"projects": {"idle": {"weight": -1}}}]:
+        with pytest.raises(Exception):
+            FairQueue(config)
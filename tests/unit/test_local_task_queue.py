@@ -0,0 +1,105 @@
+import os
+import time
+import threading
+import pytest
+from datetime import datetime, timedelta
+from latigo.types import Task
+from latigo.task_queue import task_queue_sender_factory, task_queue_receiver_factory
+from latigo.task_queue.local import SegmentLog
+
+start = datetime(2019, 11, 1, 12, 0)
+
+
+def make_task(number):
+    return Task("project", f"model-{number}", start, start + timedelta(minutes=30))
+
+
+def make_config(tmpdir, **overrides):
+    return {"type": "local", "directory": str(tmpdir), "topic": "tasks", "group.id": "executor", "receive_timeout": "0s", "segment_size": 256, **overrides}
+
+
+def test_tasks_round_trip_and_groups_share_work(tmpdir):
+    sender = task_queue_sender_factory(make_config(tmpdir))
+    for number in range(10):
+        sender.put_task(make_task(number))
+    first = task_queue_receiver_factory(make_config(tmpdir))
+    second = task_queue_receiver_factory(make_config(tmpdir))
+    other_group = task_queue_receiver_factory(make_config(tmpdir, **{"group.id": "audit"}))
+    received = []
+    for number in range(5):
+        received.append(first.get_task())
+        received.append(second.get_task())
+    assert first.get_task() is None
+    assert second.get_task() is None
+    # Every task went to exactly one receiver in the group, in order, across several segments
+    assert received == [make_task(number) for number in range(10)]
+    assert [other_group.get_task() for _ in range(10)] == received
+
+
+def test_offsets_survive_restart_and_consumed_segments_are_deleted(tmpdir):
+    sender = task_queue_sender_factory(make_config(tmpdir))
+    receiver = task_queue_receiver_factory(make_config(tmpdir))
+    for number in range(3):
+        sender.put_task(make_task(number))
+    assert receiver.get_task() == make_task(0)
+    receiver.close()
+    receiver = task_queue_receiver_factory(make_config(tmpdir))
+    assert receiver.get_task() == make_task(1)
+    assert receiver.get_task() == make_task(2)
+    log = SegmentLog(os.path.join(str(tmpdir), "tasks"), segment_size=256)
+    for number in range(3, 10):
+        sender.put_task(make_task(number))
+    assert receiver.consumer.lag() == 7
+    assert sender.lag() == 7
+    assert log.segment_bases()[0] > 0
+    assert [receiver.get_task() for _ in range(7)] == [make_task(number) for number in range(3, 10)]
+    assert receiver.consumer.lag() == 0
+    assert sender.lag() == 0
+
+
+class WriterDied(Exception):
+    pass
+
+
+@pytest.mark.parametrize("create_first", [False, True])
+def test_records_after_a_writer_died_while_rolling_are_consumed(tmpdir, create_first):
+    directory = os.path.join(str(tmpdir), "tasks")
+    log = SegmentLog(directory, segment_size=64)
+    create_segment = log._create_segment
+
+    def die_while_creating(base):
+        if base == 0:
+            return create_segment(base)
+        # Rolling over, the writer dies right before, or right after, the next segment file appears
+        if create_first:
+            create_segment(base)
+        raise WriterDied()
+
+    log._create_segment = die_while_creating
+    consumer = SegmentLog(directory, segment_size=64).consumer("executor")
+    payloads = [f"record-{number}".encode("ascii") for number in range(6)]
+    written = 0
+    with pytest.raises(WriterDied):
+        for payload in payloads:
+            log.append(payload)
+            written += 1
+    # The next writer process picks up where the dead one left off
+    log = SegmentLog(directory, segment_size=64)
+    for payload in payloads[written:]:
+        log.append(payload)
+    assert [consumer.poll() for _ in payloads] == payloads
+    assert consumer.poll() is None
+
+
+def test_long_poll_wakes_up_when_a_task_arrives(tmpdir):
+    receiver = task_queue_receiver_factory(make_config(tmpdir, receive_timeout="10s"))
+    sender = task_queue_sender_factory(make_config(tmpdir))
+    timer = threading.Timer(0.1, sender.put_task, args=[make_task(0)])
+    timer.start()
+    started = time.monotonic()
+    assert receiver.get_task() == make_task(0)
+    assert time.monotonic() - started < 5
+    started = time.monotonic()
+    assert receiver.get_task(timeout=0.1) is None
+    assert time.monotonic() - started < 5
+    timer.join()
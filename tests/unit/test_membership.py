@@ -0,0 +1,74 @@
+import asyncio
+from collections import Counter
+from latigo.scheduler import Scheduler
+from latigo.scheduler.membership import ConsistentHashRing, SqliteMembership, MembershipInterface
+from latigo.scheduler.simulation import VirtualClock, CountingTaskQueueSender
+
+
+def test_consistent_hash_ring_spreads_and_moves_little():
+    keys = [f"project/model-{number}" for number in range(10000)]
+    ring = ConsistentHashRing(["a", "b", "c"])
+    owners = {key: ring.owner(key) for key in keys}
+    shares = Counter(owners.values())
+    assert set(shares) == {"a", "b", "c"}
+    assert min(shares.values()) > 2000
+    # When c goes away only c's models move
+    smaller = ConsistentHashRing(["a", "b"])
+    moved = [key for key in keys if smaller.owner(key) != owners[key]]
+    assert all(owners[key] == "c" for key in moved)
+    assert ConsistentHashRing([]).owner("anything") is None
+
+
+def test_sqlite_membership_expires_dead_instances(tmpdir):
+    config = {"database": str(tmpdir.join("members.db")), "lease_time": "30s"}
+    first = SqliteMembership("first", config)
+    second = SqliteMembership("second", config)
+    assert first.heartbeat(now=1000.0) == ["first"]
+    assert second.heartbeat(now=1010.0) == ["first", "second"]
+    # First stops renewing and its lease runs out
+    assert second.heartbeat(now=1040.0) == ["second"]
+    assert first.heartbeat(now=1041.0) == ["first", "second"]
+    first.leave()
+    assert second.heartbeat(now=1042.0) == ["second"]
+
+
+class UnreachableMembership(MembershipInterface):
+    lease_time = 30.0
+
+    def heartbeat(self):
+        raise IOError("database is locked")
+
+
+def test_scheduler_stops_owning_models_when_its_lease_may_have_run_out():
+    clock = VirtualClock()
+    scheduler = Scheduler({"task_queue": {"type": None}, "model_info": {"type": "synthetic", "model_count": 100, "project_count": 2}, "scheduler": {"continuous_prediction_interval": "1m", "sharding": {"instance_id": "a", "heartbeat_interval": "10s"}}})
+    scheduler.clock = clock
+    scheduler.task_queue = sender = CountingTaskQueueSender(clock)
+    scheduler.membership = UnreachableMembership()
+    scheduler.membership_renewed(["a", "b"], clock.monotonic())
+    scheduler.synchronize_configuration()
+    owned = len(scheduler.model_index)
+    assert 0 < owned < 100
+    # One missed heartbeat leaves enough of the lease for the next one
+    clock.advance_to(10)
+    scheduler.membership_failed(clock.monotonic())
+    assert len(scheduler.model_index) == owned
+    # The lease would run out before the next heartbeat
+    clock.advance_to(20)
+    scheduler.membership_failed(clock.monotonic())
+    assert scheduler.stats()["lease_lost"]
+    assert scheduler.model_index == {} and len(scheduler.deadlines) == 0
+    sent = sender.count
+    clock.advance_to(120)
+    scheduler.perform_prediction_step()
+    assert sender.count == sent
+    # A heartbeat that goes through again hands back the same share
+    scheduler.membership_renewed(["a", "b"], clock.monotonic())
+    assert len(scheduler.model_index) == owned
+    assert not scheduler.stats()["lease_lost"]
+
+
+def test_scheduler_stop_before_run_is_not_lost():
+    scheduler = Scheduler({"task_queue": {"type": None}, "model_info": {"type": "synthetic", "model_count": 10, "project_count": 1}, "scheduler": {"continuous_prediction_interval": "1m"}})
+    scheduler.stop()
+    asyncio.run(asyncio.wait_for(scheduler.run_async(), 5))
@@ -0,0 +1,88 @@
+import pytest
+import requests
+from latigo.metrics import MetricsRegistry, start_metrics_server
+
+
+def test_counters_and_gauges_render_in_prometheus_text_format():
+    registry = MetricsRegistry()
+    tasks = registry.counter("latigo_test_tasks_total", "Tasks", ["outcome"])
+    tasks.labels("succeeded").inc()
+    tasks.labels(outcome="succeeded").inc(2)
+    tasks.labels("failed").inc()
+    registry.gauge("latigo_test_queued", "Queued").set(7)
+    text = registry.render()
+    assert "# TYPE latigo_test_tasks_total counter" in text
+    assert 'latigo_test_tasks_total{outcome="succeeded"} 3.0' in text
+    assert 'latigo_test_tasks_total{outcome="failed"} 1.0' in text
+    assert "latigo_test_queued 7.0" in text
+    # Asking again hands out the same metric, asking for something else under the same name fails
+    assert registry.counter("latigo_test_tasks_total", "Tasks", ["outcome"]) is tasks
+    with pytest.raises(Exception):
+        registry.gauge("latigo_test_tasks_total", "Tasks", ["outcome"])
+    with pytest.raises(Exception):
+        tasks.labels("a", "b")
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    stage = registry.histogram("latigo_test_stage_seconds", "Stage", ["stage"], buckets=[0.1, 1.0])
+    for value in [0.05, 0.1, 0.5, 2.0]:
+        stage.labels("fetch").observe(value)
+    with stage.labels("store").time():
+        pass
+    text = registry.render()
+    assert 'latigo_test_stage_seconds_bucket{stage="fetch",le="0.1"} 2.0' in text
+    assert 'latigo_test_stage_seconds_bucket{stage="fetch",le="1.0"} 3.0' in text
+    assert 'latigo_test_stage_seconds_bucket{stage="fetch",le="+Inf"} 4.0' in text
+    assert 'latigo_test_stage_seconds_sum{stage="fetch"} 2.65' in text
+    assert 'latigo_test_stage_seconds_count{stage="fetch"} 4.0' in text
+    assert 'latigo_test_stage_seconds_count{stage="store"} 1.0' in text
+
+
+def test_collectors_expose_numbers_from_stats():
+    registry = MetricsRegistry()
+    registry.add_collector("latigo_test", lambda: {"held_tasks": 3, "idle": True, "name": "ignored", "lag": None})
+    registry.add_collector("latigo_broken", lambda: 1 / 0)
+    text = registry.render()
+    assert "latigo_test_held_tasks 3.0" in text
+    assert "latigo_test_idle 1.0" in text
+    assert "name" not in text and "lag" not in text and "latigo_broken" not in text
+    registry.remove_collector("latigo_test")
+    assert "latigo_test_held_tasks" not in registry.render()
+
+
+def test_metrics_server_serves_the_registry():
+    registry = MetricsRegistry()
+    registry.counter("latigo_test_requests_total", "Requests").inc()
+    assert start_metrics_server({}, registry) is None
+    server = start_metrics_server({"port": 0}, registry)
+    try:
+        res = requests.get(f"http://127.0.0.1:{server.port}/metrics")
+        assert res.status_code == 200
+        assert res.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        assert "latigo_test_requests_total 1.0" in res.text
+        assert requests.get(f"http://127.0.0.1:{server.port}/other").status_code == 404
+    finally:
+        server.stop()
+
+
+def test_kafka_stats_become_gauges():
+    pytest.importorskip("confluent_kafka")
+    from latigo.task_queue.kafka import record_kafka_stats
+
+    registry = MetricsRegistry()
+    stats = {
+        "name": "executor#consumer-1",
+        "msg_cnt": 4,
+        "rxmsgs": 100,
+        "brokers": {"latigo.servicebus.windows.net:9093/0": {"rtt": {"avg": 25000, "p50": 20000, "p99": 90000}, "outbuf_msg_cnt": 0}},
+        "topics": {"latigo_topic": {"partitions": {"0": {"consumer_lag": 12, "fetchq_cnt": 3}, "-1": {"consumer_lag": -1}}}},
+        "cgrp": {"rebalance_cnt": 2, "assignment_size": 1},
+    }
+    record_kafka_stats(stats, registry)
+    text = registry.render()
+    assert 'latigo_kafka_client{client="executor#consumer-1",stat="rxmsgs"} 100.0' in text
+    assert 'latigo_kafka_broker_rtt_seconds{client="executor#consumer-1",broker="latigo.servicebus.windows.net:9093/0",quantile="0.99"} 0.09' in text
+    assert 'latigo_kafka_partition{client="executor#consumer-1",topic="latigo_topic",partition="0",stat="consumer_lag"} 12.0' in text
+    assert 'partition="-1"' not in text
+    assert 'latigo_kafka_consumer_group{client="executor#consumer-1",stat="rebalance_cnt"} 2.0' in text
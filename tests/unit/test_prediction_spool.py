@@ -0,0 +1,135 @@
+import os
+import tempfile
+import pytest
+from datetime import datetime, timedelta
+from latigo.types import PredictionData, TimeRange
+from latigo.prediction_storage import PredictionStorageProviderInterface
+from latigo.prediction_storage.spool import PredictionSpool, SpoolingPredictionStorageProvider, SpoolFullError
+
+
+class CollectingPredictionStorageProvider(PredictionStorageProviderInterface):
+    def __init__(self, fail=False, poison=None):
+        self.fail = fail
+        self.poison = poison
+        self.stored = []
+        self.calls = 0
+
+    def put_predictions(self, prediction_data: PredictionData):
+        self.put_predictions_batch([prediction_data])
+
+    def put_predictions_batch(self, prediction_data_list):
+        self.calls += 1
+        if self.fail or any(prediction_data.name == self.poison for prediction_data in prediction_data_list):
+            raise Exception("Storage is down")
+        self.stored.extend(prediction_data_list)
+
+
+def make_prediction_data(name):
+    now = datetime(2019, 11, 1, 12, 0, 0)
+    return PredictionData(name=name, time_range=TimeRange(now, now + timedelta(minutes=30)), data=[])
+
+
+def test_spool_append_read_commit():
+    with tempfile.TemporaryDirectory() as working_dir:
+        spool = PredictionSpool(os.path.join(working_dir, "spool.bin"))
+        for i in range(3):
+            spool.append(make_prediction_data(f"model-{i}"))
+        batch = spool.read_batch(2)
+        assert [prediction_data.name for prediction_data, _ in batch] == ["model-0", "model-1"]
+        spool.commit(batch[-1][1])
+        batch = spool.read_batch(10)
+        assert [prediction_data.name for prediction_data, _ in batch] == ["model-2"]
+        spool.commit(batch[-1][1])
+        # Fully drained spool is truncated
+        assert spool.size() == 0
+        assert spool.offset == 0
+
+
+def test_spool_replays_pending_records_on_startup():
+    with tempfile.TemporaryDirectory() as working_dir:
+        filename = os.path.join(working_dir, "spool.bin")
+        spool = PredictionSpool(filename)
+        spool.append(make_prediction_data("delivered"))
+        spool.append(make_prediction_data("pending"))
+        spool.commit(spool.read_batch(1)[0][1])
+        # Only one process may use a spool at a time
+        with pytest.raises(Exception):
+            PredictionSpool(filename)
+        spool.close()
+        reopened = PredictionSpool(filename)
+        assert [prediction_data.name for prediction_data, _ in reopened.read_batch(10)] == ["pending"]
+
+
+def test_spool_disk_cap():
+    with tempfile.TemporaryDirectory() as working_dir:
+        spool = PredictionSpool(os.path.join(working_dir, "spool.bin"), max_bytes=1)
+        with pytest.raises(SpoolFullError):
+            spool.append(make_prediction_data("too-big"))
+
+
+def test_spooling_provider_keeps_predictions_while_storage_is_down():
+    with tempfile.TemporaryDirectory() as working_dir:
+        storage = CollectingPredictionStorageProvider(fail=True)
+        provider = SpoolingPredictionStorageProvider(storage, {"filename": os.path.join(working_dir, "spool.bin"), "retry_delay": 0.01})
+        provider.put_predictions(make_prediction_data("model"))
+        provider.close(timeout=5)
+        assert provider.spool.pending_bytes() > 0
+        storage.fail = False
+        assert provider.drain() == 1
+        assert [prediction_data.name for prediction_data in storage.stored] == ["model"]
+        assert provider.spool.pending_bytes() == 0
+
+
+def test_spool_compacts_past_the_committed_offset():
+    with tempfile.TemporaryDirectory() as working_dir:
+        filename = os.path.join(working_dir, "spool.bin")
+        spool = PredictionSpool(filename, compact_bytes=1)
+        for i in range(4):
+            spool.append(make_prediction_data(f"model-{i}"))
+        size = spool.size()
+        batch = spool.read_batch(2)
+        spool.commit(batch[-1][1])
+        # Half of it was delivered, so the spool now only holds the pending half
+        assert spool.offset == 0
+        assert spool.size() == size - batch[-1][1]
+        spool.close()
+        reopened = PredictionSpool(filename)
+        assert [prediction_data.name for prediction_data, _ in reopened.read_batch(10)] == ["model-2", "model-3"]
+
+
+def test_spooling_provider_delivers_in_batches_and_dead_letters_poison():
+    with tempfile.TemporaryDirectory() as working_dir:
+        storage = CollectingPredictionStorageProvider(poison="model-1")
+        provider = SpoolingPredictionStorageProvider(storage, {"filename": os.path.join(working_dir, "spool.bin"), "batch_size": 10, "max_attempts": 3, "retry_delay": 0.01, "retry_delay_max": 0.01})
+        provider.close(timeout=5)
+        for i in range(4):
+            provider.put_predictions(make_prediction_data(f"model-{i}"))
+        for attempt in range(2):
+            with pytest.raises(Exception):
+                provider.drain()
+        # Third failure: one record at a time, model-1 goes to the dead letters and the rest is delivered
+        assert provider.drain() == 4
+        assert [prediction_data.name for prediction_data in storage.stored] == ["model-0", "model-2", "model-3"]
+        assert provider.dead_count == 1
+        assert [prediction_data.name for prediction_data, _ in provider.dead_letters.read_batch(10)] == ["model-1"]
+        assert provider.spool.pending_bytes() == 0
+        # Three failed batches and four single records
+        assert storage.calls == 7
+
+
+def test_spooling_provider_dead_letters_nothing_during_an_outage():
+    with tempfile.TemporaryDirectory() as working_dir:
+        storage = CollectingPredictionStorageProvider(fail=True)
+        provider = SpoolingPredictionStorageProvider(storage, {"filename": os.path.join(working_dir, "spool.bin"), "batch_size": 10, "max_attempts": 2, "retry_delay": 0.01, "retry_delay_max": 0.01})
+        provider.close(timeout=5)
+        for i in range(3):
+            provider.put_predictions(make_prediction_data(f"model-{i}"))
+        # Every record fails on its own as well, so the storage is down rather than the records bad
+        for attempt in range(4):
+            with pytest.raises(Exception):
+                provider.drain()
+        assert provider.dead_count == 0
+        assert provider.dead_letters.read_batch(10) == []
+        storage.fail = False
+        assert provider.drain() == 3
+        assert [prediction_data.name for prediction_data in storage.stored] == ["model-0", "model-1", "model-2"]
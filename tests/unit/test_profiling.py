@@ -0,0 +1,86 @@
+import os
+import time
+import pstats
+import signal
+import tracemalloc
+from datetime import datetime
+import requests
+from latigo.types import Task
+from latigo.profiling import Profiler
+
+task = Task("ioc project", "model/1", datetime(2019, 11, 1, 12, 0), datetime(2019, 11, 1, 12, 30))
+
+
+def busy(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        sum(range(100))
+
+
+def test_profiler_is_a_no_op_unless_configured():
+    profiler = Profiler(None)
+    profiler.start()
+    assert profiler.task(task) is profiler.task(task)
+    with profiler.task(task):
+        pass
+    profiler.stop()
+    assert profiler.stats() == {"sampling": False, "slow_tasks": 0}
+
+
+def test_slow_tasks_are_captured_with_project_and_model_in_the_name(tmp_path):
+    profiler = Profiler({"directory": str(tmp_path), "slow_task_threshold": "0.05s", "tracemalloc_frames": 5})
+    profiler.start()
+    try:
+        with profiler.task(task):
+            pass
+        assert os.listdir(tmp_path) == []
+        with profiler.task(task):
+            busy(0.1)
+        assert tracemalloc.is_tracing()
+    finally:
+        profiler.stop()
+    assert not tracemalloc.is_tracing()
+    filenames = sorted(os.listdir(tmp_path))
+    assert [os.path.splitext(filename)[1] for filename in filenames] == [".prof", ".tracemalloc"]
+    assert all(filename.endswith(("-ioc_project-model_1.prof", "-ioc_project-model_1.tracemalloc")) for filename in filenames)
+    assert any(function[2] == "busy" for function in pstats.Stats(str(tmp_path / filenames[0])).stats)
+    assert tracemalloc.Snapshot.load(str(tmp_path / filenames[1])).traces
+    assert profiler.stats()["slow_tasks"] == 1
+
+
+def test_signal_opens_a_sampling_window(tmp_path):
+    profiler = Profiler({"directory": str(tmp_path), "signal": "SIGUSR2", "sampling_window": "0.2s", "sampling_interval": 0.005})
+    profiler.start()
+    try:
+        os.kill(os.getpid(), signal.SIGUSR2)
+        busy(0.05)
+        assert profiler.stats()["sampling"]
+        assert not profiler.sample()
+        profiler.sampler.join()
+    finally:
+        profiler.stop()
+    assert signal.getsignal(signal.SIGUSR2) == signal.SIG_DFL
+    with open(profiler.sampler.last_filename) as f:
+        lines = f.read().splitlines()
+    assert any("MainThread;" in line and "busy (test_profiling.py" in line for line in lines)
+    assert all(int(line.rsplit(" ", 1)[1]) > 0 for line in lines)
+
+
+def test_sampling_is_triggered_over_http(tmp_path):
+    assert Profiler({}).http_port is None
+    profiler = Profiler({"directory": str(tmp_path), "sampling_interval": 0.005, "http_port": 0})
+    profiler.start()
+    try:
+        # Only on localhost, and it does not serve metrics
+        assert profiler.server.server.server_address[0] == "127.0.0.1"
+        url = f"http://127.0.0.1:{profiler.server.port}/profile"
+        assert requests.post(f"{url}?seconds=a").status_code == 400
+        assert requests.post(f"{url}?seconds=0.1").status_code == 202
+        assert requests.post(f"{url}?seconds=0.1").status_code == 409
+        assert requests.post(f"http://127.0.0.1:{profiler.server.port}/other").status_code == 404
+        assert requests.get(f"http://127.0.0.1:{profiler.server.port}/metrics").status_code == 404
+        profiler.sampler.join()
+    finally:
+        profiler.stop()
+    assert profiler.server is None
+    assert os.path.exists(profiler.sampler.last_filename)
@@ -0,0 +1,83 @@
+import os
+import asyncio
+import tempfile
+from latigo.rate_limiter import TokenBucketRateLimiter, FileTokenBucketRateLimiter, DevNullRateLimiter, get_rate_limiter, retry_after_seconds
+
+
+def test_token_bucket_burst_then_throttle():
+    rate_limiter = TokenBucketRateLimiter("test", rate=10, burst=5)
+    waits = [rate_limiter.reserve() for _ in range(7)]
+    assert waits[:5] == [0.0] * 5
+    # Reservations queue up behind each other at 1/rate seconds apart
+    assert 0.05 < waits[5] <= 0.1
+    assert 0.15 < waits[6] <= 0.2
+    stats = rate_limiter.stats()
+    assert stats["throttled"] == 2
+    assert stats["throttled_seconds"] > 0.2
+
+
+def test_token_bucket_penalize():
+    rate_limiter = TokenBucketRateLimiter("test", rate=1000)
+    rate_limiter.penalize(5)
+    assert rate_limiter.reserve() > 4
+
+
+def test_token_bucket_async():
+    rate_limiter = TokenBucketRateLimiter("test", rate=1000, burst=1)
+    waited = asyncio.run(rate_limiter.acquire_async())
+    assert waited == 0
+
+
+def test_file_token_bucket_is_shared():
+    with tempfile.TemporaryDirectory() as working_dir:
+        filename = os.path.join(working_dir, "bucket")
+        first = FileTokenBucketRateLimiter("test", rate=1, burst=2, filename=filename)
+        second = FileTokenBucketRateLimiter("test", rate=1, burst=2, filename=filename)
+        assert first.reserve() == 0
+        assert second.reserve() == 0
+        # The shared bucket is now empty for both
+        assert first.reserve() > 0.5
+
+
+def test_file_token_bucket_async_does_not_block_the_event_loop():
+    import fcntl
+    import time
+    import threading
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "bucket")
+        rate_limiter = FileTokenBucketRateLimiter("test", rate=1000, filename=filename)
+        ticks = []
+
+        async def acquire():
+            await rate_limiter.acquire_async()
+            return time.monotonic()
+
+        async def tick():
+            while len(ticks) < 5:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        async def acquire_and_tick():
+            acquired, _ = await asyncio.gather(acquire(), tick())
+            return acquired
+
+        # Another process holds the bucket for a while, the loop keeps ticking meanwhile
+        with open(filename, "a+") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            threading.Timer(0.2, fcntl.flock, (f.fileno(), fcntl.LOCK_UN)).start()
+            acquired = asyncio.run(acquire_and_tick())
+        assert len(ticks) == 5
+        assert ticks[-1] < acquired
+
+
+def test_get_rate_limiter():
+    assert isinstance(get_rate_limiter("test_unlimited"), DevNullRateLimiter)
+    rate_limiter = get_rate_limiter("test_limited", {"rate": 5})
+    assert get_rate_limiter("test_limited") is rate_limiter
+
+
+def test_retry_after_seconds():
+    assert retry_after_seconds({"Retry-After": "7"}) == 7
+    assert retry_after_seconds({}, default=3) == 3
+    assert retry_after_seconds({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}) == 0
@@ -0,0 +1,69 @@
+import time
+import asyncio
+from datetime import timedelta
+from latigo.utils import Timer
+from latigo.scheduler import Scheduler
+from latigo.scheduler.timing import DeadlineHeap, model_phase, phase_delay
+
+
+def test_deadline_heap_pops_due_keys_in_order():
+    deadlines = DeadlineHeap()
+    for number in range(10000):
+        deadlines.schedule(("project", f"model-{number}"), float(number % 100))
+    assert len(deadlines) == 10000
+    assert deadlines.next_deadline() == 0.0
+    due = deadlines.pop_due(1.5)
+    assert len(due) == 200
+    assert [deadline for deadline, _ in due] == sorted(deadline for deadline, _ in due)
+    assert deadlines.next_deadline() == 2.0
+    assert len(deadlines) == 9800
+
+
+def test_deadline_heap_reschedule_and_cancel():
+    deadlines = DeadlineHeap()
+    deadlines.schedule("a", 1.0)
+    deadlines.schedule("b", 2.0)
+    deadlines.schedule("a", 3.0)
+    deadlines.cancel("b")
+    assert deadlines.next_deadline() == 3.0
+    assert deadlines.pop_due(2.5) == []
+    assert deadlines.pop_due(3.0) == [(3.0, "a")]
+    assert len(deadlines) == 0
+    assert deadlines.next_deadline() is None
+
+
+def test_timer_waits_for_remaining_interval():
+    timer = Timer(timedelta(seconds=0.2))
+    assert timer.is_triggered()
+    timer.start(time.monotonic() - 0.15)
+    assert not timer.is_triggered()
+    assert timedelta(0) < timer.remaining() <= timedelta(seconds=0.05)
+    started = time.monotonic()
+    asyncio.run(timer.wait_for_trigger())
+    assert time.monotonic() - started < 0.15
+    assert timer.is_triggered()
+
+
+def test_model_phases_spread_emission_evenly():
+    interval = 1800.0
+    wall_now = 1572609600.0
+    buckets = [0] * 10
+    for number in range(10000):
+        phase = model_phase("project", f"model-{number}")
+        assert phase == model_phase("project", f"model-{number}")
+        delay = phase_delay(wall_now, interval, phase)
+        assert 0 <= delay < interval
+        # Emission times land on the same phase of every interval
+        assert abs((wall_now + delay) % interval - phase * interval) < 1e-3
+        buckets[int(delay / interval * 10)] += 1
+    assert max(buckets) < 1.2 * min(buckets)
+
+
+def test_fractional_task_rate_still_emits():
+    scheduler = Scheduler({"task_queue": {"type": None}, "model_info": {"type": "synthetic", "model_count": 10, "project_count": 1}, "scheduler": {"continuous_prediction_interval": "1m", "max_task_rate": 0.5}})
+    assert scheduler._emit_budget(0.0) == 1
+    scheduler.emit_tokens -= 1
+    assert scheduler._emit_budget(1.0) == 0
+    assert scheduler._emit_budget(2.0) == 1
+    # A long idle spell does not bank more than one task
+    assert scheduler._emit_budget(100.0) == 1
@@ -0,0 +1,90 @@
+import threading
+from latigo.session import PooledSession
+from tests.load.pipeline import StandInServer
+
+
+class ConnectionCountingServer(StandInServer):
+    def __init__(self):
+        super().__init__()
+        self.clients: set = set()
+        process_request = self.server.process_request
+
+        def counting_process_request(request, client_address):
+            with self.lock:
+                self.clients.add(client_address)
+            process_request(request, client_address)
+
+        self.server.process_request = counting_process_request
+
+    def handle(self, method, path, query, body):
+        return 200, {}
+
+
+def request_concurrently(pooled_session, url, thread_count, request_count):
+    statuses = []
+    barrier = threading.Barrier(thread_count)
+
+    def worker():
+        barrier.wait()
+        for _ in range(request_count):
+            statuses.append(pooled_session.get(url).status_code)
+
+    threads = [threading.Thread(target=worker) for _ in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses
+
+
+def test_pooled_session_per_thread():
+    pooled_session = PooledSession({"pool_maxsize": 64})
+    sessions = []
+
+    def worker():
+        sessions.append(pooled_session.session)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(id(session) for session in sessions)) == 4
+    assert pooled_session.session is pooled_session.session
+    pooled_session.close()
+    assert pooled_session.sessions == {}
+
+
+def test_pooled_session_closes_sessions_of_ended_threads():
+    pooled_session = PooledSession()
+    for _ in range(10):
+        thread = threading.Thread(target=lambda: pooled_session.session)
+        thread.start()
+        thread.join()
+    ended_session = pooled_session.sessions[thread]
+    assert pooled_session.session is not ended_session
+    assert list(pooled_session.sessions.keys()) == [threading.current_thread()]
+    pooled_session.close()
+
+
+def test_pooled_session_reuses_connections():
+    with ConnectionCountingServer() as server:
+        for config in [{"pool_maxsize": 4}, {"per_thread": False, "pool_maxsize": 4}]:
+            server.clients.clear()
+            pooled_session = PooledSession(config)
+            statuses = request_concurrently(pooled_session, f"{server.base_url}/ping", 4, 10)
+            pooled_session.close()
+            assert statuses == [200] * 40
+            # Four threads at a time never need more than four connections
+            assert len(server.clients) <= 4
+
+
+def test_pooled_session_shared():
+    pooled_session = PooledSession({"per_thread": False, "keep_alive": False, "connect_timeout": 1, "read_timeout": 2})
+    sessions = []
+    thread = threading.Thread(target=lambda: sessions.append(pooled_session.session))
+    thread.start()
+    thread.join()
+    assert sessions[0] is pooled_session.session
+    assert pooled_session.session.headers["Connection"] == "close"
+    assert pooled_session.timeout == (1.0, 2.0)
@@ -0,0 +1,49 @@
+import time
+import threading
+import pytest
+from latigo.single_flight import SingleFlight
+
+
+def test_concurrent_identical_calls_share_one_execution():
+    single_flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fetch(key):
+        calls.append(key)
+        started.set()
+        release.wait(5)
+        return f"result-{key}"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(single_flight.do("tag", fetch, "tag")))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(single_flight.do("tag", fetch, "tag"))) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    deadline = time.monotonic() + 5
+    while single_flight.stats()["shared"] < 3 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    assert single_flight.stats()["shared"] == 3, "followers never joined the leader's call"
+    for thread in [leader] + followers:
+        thread.join()
+    assert calls == ["tag"]
+    assert results == ["result-tag"] * 4
+    assert single_flight.stats() == {"name": "single_flight", "executed": 1, "shared": 3, "in_flight": 0}
+    # Nothing is cached after the call completes
+    single_flight.do("tag", fetch, "tag")
+    assert len(calls) == 2
+
+
+def test_errors_are_shared_and_not_cached():
+    single_flight = SingleFlight()
+
+    def fail():
+        raise IOError("upstream down")
+
+    with pytest.raises(IOError):
+        single_flight.do("key", fail)
+    assert single_flight.do("key", lambda: 42) == 42
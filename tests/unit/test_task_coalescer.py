@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+from latigo.types import Task
+from latigo.executor.coalescer import TaskCoalescer
+
+start = datetime(2019, 11, 1, 12, 0)
+
+
+def make_task(model_name, from_minutes, to_minutes):
+    return Task("project", model_name, start + timedelta(minutes=from_minutes), start + timedelta(minutes=to_minutes))
+
+
+def test_overlapping_and_adjacent_windows_are_merged():
+    coalescer = TaskCoalescer({"hold_time": "5s"})
+    coalescer.add(make_task("a", 0, 30), now=0)
+    coalescer.add(make_task("a", 20, 50), now=1)
+    coalescer.add(make_task("a", 50, 60), now=2)
+    coalescer.add(make_task("b", 0, 30), now=3)
+    assert coalescer.pop_ready(now=4) == []
+    assert coalescer.next_deadline() == 5
+    ready = coalescer.pop_ready(now=5)
+    assert ready == [make_task("a", 0, 60)]
+    assert coalescer.merged_count == 2
+    assert coalescer.pop_ready(now=6, flush=True) == [make_task("b", 0, 30)]
+    assert len(coalescer) == 0
+
+
+def test_disjoint_and_oversized_windows_are_kept_apart():
+    coalescer = TaskCoalescer({"max_window": "45m"})
+    coalescer.add(make_task("a", 0, 30), now=0)
+    coalescer.add(make_task("a", 40, 50), now=0)
+    # Merging with the first window would exceed max_window, so it joins the second one instead
+    coalescer.add(make_task("a", 20, 60), now=0)
+    assert coalescer.pop_ready(now=0) == [make_task("a", 0, 30), make_task("a", 20, 60)]
+
+
+def test_completed_windows_are_dropped():
+    coalescer = TaskCoalescer({"max_models": 1})
+    coalescer.mark_completed(make_task("a", 0, 30))
+    assert not coalescer.add(make_task("a", 0, 30))
+    assert not coalescer.add(make_task("a", 10, 20))
+    assert coalescer.add(make_task("a", 10, 40))
+    assert coalescer.dropped_count == 2
+    # The completed index is bounded, evicting the least recently completed model
+    coalescer.mark_completed(make_task("b", 0, 30))
+    assert coalescer.add(make_task("a", 0, 30))
+
+
+def test_forget_drops_completed_windows():
+    coalescer = TaskCoalescer()
+    coalescer.mark_completed(make_task("a", 0, 30))
+    coalescer.forget([("project", "a"), ("project", "unknown")])
+    assert coalescer.add(make_task("a", 0, 30))
+
+
+def test_stale_tasks_merge_across_gaps():
+    coalescer = TaskCoalescer({"max_window": "2h"})
+    coalescer.add(make_task("a", 0, 30), now=0, stale=True)
+    coalescer.add(make_task("a", 60, 90), now=0, stale=True)
+    coalescer.add(make_task("a", 200, 230), now=0, stale=True)
+    assert coalescer.pop_ready(now=0) == [make_task("a", 0, 90), make_task("a", 200, 230)]
+
+
+def test_merged_task_keeps_trace_of_first_task():
+    coalescer = TaskCoalescer({"hold_time": "5s"})
+    coalescer.add(make_task("a", 0, 30).traced("first", 1000), now=0)
+    coalescer.add(make_task("a", 30, 60).traced("second", 2000), now=1)
+    ready = coalescer.pop_ready(now=5)
+    assert ready == [make_task("a", 0, 60)]
+    assert (ready[0].trace_id, ready[0].enqueued_us) == ("first", 1000)
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+from latigo.types import Task
+from latigo.task_queue import task_partition_key, PartitionAssignmentListenerInterface
+
+start = datetime(2019, 11, 1, 12, 0)
+
+
+def test_task_partition_key():
+    task = Task("project", "model", start, start + timedelta(minutes=30))
+    assert task_partition_key(task) == b"project/model"
+    assert task_partition_key(task.replace(from_time=start + timedelta(minutes=10))) == b"project/model"
+    assert task_partition_key(task, "model") == b"model"
+    assert task_partition_key(task, "project") == b"project"
+    assert task_partition_key(task, None) is None
+    assert task_partition_key(task, "none") is None
+
+
+class RecordingAssignmentListener(PartitionAssignmentListenerInterface):
+    def __init__(self):
+        self.calls = []
+
+    def on_partitions_assigned(self, partitions, model_keys):
+        self.calls.append(("assigned", sorted(partitions), model_keys))
+
+    def on_partitions_revoked(self, partitions, model_keys):
+        self.calls.append(("revoked", sorted(partitions), model_keys))
+
+
+def test_kafka_receiver_tracks_models_per_assigned_partition():
+    from confluent_kafka import TopicPartition
+    from latigo.task_queue.kafka import KafkaTaskQueueReceiver
+
+    connection_string = "Endpoint=sb://localhost/;SharedAccessKeyName=executor;SharedAccessKey=c2VjcmV0=;EntityPath=latigo_topic"
+    config = {"connection_string": connection_string, "security.protocol": "SASL_PLAINTEXT", "sasl.mechanism": "PLAIN", "group.id": "test", "client.id": "executor", "request.timeout.ms": 10000, "session.timeout.ms": 10000, "default.topic.config": {}, "debug": "consumer", "enable.auto.commit": True, "auto.commit.interval.ms": 1000}
+    receiver = KafkaTaskQueueReceiver(config)
+    listener = RecordingAssignmentListener()
+    receiver.set_assignment_listener(listener)
+    partitions = lambda *numbers: [TopicPartition("latigo_topic", number) for number in numbers]
+    receiver._on_assign(None, partitions(0, 1))
+    receiver._track_model(0, Task("project", "a"))
+    receiver._track_model(1, Task("project", "b"))
+    receiver._track_model(2, Task("project", "c"))
+    assert receiver.models_by_partition == {0: {("project", "a")}, 1: {("project", "b")}}
+    # An eager rebalance takes everything away and gives partition 1 back
+    receiver._on_revoke(None, partitions(0, 1))
+    assert receiver.models_by_partition == {}
+    receiver._on_assign(None, partitions(1, 3))
+    assert receiver.models_by_partition == {1: {("project", "b")}}
+    assert receiver.revoked_models_by_partition == {}
+    assert listener.calls == [("assigned", [0, 1], set()), ("revoked", [0, 1], {("project", "a"), ("project", "b")}), ("assigned", [1, 3], {("project", "b")})]
+    receiver.consumer.close()
+    receiver.consumer = None
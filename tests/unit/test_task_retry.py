@@ -0,0 +1,79 @@
+import time
+from datetime import datetime, timedelta
+from latigo.types import Task
+from latigo.task_queue import TaskQueueReceiverInterface
+from latigo.task_queue.retry import RetryingTaskQueueReceiver, RetryPolicy
+from latigo.executor import PredictionExecutor
+
+start = datetime(2019, 11, 1, 12, 0)
+
+
+def make_task(model_name, from_minutes, to_minutes):
+    return Task("project", model_name, start + timedelta(minutes=from_minutes), start + timedelta(minutes=to_minutes))
+
+
+class ListReceiver(TaskQueueReceiverInterface):
+    def __init__(self, tasks):
+        self.tasks = list(tasks)
+
+    def get_task(self, timeout=None):
+        return self.tasks.pop(0) if self.tasks else None
+
+
+def make_receiver(tmpdir, tasks, **config):
+    return RetryingTaskQueueReceiver(ListReceiver(tasks), {"initial_delay": "0s", "jitter": 0, "state_file": str(tmpdir.join("state.json")), "dead_letter_file": str(tmpdir.join("dead.jsonl")), **config})
+
+
+def test_retry_policy_backs_off_exponentially():
+    policy = RetryPolicy({"initial_delay": "10s", "max_delay": "1m", "multiplier": 2, "jitter": 0})
+    assert [policy.delay(attempt) for attempt in range(1, 6)] == [10, 20, 40, 60, 60]
+
+
+def test_failed_tasks_are_redelivered_then_dead_lettered(tmpdir):
+    task = make_task("a", 0, 30)
+    receiver = make_receiver(tmpdir, [task], max_attempts=3)
+    for attempt in range(3):
+        assert receiver.get_task() == task
+        receiver.task_failed(task, Exception(f"boom {attempt}"))
+    assert receiver.get_task() is None
+    assert receiver.stats() == {"delayed": 0, "in_flight": 0, "retried": 2, "dead": 1}
+    [dead] = list(receiver.dead_letters.entries())
+    assert Task.from_dict(dead["task"]) == task
+    assert dead["attempts"] == 3
+    assert [error["message"] for error in dead["errors"]] == ["boom 0", "boom 1", "boom 2"]
+
+
+def test_retries_wait_for_backoff_and_survive_restart(tmpdir, monkeypatch):
+    task = make_task("a", 0, 30)
+    receiver = make_receiver(tmpdir, [task], initial_delay="1h")
+    receiver.get_task()
+    receiver.task_failed(task, Exception("boom"))
+    assert receiver.get_task() is None
+    restarted = make_receiver(tmpdir, [], initial_delay="1h")
+    assert restarted.pending_count() == 1
+    due = restarted.next_due()
+    monkeypatch.setattr(time, "time", lambda: due)
+    assert restarted.get_task() == task
+    # Succeeding with a wider, merged window clears the retry
+    restarted.task_succeeded(make_task("a", 0, 60))
+    assert restarted.stats()["in_flight"] == 0
+
+
+def test_retries_the_executor_drops_are_released(tmpdir):
+    executor = PredictionExecutor({"task_queue": {"type": "devnull"}, "sensor_data": {"type": "mock"}, "prediction_storage": {"type": "mock"}, "predictor": {"type": "mock"}})
+    task = make_task("a", 0, 30)
+    executor.task_queue = receiver = make_receiver(tmpdir, [task])
+    receiver.task_failed(receiver.get_task(), Exception("boom"))
+    # A wider task covering the failed window succeeds before the retry comes back, so the retry is a duplicate
+    executor.task_coalescer.mark_completed(make_task("a", 0, 60))
+    executor._accept_task(receiver.get_task())
+    assert len(executor.task_coalescer) == 0
+    assert receiver.stats()["in_flight"] == 0
+    assert make_receiver(tmpdir, []).pending_count() == 0
+    # Same for a retry skipped as stale
+    receiver.task_failed(task.replace(model_name="b"), Exception("boom"))
+    executor.max_task_age = 60
+    executor._accept_task(receiver.get_task())
+    assert executor.stale_skipped_count == 1
+    assert receiver.stats()["in_flight"] == 0
+    assert make_receiver(tmpdir, []).pending_count() == 0
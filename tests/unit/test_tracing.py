@@ -0,0 +1,82 @@
+import json
+import asyncio
+from datetime import datetime
+from latigo.types import Task
+from latigo import tracing
+from latigo.tracing import Tracer, RingBufferSpanExporter, JsonlSpanExporter, DevNullSpanExporter, span_exporter_factory
+
+task = Task("project", "model", datetime(2019, 11, 1, 12, 0), datetime(2019, 11, 1, 12, 30))
+
+
+def test_spans_are_recorded_for_traced_tasks_only():
+    exporter = RingBufferSpanExporter({"capacity": 3})
+    tracer = Tracer(exporter)
+    traced = task.traced(tracing.new_trace_id(), 1572609600000000)
+    tracer.record(traced, "queue_wait", traced.enqueued_us, 0.5)
+    with tracer.span(traced, "fetch", rows=10):
+        pass
+    with tracer.span(task, "fetch"):
+        pass
+    assert [span.name for span in exporter.spans(traced.trace_id)] == ["queue_wait", "fetch"]
+    fetch = exporter.spans()[-1].to_dict()
+    assert fetch["project_name"] == "project" and fetch["model_name"] == "model" and fetch["rows"] == 10
+    assert fetch["duration"] >= 0
+    for _ in range(3):
+        tracer.record(traced, "store", 0, 0.1)
+    assert [span.name for span in exporter.spans()] == ["store"] * 3
+
+
+def test_failing_block_is_marked_on_its_span():
+    exporter = RingBufferSpanExporter({})
+    tracer = Tracer(exporter)
+    try:
+        with tracer.span(task.traced("trace", None), "predict"):
+            raise ValueError("no")
+    except ValueError:
+        pass
+    assert exporter.spans("trace")[0].attributes["error"] == "ValueError"
+
+
+def test_module_span_follows_activation_into_coroutines():
+    exporter = RingBufferSpanExporter({})
+    tracer = Tracer(exporter)
+    traced = task.traced("trace", None)
+
+    async def chunk(number):
+        with tracing.span("gordo_chunk", chunk=number):
+            await asyncio.sleep(0)
+
+    async def chunks():
+        await asyncio.gather(*[chunk(number) for number in range(3)])
+
+    loop = asyncio.new_event_loop()
+    try:
+        with tracer.activate(traced):
+            loop.run_until_complete(chunks())
+        loop.run_until_complete(chunks())
+    finally:
+        loop.close()
+    assert sorted(span.attributes["chunk"] for span in exporter.spans("trace")) == [0, 1, 2]
+    assert len(exporter.spans()) == 3
+
+
+def test_jsonl_exporter_appends_one_line_per_span(tmp_path):
+    filename = str(tmp_path / "spans" / "spans.jsonl")
+    tracer = Tracer(span_exporter_factory({"type": "jsonl", "filename": filename}))
+    assert isinstance(tracer.exporter, JsonlSpanExporter)
+    traced = task.traced("trace", 1572609600000000)
+    tracer.record(traced, "queue_wait", traced.enqueued_us, 0.25)
+    tracer.record(traced, "store", traced.enqueued_us + 1000000, 0.5)
+    tracer.close()
+    with open(filename) as f:
+        spans = [json.loads(line) for line in f]
+    assert [(span["name"], span["start_time"], span["duration"]) for span in spans] == [("queue_wait", 1572609600.0, 0.25), ("store", 1572609601.0, 0.5)]
+
+
+def test_tracing_is_off_without_exporter():
+    tracer = Tracer(span_exporter_factory(None))
+    assert isinstance(tracer.exporter, DevNullSpanExporter)
+    assert not tracer.enabled
+    with tracer.activate(task.traced("trace", None)):
+        with tracing.span("gordo_chunk"):
+            pass
@@ -0,0 +1,53 @@
+import pickle
+from datetime import datetime, timedelta, timezone
+import pytest
+from latigo.types import Task, TimeRange
+from latigo.task_queue import serialize_task, deserialize_task
+
+
+def test_time_range_is_canonical_utc():
+    naive = TimeRange(datetime(2019, 11, 1, 12, 0), datetime(2019, 11, 1, 12, 30))
+    aware = TimeRange(datetime(2019, 11, 1, 13, 0, tzinfo=timezone(timedelta(hours=1))), datetime(2019, 11, 1, 12, 30, tzinfo=timezone.utc))
+    assert naive == aware
+    assert hash(naive) == hash(aware)
+    assert naive.rfc3339_from() == "2019-11-01T12:00:00Z"
+    assert naive.rfc3339_to() == "2019-11-01T12:30:00Z"
+    assert naive.duration() == timedelta(minutes=30)
+    assert naive.from_time == datetime(2019, 11, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def test_task_is_immutable_and_hashable():
+    from_time = datetime(2019, 11, 1, 12, 0, 0, 123456)
+    task = Task("project", "model", from_time, from_time + timedelta(minutes=30))
+    with pytest.raises(AttributeError):
+        task.model_name = "other"
+    assert task.time_range.rfc3339_from() == "2019-11-01T12:00:00.123456Z"
+    duplicate = Task(project_name="project", model_name="model", from_time=from_time, to_time=from_time + timedelta(minutes=30))
+    assert len({task, duplicate}) == 1
+    assert task.replace(model_name="other") != task
+
+
+def test_task_defaults_are_evaluated_per_task():
+    before = datetime.now(timezone.utc)
+    task = Task("null")
+    assert task.to_time >= before
+    assert task.time_range.duration() == timedelta(seconds=20)
+
+
+def test_task_serialization_round_trip():
+    task = Task("project", "model", datetime(2019, 11, 1, 12, 0), datetime(2019, 11, 1, 12, 30))
+    assert deserialize_task(serialize_task(task)) == task
+    assert deserialize_task(serialize_task(task, mode="pickle"), mode="pickle") == task
+    assert pickle.loads(pickle.dumps(task.time_range)) == task.time_range
+    # Tasks encoded by dataclasses_json carry epoch seconds
+    assert Task.from_json('{"project_name": "project", "model_name": "model", "from_time": 1572609600.0, "to_time": 1572611400.0}') == task
+    assert Task.from_json('{"project_name": "project", "model_name": "model", "from_time": "2019-11-01T12:00:00Z", "to_time": "2019-11-01T12:30:00Z"}') == task
+
+
+def test_task_trace_survives_serialization_but_not_equality():
+    task = Task("project", "model", datetime(2019, 11, 1, 12, 0), datetime(2019, 11, 1, 12, 30))
+    traced = task.traced("abc123", 1572609600500000)
+    assert traced == task and hash(traced) == hash(task)
+    assert task.trace_id is None and "trace_id" not in task.to_dict()
+    for copy in [deserialize_task(serialize_task(traced)), deserialize_task(serialize_task(traced, mode="pickle"), mode="pickle"), traced.replace(model_name="model")]:
+        assert (copy.trace_id, copy.enqueued_us) == ("abc123", 1572609600500000)
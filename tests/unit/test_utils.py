@@ -1,6 +1,6 @@
 import pprint
 import os
-from latigo.utils import merge, load_config, load_yaml, save_yaml
+from latigo.utils import merge, load_config, load_yaml, save_yaml, parse_event_hub_connection_string
 
 # TODO: Actually manage this
 writable_working_dir="/tmp/"
@@ -108,3 +108,10 @@ def test_load_config():
     if os.path.exists(config_filename):
         os.remove(config_filename)
     assert config == expected
+
+
+def test_parse_event_hub_connection_string():
+    parts = parse_event_hub_connection_string("Endpoint=sb://latigo.servicebus.windows.net/;SharedAccessKeyName=scheduler;SharedAccessKey=c2VjcmV0=;EntityPath=latigo_topic")
+    assert parts == {"endpoint": "latigo.servicebus.windows.net", "shared_access_key_name": "scheduler", "shared_access_key": "c2VjcmV0=", "entity_path": "latigo_topic"}
+    assert parse_event_hub_connection_string("Endpoint=nothing") is None
+    assert parse_event_hub_connection_string("") is None